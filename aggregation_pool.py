@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+集計処理のプロセスプール実行
+
+_count_events_from_data と _create_time_blocks のカウント処理は純粋なPythonのCPU処理で、
+フレーム数の多い日はイベントループを長時間ブロックする。
+SED_POOL_WORKERS を設定すると、一定以上のフレーム数の日の集計（aggregate_data）を
+ProcessPoolExecutor のワーカープロセスで実行する。
+
+- ワーカー数はコンテナに割り当てられたCPU数（sched_getaffinity）を上限とする
+- スロットデータは親プロセスで1回だけpickle化したbytesとして渡す
+- ルールはソース（dict）を渡し、ワーカー側でコンパイル済みルールをキャッシュする
+- ワーカー内のステージ所要時間・カウンターは結果と一緒に返し、親プロセスのフックに通知する
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from log_config import fields
+
+logger = logging.getLogger(__name__)
+
+# ワーカー数（0で無効、auto で割り当てCPU数）
+POOL_WORKERS = os.getenv('SED_POOL_WORKERS', '0')
+# このフレーム数以上の日だけプロセスプールで集計する（小さい日はプロセス間通信の方が高コスト）
+POOL_MIN_FRAMES = int(os.getenv('SED_POOL_MIN_FRAMES', '5000'))
+
+# ワーカーが返す計測値
+StageRecord = Tuple[str, float]
+CounterRecord = Tuple[str, float, Dict[str, str]]
+
+
+def available_cpus() -> int:
+    """このプロセスが使用できるCPU数（コンテナのCPU制限を反映）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def count_frames(slot_data: Dict[str, List[Dict]]) -> int:
+    """スロットデータに含まれるフレーム数"""
+    return sum(len(frames) for frames in slot_data.values() if frames)
+
+
+# ==================== ワーカープロセス側 ====================
+
+_worker_aggregator = None
+_worker_rules: Tuple[Optional[Dict[str, Any]], Any] = (None, None)
+_stages: List[StageRecord] = []
+_counters: List[CounterRecord] = []
+
+
+def _init_worker() -> None:
+    """ワーカー起動時に集計クライアントを作成（保存先は使わないためメモリ）"""
+    global _worker_aggregator
+    from sed_aggregator import SEDAggregator
+    from storage import MemoryStorage
+
+    SEDAggregator.stage_hooks.append(lambda stage, seconds: _stages.append((stage, seconds)))
+    SEDAggregator.counter_hooks.append(lambda name, amount, labels: _counters.append((name, amount, labels)))
+    _worker_aggregator = SEDAggregator(MemoryStorage())
+
+
+def _worker_rules_for(source: Dict[str, Any]):
+    """ルールソースからコンパイル済みルールを取得（同じソースなら再利用）"""
+    global _worker_rules
+    from sed_rules import compile_rules
+
+    cached_source, cached_rules = _worker_rules
+    if cached_source != source:
+        cached_rules = compile_rules(source)
+        _worker_rules = (source, cached_rules)
+    return cached_rules
+
+
+def _aggregate_in_worker(payload: bytes, rules_source: Dict[str, Any]) -> Tuple[Dict, List[StageRecord], List[CounterRecord]]:
+    """ワーカーでの集計（結果と計測値を返す）"""
+    _stages.clear()
+    _counters.clear()
+    slot_data = pickle.loads(payload)
+    result = _worker_aggregator.aggregate_data(slot_data, _worker_rules_for(rules_source))
+    return result, list(_stages), list(_counters)
+
+
+# ==================== 親プロセス側 ====================
+
+class AggregationPool:
+    """aggregate_data をワーカープロセスで実行するプール"""
+
+    def __init__(self, workers: Optional[int] = None, min_frames: int = POOL_MIN_FRAMES):
+        """
+        Args:
+            workers: ワーカー数（省略時は割り当てCPU数）
+            min_frames: プロセスプールで集計する最小フレーム数
+        """
+        self.workers = min(workers or available_cpus(), available_cpus())
+        self.min_frames = min_frames
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def should_offload(self, slot_data: Dict[str, List[Dict]]) -> bool:
+        """プロセスプールで集計するか"""
+        return count_frames(slot_data) >= self.min_frames
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # uvicornのスレッドを引き継がないよう spawn で起動する
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker
+            )
+            logger.info("集計プロセスプール起動", extra=fields(workers=self.workers, min_frames=self.min_frames))
+        return self._executor
+
+    async def aggregate(self, slot_data: Dict[str, List[Dict]],
+                        rules_source: Dict[str, Any]) -> Tuple[Dict, List[StageRecord], List[CounterRecord]]:
+        """ワーカープロセスで集計（結果, ステージ所要時間, カウンター）"""
+        payload = pickle.dumps(slot_data, protocol=pickle.HIGHEST_PROTOCOL)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), _aggregate_in_worker, payload, rules_source)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def create_pool(workers: Optional[str] = None) -> Optional[AggregationPool]:
+    """環境変数 SED_POOL_WORKERS からプールを作成（0・未設定の場合はNone）"""
+    value = (workers if workers is not None else POOL_WORKERS).strip().lower()
+    if value in ('', '0'):
+        return None
+    if value == 'auto':
+        return AggregationPool()
+    return AggregationPool(int(value))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+デバイスごとのベースラインによる異常検出
+
+time_blocks の各スロット・ラベルの出現回数（と1日の合計）を、そのデバイスの過去の傾向
+（指数移動平均による平均・分散）と比較し、統計的に珍しい回数をフラグとして返す。
+
+- ベースラインは1日分の集計ごとに更新する（過去の集計結果を読み直さない）。
+  更新はその日のラベル数 × スロット数に比例する
+- ベースラインは {ラベル: {スロット: [平均, 分散, 日数]}} の形で保存し、
+  平均がほぼ0まで減衰したエントリは削除する
+- データのないスロット（None）はその日の観測に含めない
+
+環境変数:
+    SED_ANOMALY_DETECTION  異常検出を行う（デフォルト: 0、1で有効。audio_aggregator_baselines テーブルが必要）
+    SED_ANOMALY_ALPHA      指数移動平均の平滑化係数（デフォルト: 0.1、半減期は約7日）
+    SED_ANOMALY_Z          フラグとするzスコアの絶対値（デフォルト: 3.0）
+    SED_ANOMALY_MIN_DAYS   判定に必要な観測日数（デフォルト: 7）
+    SED_ANOMALY_MIN_COUNT  回数・平均のどちらもこの値未満なら判定しない（デフォルト: 3）
+"""
+
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+ANOMALY_DETECTION = os.getenv('SED_ANOMALY_DETECTION', '0').lower() not in ('0', 'false', 'no')
+
+# 1日の合計を表すスロット名
+DAY = "day"
+
+# 平均がこの値を下回り、その日の観測が0のエントリは削除する
+_PRUNE_BELOW = 0.01
+
+# 分散がほぼ0（毎日同じ回数）でもzスコアが発散しないよう、標準偏差の下限（回数）
+_MIN_STD = 1.0
+
+# {ラベル: {スロット: [平均, 分散, 日数]}}
+BaselineStats = Dict[str, Dict[str, List[float]]]
+
+
+def _observations(time_blocks: Dict[str, Optional[List[Dict[str, Any]]]]) -> Tuple[List[str], Dict[str, Dict[str, int]]]:
+    """データのあるスロットと、ラベル → スロット → 回数（1日の合計を含む）"""
+    slots = [slot for slot, events in time_blocks.items() if events is not None]
+    counts: Dict[str, Dict[str, int]] = {}
+    for slot in slots:
+        for item in time_blocks[slot]:
+            by_slot = counts.setdefault(item["event"], {})
+            by_slot[slot] = item["count"]
+            by_slot[DAY] = by_slot.get(DAY, 0) + item["count"]
+    return slots, counts
+
+
+class AnomalyDetector:
+    """指数移動平均・分散のベースラインと比較して異常な回数を検出する"""
+
+    def __init__(self, alpha: Optional[float] = None, z_threshold: Optional[float] = None,
+                 min_days: Optional[int] = None, min_count: Optional[float] = None, max_flags: int = 20):
+        """
+        Args:
+            alpha: 平滑化係数（大きいほど直近の日を重視）
+            z_threshold: フラグとするzスコアの絶対値
+            min_days: 判定に必要な観測日数
+            min_count: 回数・平均のどちらもこの値未満なら判定しない
+            max_flags: 返すフラグの最大数（zスコアの絶対値が大きい順）
+        """
+        self.alpha = alpha if alpha is not None else float(os.getenv('SED_ANOMALY_ALPHA', '0.1'))
+        self.z_threshold = z_threshold if z_threshold is not None else float(os.getenv('SED_ANOMALY_Z', '3.0'))
+        self.min_days = min_days if min_days is not None else int(os.getenv('SED_ANOMALY_MIN_DAYS', '7'))
+        self.min_count = min_count if min_count is not None else float(os.getenv('SED_ANOMALY_MIN_COUNT', '3'))
+        self.max_flags = max_flags
+
+    def _score(self, label: str, slot: str, count: int, stats: Optional[List[float]]) -> Optional[Dict[str, Any]]:
+        """更新前のベースラインと比較し、異常ならフラグを返す"""
+        if stats is None:
+            mean, var, days = 0.0, 0.0, 0
+        else:
+            mean, var, days = stats
+        if days < self.min_days or max(count, mean) < self.min_count:
+            return None
+        z = (count - mean) / max(math.sqrt(var), _MIN_STD)
+        if abs(z) < self.z_threshold:
+            return None
+        return {
+            "event": label,
+            "slot": slot,
+            "count": count,
+            "expected": round(mean, 2),
+            "z": round(z, 2),
+            "direction": "high" if z > 0 else "low",
+        }
+
+    def _update(self, stats: Optional[List[float]], count: int) -> Optional[List[float]]:
+        """1日分の観測でベースラインを更新（削除する場合はNone）"""
+        if stats is None:
+            # 初回は観測値を平均とする
+            return [float(count), 0.0, 1]
+        mean, var, days = stats
+        diff = count - mean
+        increment = self.alpha * diff
+        mean += increment
+        var = (1 - self.alpha) * (var + diff * increment)
+        if count == 0 and mean < _PRUNE_BELOW:
+            return None
+        return [round(mean, 4), round(var, 4), int(days) + 1]
+
+    def evaluate(self, baseline: BaselineStats,
+                 time_blocks: Dict[str, Optional[List[Dict[str, Any]]]]) -> Tuple[List[Dict[str, Any]], BaselineStats]:
+        """time_blocksをベースラインと比較し、(フラグ, 更新後のベースライン) を返す（baselineは変更しない）"""
+        slots, counts = _observations(time_blocks)
+        observed = slots + [DAY] if slots else []
+        flags: List[Dict[str, Any]] = []
+        updated: BaselineStats = {}
+
+        # ラベル順に処理し、同じzスコアのフラグもハッシュシードによらず同じ順にする（result_hashに含まれるため）
+        for label in sorted(set(baseline) | set(counts)):
+            previous = baseline.get(label, {})
+            today = counts.get(label, {})
+            entries = {slot: stats for slot, stats in previous.items() if slot not in observed}
+            for slot in observed:
+                count = today.get(slot, 0)
+                stats = previous.get(slot)
+                if stats is None and count == 0:
+                    continue
+                flag = self._score(label, slot, count, stats)
+                if flag is not None:
+                    flags.append(flag)
+                new_stats = self._update(stats, count)
+                if new_stats is not None:
+                    entries[slot] = new_stats
+            if entries:
+                updated[label] = entries
+
+        flags.sort(key=lambda flag: (-abs(flag["z"]), flag["event"], flag["slot"]))
+        return flags[:self.max_flags], updated
+
+
+def create_detector() -> Optional[AnomalyDetector]:
+    """環境変数 SED_ANOMALY_DETECTION に応じて検出器を作成（無効の場合はNone）"""
+    return AnomalyDetector() if ANOMALY_DETECTION else None
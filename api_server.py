@@ -4,25 +4,59 @@ SED集計・アップロードAPI サーバー
 
 FastAPIを使用してSED分析機能をREST APIとして提供する。
 ダッシュボードやWebアプリケーションから呼び出し可能。
+
+起動を速くするため、supabaseクライアント・プロセスプールは起動後にバックグラウンドで作成し（GET /ready で確認）、
+一括分析・再集計でのみ使うモジュールは各エンドポイントで読み込む。
 """
 
-from fastapi import FastAPI, BackgroundTasks, HTTPException
+from collections import Counter
+from fastapi import FastAPI, BackgroundTasks, Header, HTTPException, Query
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Set
+import asyncio
+import math
 import uuid
 import json
 import os
+import threading
+import time
 from datetime import datetime
 import logging
 
+from dotenv import load_dotenv
+
+# 環境変数を読み込み（各モジュールがimport時に設定値を読むため、最初に行う）
+load_dotenv()
+
+import localization
+import metrics
+import profiles
+from compression import CompressionMiddleware
+import serialization
+from coalescer import Debouncer
+from rate_limit import create_rate_limiter
+from log_config import bind_task, configure_logging, fields, record_stage, stage_durations
+from profiling import task_profiler
 from sed_aggregator import SEDAggregator
+from sed_rules import rules_registry
+from resilience import ResiliencePolicy
+from storage import DeviceDay, SupabaseStorage
+
+class FastJSONResponse(JSONResponse):
+    """orjson（未インストール時は標準json）でシリアライズするレスポンス"""
+
+    def render(self, content: Any) -> bytes:
+        return serialization.dumps(content)
+
 
 # FastAPIアプリ設定
 app = FastAPI(
     title="SED分析API",
     description="音響イベント検出データの収集・集計・アップロードAPI",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
 # CORS設定を追加
@@ -34,13 +68,150 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ログ設定
-logging.basicConfig(level=logging.INFO)
+# レスポンス圧縮（brotli / gzip、SED_COMPRESS_MIN_BYTES 以上の本文のみ）
+app.add_middleware(CompressionMiddleware)
+
+# ログ設定（JSON形式、LOG_LEVEL / LOG_LEVELS / LOG_FORMAT で変更可能）
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # タスク状況管理
 task_status: Dict[str, Dict[str, Any]] = {}
 
+# 集計クライアント（起動後のウォームアップまたは初回アクセス時に作成し、全リクエスト・タスクで保存先を共有する）
+_aggregator: Optional[SEDAggregator] = None
+_aggregator_lock = threading.Lock()
+
+# ウォームアップの状態（GET /ready）
+readiness: Dict[str, Any] = {"ready": False, "error": None}
+
+# 同じデバイス・日付へのリクエストをまとめる待機時間（秒、デフォルトは0で無効。実行開始が遅れるためオプトイン）
+DEBOUNCE_SECONDS = float(os.getenv('SED_DEBOUNCE_SECONDS', '0'))
+# リクエストが続いても実行を開始するまでの最大待機時間（秒）
+DEBOUNCE_MAX_WAIT = float(os.getenv('SED_DEBOUNCE_MAX_WAIT', '30'))
+
+# 実行待ちのデバイス・日付 → タスクID（待機中のリクエストは同じタスクにまとめる）
+debouncer: Debouncer[DeviceDay] = Debouncer(DEBOUNCE_SECONDS, DEBOUNCE_MAX_WAIT)
+pending_tasks: Dict[DeviceDay, str] = {}
+# レート制限を確認中のデバイス・日付（同じキーのリクエストは結果を待ってから、作成されたタスクにまとめる）
+rate_checks: Dict[DeviceDay, asyncio.Event] = {}
+
+# プロファイルの取得を指定されたタスクID（実行開始時に取り出す）
+profile_requests: Set[str] = set()
+
+# POST /analysis/sed のデバイスごと・全体のレート制限（SED_RATE_LIMIT_*）
+rate_limiter = create_rate_limiter()
+
+# レート制限で拒否したバケット → メッセージ
+RATE_LIMIT_MESSAGES = {
+    "device": "このデバイスからの分析リクエストが多すぎます",
+    "global": "分析リクエストが集中しているため受け付けられません",
+}
+
+# 失敗理由 → タスクのメッセージ
+FAILURE_MESSAGES = {
+    "timeout": "Supabaseの応答がタイムアウトしました",
+    "unavailable": "Supabaseに一時的に接続できませんでした",
+    "circuit_open": "Supabaseが不安定なため処理を停止しています",
+    "rejected": "Supabaseがリクエストを拒否しました",
+    "storage_error": "保存先の処理に失敗しました",
+    "conflict": "同じデバイス・日付への他の保存と競合し続けました",
+}
+
+# ?lang= の形式（locales/<lang>.json のファイル名）
+LANG_PATTERN = r"^[a-z]{2}(-[A-Za-z]{2,4})?$"
+
+
+# 集計パイプラインの計測フックを登録
+SEDAggregator.stage_hooks.append(metrics.observe_stage)
+SEDAggregator.counter_hooks.append(metrics.count)
+SEDAggregator.stage_hooks.append(record_stage)
+SupabaseStorage.payload_hooks.append(metrics.observe_payload)
+ResiliencePolicy.event_hooks.append(metrics.observe_storage_event)
+SEDAggregator.write_hooks.append(profiles.profile_index.on_written)
+metrics.register_task_gauge(lambda: Counter(task["status"] for task in list(task_status.values())))
+
+
+def parse_fields(spec: Optional[str]) -> Optional[Dict[str, Any]]:
+    """?fields= をツリーに変換（None は配下を全て含む）
+
+    例: "status,time_blocks.09-00" → {"status": None, "time_blocks": {"09-00": None}}
+    """
+    if not spec:
+        return None
+    tree: Dict[str, Any] = {}
+    for path in spec.split(','):
+        parts = [part for part in path.strip().split('.') if part]
+        node = tree
+        for i, part in enumerate(parts):
+            if i == len(parts) - 1:
+                node[part] = None
+                break
+            child = node.get(part, {})
+            if child is None:  # 親が全て含まれる指定済み
+                break
+            node[part] = child
+            node = child
+    return tree or None
+
+
+def select_fields(data: Any, tree: Optional[Dict[str, Any]]) -> Any:
+    """指定されたフィールドだけを残す（存在しないフィールドは無視）"""
+    if tree is None or not isinstance(data, dict):
+        return data
+    return {key: select_fields(data[key], sub) for key, sub in tree.items() if key in data}
+
+
+def get_aggregator() -> SEDAggregator:
+    """集計クライアントを取得（保存先は SED_STORAGE、プロセスプールは SED_POOL_WORKERS で選択）"""
+    global _aggregator
+    if _aggregator is None:
+        with _aggregator_lock:
+            if _aggregator is None:
+                from aggregation_pool import create_pool
+                _aggregator = SEDAggregator(pool=create_pool())
+    return _aggregator
+
+
+def ready_aggregator() -> SEDAggregator:
+    """ウォームアップ済みの集計クライアントを取得（完了前・失敗時は503）
+
+    リクエストの処理中に集計クライアントを作成すると、supabaseのimport・クライアント作成と
+    ロック待ちでイベントループが止まるため、作成はウォームアップ（別スレッド）だけで行う。
+    """
+    if not readiness["ready"]:
+        detail = "起動処理中のため受け付けられません" if readiness["error"] is None else \
+            f"保存先を利用できません: {readiness['error']}"
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "1"})
+    return get_aggregator()
+
+
+async def warm_up() -> None:
+    """集計クライアント（supabaseのimport・クライアント作成）と集計ルールを用意する"""
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(get_aggregator)
+        await asyncio.to_thread(rules_registry.get)
+    except Exception as e:
+        readiness["error"] = str(e)
+        logger.exception("ウォームアップに失敗しました", extra=fields(error=str(e)))
+        return
+    readiness.update({"ready": True, "error": None})
+    logger.info("ウォームアップ完了", extra=fields(seconds=round(time.perf_counter() - started, 3)))
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    """起動を待たせずにウォームアップを開始（完了までは GET /ready が503）"""
+    asyncio.ensure_future(warm_up())
+
+
+@app.on_event("shutdown")
+async def shutdown_pool():
+    """集計プロセスプールを終了"""
+    if _aggregator is not None and _aggregator.pool is not None:
+        _aggregator.pool.shutdown()
+
 
 class AnalysisRequest(BaseModel):
     """分析リクエストモデル"""
@@ -48,14 +219,24 @@ class AnalysisRequest(BaseModel):
     date: str  # YYYY-MM-DD形式
 
 
+class BatchAnalysisRequest(BaseModel):
+    """一括分析リクエストモデル"""
+    device_ids: List[str]
+    start_date: str  # YYYY-MM-DD形式
+    end_date: Optional[str] = None  # 省略時は start_date のみ
+
+
 class TaskStatus(BaseModel):
     """タスク状況モデル"""
     task_id: str
     status: str  # started, running, completed, failed
     message: str
     progress: Optional[int] = None
+    coalesced: Optional[int] = None  # まとめたリクエスト数
+    reason: Optional[str] = None  # 失敗理由（no_data, timeout, unavailable, circuit_open, rejected, storage_error, conflict）
     result: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
+    profile: Optional[Dict[str, Any]] = None  # 取得したプロファイルの概要（GET /analysis/sed/{task_id}/profile）
 
 
 @app.get("/", tags=["Health"])
@@ -70,21 +251,96 @@ async def root():
 
 @app.get("/health", tags=["Health"])
 async def health_check():
-    """ヘルスチェックエンドポイント"""
+    """ヘルスチェックエンドポイント（liveness: プロセスが応答できるか。依存先は確認しない）"""
     return {"status": "healthy"}
 
 
+@app.get("/ready", tags=["Health"])
+async def readiness_check():
+    """readiness: 集計クライアントの作成（ウォームアップ）が完了し、リクエストを処理できるか"""
+    if readiness["ready"]:
+        return {"status": "ready", "storage": get_aggregator().storage.name}
+    if readiness["error"]:
+        return FastJSONResponse({"status": "unavailable", "error": readiness["error"]}, status_code=503)
+    return FastJSONResponse({"status": "starting"}, status_code=503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Health"])
+async def get_metrics():
+    """Prometheus形式のメトリクス"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.post("/analysis/sed", response_model=Dict[str, str], tags=["Analysis"])
-async def start_sed_analysis(request: AnalysisRequest, background_tasks: BackgroundTasks):
+async def start_sed_analysis(request: AnalysisRequest, background_tasks: BackgroundTasks,
+                             profile: bool = False,
+                             x_sed_profile: Optional[str] = Header(None),
+                             x_sed_profile_token: Optional[str] = Header(None)):
     """
     SED分析を開始（非同期バックグラウンド実行）
+
+    同じデバイス・日付へのリクエストが SED_DEBOUNCE_SECONDS 秒以内に続いた場合は
+    1回の実行にまとめ、同じタスクIDを返す。
+    新しく実行するリクエストがデバイスごと・全体のレート制限を超えた場合は 429（Retry-After付き）を返す
+    （実行待ちのタスクにまとめたリクエストは制限しない）。
+    ?profile=true または X-SED-Profile: 1 を指定すると集計をプロファイルする
+    （SED_PROFILE_TOKEN 設定時は X-SED-Profile-Token が必要）。
     """
     # 日付形式検証
     try:
         datetime.strptime(request.date, "%Y-%m-%d")
     except ValueError:
         raise HTTPException(status_code=400, detail="日付はYYYY-MM-DD形式で指定してください")
-    
+
+    # Supabaseが不安定な間は新しい分析を受け付けない（サーキットが閉じるまで）
+    policy = getattr(ready_aggregator().storage, 'policy', None)
+    if policy is not None and policy.breaker.state == "open":
+        retry_after = max(1, int(policy.breaker.retry_after()))
+        raise HTTPException(status_code=503, detail=FAILURE_MESSAGES["circuit_open"],
+                            headers={"Retry-After": str(retry_after)})
+
+    profile_requested = profile or (x_sed_profile or "").lower() in ("1", "true")
+    if profile_requested and not task_profiler.authorized(x_sed_profile_token):
+        raise HTTPException(status_code=403, detail="プロファイルの取得には X-SED-Profile-Token が必要です")
+
+    # 実行待ちのタスクがあればまとめる（レート制限の確認中なら、その結果を待つ）
+    key = (request.device_id, request.date)
+    while key in rate_checks:
+        await rate_checks[key].wait()
+    if key in pending_tasks:
+        task_id = pending_tasks[key]
+        if profile_requested:
+            profile_requests.add(task_id)
+        debouncer.touch(key, time.monotonic())
+        task_status[task_id]["coalesced"] = debouncer.coalesced(key)
+        metrics.COALESCED_REQUESTS.inc()
+
+        logger.info("SED分析リクエストを既存タスクにまとめました", extra=fields(
+            task_id=task_id, device_id=request.device_id, date=request.date,
+            coalesced=task_status[task_id]["coalesced"]
+        ))
+        return {
+            "task_id": task_id,
+            "status": "started",
+            "message": f"{request.device_id}/{request.date} の分析は実行待ちのタスクにまとめました"
+        }
+
+    # レート制限（新しく実行するリクエストのみトークンを消費する。まとめたリクエスト・不正なリクエストは消費しない）
+    checking = rate_checks[key] = asyncio.Event()
+    try:
+        decision = await rate_limiter.check(request.device_id)
+    finally:
+        # 待っているリクエストが再開するのは、この後（awaitせずに）タスクを登録してから
+        del rate_checks[key]
+        checking.set()
+    if not decision.allowed:
+        metrics.RATE_LIMITED.inc(scope=decision.scope)
+        logger.debug("SED分析リクエストをレート制限で拒否しました", extra=fields(
+            device_id=request.device_id, scope=decision.scope, retry_after=decision.retry_after
+        ))
+        raise HTTPException(status_code=429, detail=RATE_LIMIT_MESSAGES[decision.scope],
+                            headers={"Retry-After": str(max(1, math.ceil(decision.retry_after)))})
+
     # タスクID生成
     task_id = str(uuid.uuid4())
     
@@ -96,13 +352,18 @@ async def start_sed_analysis(request: AnalysisRequest, background_tasks: Backgro
         "progress": 0,
         "device_id": request.device_id,
         "date": request.date,
+        "coalesced": 1,
         "created_at": datetime.now().isoformat()
     }
+    pending_tasks[key] = task_id
+    debouncer.touch(key, time.monotonic())
+    if profile_requested:
+        profile_requests.add(task_id)
+
+    # バックグラウンドタスク追加（待機時間が過ぎてから実行）
+    background_tasks.add_task(execute_debounced_analysis, task_id, request.device_id, request.date)
     
-    # バックグラウンドタスク追加
-    background_tasks.add_task(execute_sed_analysis, task_id, request.device_id, request.date)
-    
-    logger.info(f"SED分析開始: task_id={task_id}, device_id={request.device_id}, date={request.date}")
+    logger.info("SED分析開始", extra=fields(task_id=task_id, device_id=request.device_id, date=request.date))
     
     return {
         "task_id": task_id,
@@ -111,26 +372,75 @@ async def start_sed_analysis(request: AnalysisRequest, background_tasks: Backgro
     }
 
 
+@app.post("/analysis/sed/batch", response_model=Dict[str, str], tags=["Analysis"])
+async def start_batch_analysis(request: BatchAnalysisRequest, background_tasks: BackgroundTasks,
+                               fetch_batch: int = 10, save_batch: int = 20):
+    """
+    複数デバイス・日付のSED分析を一括実行（非同期バックグラウンド実行）
+
+    取得・集計・保存をパイプラインで重ねて実行し、保存は複数行UPSERTにまとめる。
+    進捗は GET /analysis/sed/{task_id} で確認できる。
+    """
+    from sed_pipeline import date_range
+
+    try:
+        dates = date_range(request.start_date, request.end_date or request.start_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"日付はYYYY-MM-DD形式で指定してください: {e}")
+    if not request.device_ids:
+        raise HTTPException(status_code=400, detail="device_idsを指定してください")
+
+    ready_aggregator()
+
+    keys = [(device_id, date) for device_id in request.device_ids for date in dates]
+    task_id = str(uuid.uuid4())
+    task_status[task_id] = {
+        "task_id": task_id,
+        "status": "started",
+        "message": f"{len(keys)}件の一括分析を開始しました",
+        "progress": 0,
+        "created_at": datetime.now().isoformat()
+    }
+
+    background_tasks.add_task(execute_batch_analysis, task_id, keys, fetch_batch, save_batch)
+    logger.info("一括分析開始", extra=fields(task_id=task_id, keys=len(keys)))
+
+    return {
+        "task_id": task_id,
+        "status": "started",
+        "message": f"{len(keys)}件の一括分析を開始しました"
+    }
+
+
 @app.get("/analysis/sed/{task_id}", response_model=TaskStatus, tags=["Analysis"])
-async def get_analysis_status(task_id: str):
+async def get_analysis_status(task_id: str, fields: Optional[str] = None):
     """
     分析タスクの状況を取得
+
+    ?fields=status,progress のように指定すると、そのフィールドだけを返す。
     """
     if task_id not in task_status:
         raise HTTPException(status_code=404, detail="タスクが見つかりません")
-    
+
+    tree = parse_fields(fields)
+    if tree is not None:
+        return FastJSONResponse(select_fields(task_status[task_id], tree))
     return task_status[task_id]
 
 
 @app.get("/analysis/sed", tags=["Analysis"])
-async def list_analysis_tasks():
+async def list_analysis_tasks(fields: Optional[str] = None):
     """
     全分析タスクの一覧を取得
+
+    ?fields=task_id,status のように指定すると、各タスクのそのフィールドだけを返す。
     """
-    return {
-        "tasks": list(task_status.values()),
+    tree = parse_fields(fields)
+    # タスク一覧は件数が多くなるため、jsonable_encoderを通さずそのままシリアライズする
+    return FastJSONResponse({
+        "tasks": [select_fields(task, tree) for task in list(task_status.values())],
         "total": len(task_status)
-    }
+    })
 
 
 @app.delete("/analysis/sed/{task_id}", tags=["Analysis"])
@@ -146,9 +456,298 @@ async def delete_analysis_task(task_id: str):
         raise HTTPException(status_code=400, detail="実行中のタスクは削除できません")
     
     del task_status[task_id]
+    task_profiler.discard(task_id)
     return {"message": f"タスク {task_id} を削除しました"}
 
 
+@app.get("/analysis/sed/{task_id}/profile", tags=["Analysis"])
+async def get_analysis_profile(task_id: str, format: str = Query("text", pattern="^(text|pstats|html)$"),
+                               x_sed_profile_token: Optional[str] = Header(None)):
+    """
+    タスクの集計のプロファイルをダウンロード
+
+    format=text: 上位の関数（cProfileは累積時間順）、pstats: cProfileの統計（python -m pstats で読み込み）、
+    html: pyinstrumentのレポート
+    """
+    if not task_profiler.authorized(x_sed_profile_token):
+        raise HTTPException(status_code=403, detail="プロファイルの取得には X-SED-Profile-Token が必要です")
+    captured = task_profiler.get(task_id)
+    if captured is None:
+        raise HTTPException(status_code=404, detail="このタスクのプロファイルはありません")
+
+    if format == "pstats":
+        if captured.data is None:
+            raise HTTPException(status_code=404, detail=f"{captured.profiler}のプロファイルはpstats形式で取得できません")
+        return Response(captured.data, media_type="application/octet-stream",
+                        headers={"Content-Disposition": f'attachment; filename="{task_id}.prof"'})
+    if format == "html":
+        if captured.html is None:
+            raise HTTPException(status_code=404, detail=f"{captured.profiler}のプロファイルはHTML形式で取得できません")
+        return HTMLResponse(captured.html)
+    return PlainTextResponse(captured.text)
+
+
+@app.get("/aggregates/{device_id}/{date}", tags=["Aggregates"])
+async def get_aggregate(device_id: str, date: str,
+                        lang: str = Query(localization.SOURCE_LANGUAGE, pattern=LANG_PATTERN),
+                        fields: Optional[str] = None):
+    """
+    保存済みの集計結果（time_blocks + summary_ranking + anomalies）を取得
+
+    保存データは英語ラベルのまま。?lang=ja で読み出し時に翻訳する。
+    ?fields=time_blocks.09-00,time_blocks.09-30 のように指定すると、そのフィールド・スロットだけを返す。
+    """
+    try:
+        datetime.strptime(date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="日付はYYYY-MM-DD形式で指定してください")
+
+    try:
+        localization.get_dictionary(lang)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    reader = ready_aggregator()
+    row = await reader.fetch_aggregate(device_id, date)
+    if row is None:
+        raise HTTPException(status_code=404, detail="集計結果が見つかりません")
+
+    def build() -> Dict[str, Any]:
+        time_blocks = row["behavior_aggregator_result"] or {}
+        return {
+            "device_id": device_id,
+            "date": date,
+            "rules_version": row.get("behavior_aggregator_rules_version"),
+            "processed_at": row.get("behavior_aggregator_processed_at"),
+            "summary_ranking": reader.create_summary_ranking(time_blocks),
+            "time_blocks": time_blocks,
+            # デバイスのベースラインと比べて珍しい回数（異常検出が無効・未実行の場合はNone）
+            "anomalies": row.get("behavior_aggregator_anomalies")
+        }
+
+    # 更新時刻・集計時と現在のルールバージョンをキーに含め、再集計・ルール変更後は新しい翻訳を作る
+    # （summary_ranking は現在のルールのカテゴリーで作るため、保存済みの行が同じでもルールの再読み込みで変わる）
+    cache_key = (device_id, date, row.get("behavior_aggregator_processed_at"),
+                 row.get("behavior_aggregator_rules_version"), rules_registry.get().version)
+    response = localization.response_cache.get_or_translate(cache_key, lang, build)
+    return FastJSONResponse(select_fields(response, parse_fields(fields)))
+
+
+@app.get("/aggregates/{device_id}/{date}/similar", tags=["Aggregates"])
+async def get_similar_days(device_id: str, date: str, limit: int = Query(10, ge=1, le=100)):
+    """
+    活動プロファイル（30分スロット × イベントグループ）が似ている日を検索
+
+    デバイスの全ての日のプロファイルとのコサイン類似度を計算し、高い順に返す（指定した日自身は含めない）。
+    """
+    try:
+        datetime.strptime(date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="日付はYYYY-MM-DD形式で指定してください")
+
+    storage = ready_aggregator().storage
+    matrix = await profiles.profile_index.get(device_id, storage.fetch_profiles)
+    if date not in matrix:
+        raise HTTPException(status_code=404, detail="この日の活動プロファイルが見つかりません")
+
+    return {
+        "device_id": device_id,
+        "date": date,
+        "groups": list(profiles.PROFILE_GROUPS),
+        "compared": len(matrix) - 1,
+        "similar": [
+            {"date": other, "similarity": score} for other, score in matrix.most_similar(date, limit)
+        ]
+    }
+
+
+@app.get("/export", tags=["Aggregates"])
+async def export_aggregates(date_from: str = Query(..., alias="from"), date_to: str = Query(..., alias="to"),
+                            devices: Optional[str] = None,
+                            format: str = Query("ndjson", pattern="^(ndjson|parquet)$")):
+    """
+    期間内の集計結果を (device_id, date, slot, label, count) の行として出力（ストリーミング）
+
+    ?devices=id1,id2 で対象のデバイスを絞り込む。format=parquet は pyarrow が必要。
+    保存先をページ単位で読みながら出力するため、期間の長さによらずメモリ使用量は一定。
+    """
+    # pyarrowのimportが重いため、エクスポートを使うまで読み込まない
+    import export
+
+    try:
+        start = datetime.strptime(date_from, "%Y-%m-%d")
+        end = datetime.strptime(date_to, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="日付はYYYY-MM-DD形式で指定してください")
+    if start > end:
+        raise HTTPException(status_code=400, detail="from は to 以前の日付を指定してください")
+    if format == "parquet" and not export.PARQUET_AVAILABLE:
+        raise HTTPException(status_code=400, detail="Parquet形式の出力には pyarrow が必要です（format=ndjson を使用してください）")
+    device_ids = [device_id for device_id in (devices or "").split(",") if device_id] or None
+
+    pages = ready_aggregator().storage.iter_result_pages(date_from, date_to, device_ids)
+
+    async def stream():
+        try:
+            async for chunk in export.export_stream(pages, format):
+                yield chunk
+        except Exception as e:
+            # ヘッダー送信後のためステータスは変えられない（レスポンスは途中で終わる）
+            logger.exception("エクスポート中にエラーが発生しました", extra=fields(
+                date_from=date_from, date_to=date_to, format=format, error=str(e)
+            ))
+            raise
+
+    filename = f"aggregates_{date_from}_{date_to}.{format}"
+    return StreamingResponse(stream(), media_type=export.MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@app.get("/rules", tags=["Rules"])
+async def get_rules_info():
+    """
+    現在有効な集計ルールの概要を取得
+    """
+    return rules_registry.get().summary()
+
+
+@app.post("/rules/reload", tags=["Rules"])
+async def reload_rules():
+    """
+    ルールファイルを再読み込み（サーバー再起動不要）
+    """
+    try:
+        rules = rules_registry.reload(force=True)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"ルールの読み込みに失敗しました: {e}")
+
+    logger.info("集計ルール再読み込み", extra=fields(rules_version=rules.version))
+    return rules.summary()
+
+
+@app.post("/rules/reaggregate", response_model=Dict[str, str], tags=["Rules"])
+async def start_reaggregation(background_tasks: BackgroundTasks, concurrency: int = 4):
+    """
+    現在のルールで結果が変わる行だけを再集計（非同期バックグラウンド実行）
+
+    進捗は GET /analysis/sed/{task_id} で確認できる。
+    """
+    ready_aggregator()
+    task_id = str(uuid.uuid4())
+    rules = rules_registry.get()
+
+    task_status[task_id] = {
+        "task_id": task_id,
+        "status": "started",
+        "message": f"ルール {rules.version} での再集計を開始しました",
+        "progress": 0,
+        "rules_version": rules.version,
+        "created_at": datetime.now().isoformat()
+    }
+
+    background_tasks.add_task(execute_reaggregation, task_id, concurrency)
+    logger.info("選択的再集計開始", extra=fields(task_id=task_id, rules_version=rules.version))
+
+    return {
+        "task_id": task_id,
+        "status": "started",
+        "message": f"ルール {rules.version} での再集計を開始しました"
+    }
+
+
+async def execute_reaggregation(task_id: str, concurrency: int):
+    """
+    選択的再集計の実行（バックグラウンドタスク）
+    """
+    def progress(done: int, total: int) -> None:
+        task_status[task_id].update({
+            "status": "running",
+            "message": f"再集計中... ({done}/{total})",
+            "progress": int(done * 100 / total) if total else 100
+        })
+
+    from sed_reaggregator import SelectiveReaggregator
+
+    bind_task(task_id)
+    try:
+        reaggregator = SelectiveReaggregator(get_aggregator(), concurrency=concurrency, progress=progress)
+        summary = await reaggregator.run()
+        task_status[task_id].update({
+            "status": "completed",
+            "message": "再集計完了",
+            "progress": 100,
+            "result": summary
+        })
+        logger.info("選択的再集計完了", extra=fields(
+            reaggregated=summary['reaggregated'], restamped=summary['restamped'], failed=len(summary['failed'])
+        ))
+    except Exception as e:
+        logger.exception("選択的再集計エラー", extra=fields(error=str(e)))
+        task_status[task_id].update({
+            "status": "failed",
+            "message": "再集計中にエラーが発生しました",
+            "error": str(e),
+            "progress": 100
+        })
+
+
+async def execute_debounced_analysis(task_id: str, device_id: str, date: str):
+    """
+    同じデバイス・日付へのリクエストが途切れるまで待ってからSED分析を実行
+    """
+    key = (device_id, date)
+    try:
+        while True:
+            delay = debouncer.deadline(key) - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+    finally:
+        # 実行開始後のリクエストは新しいタスクとして受け付ける
+        debouncer.discard(key)
+        pending_tasks.pop(key, None)
+
+    await execute_sed_analysis(task_id, device_id, date)
+
+
+async def execute_batch_analysis(task_id: str, keys: List[DeviceDay], fetch_batch: int, save_batch: int):
+    """
+    一括分析の実行（バックグラウンドタスク）
+    """
+    def progress(done: int, total: int) -> None:
+        task_status[task_id].update({
+            "status": "running",
+            "message": f"一括分析中... ({done}/{total})",
+            "progress": int(done * 100 / total) if total else 100
+        })
+
+    from sed_pipeline import AggregationPipeline
+
+    metrics.TASKS_IN_FLIGHT.inc()
+    bind_task(task_id)
+    try:
+        pipeline = AggregationPipeline(get_aggregator(), fetch_batch=fetch_batch, save_batch=save_batch,
+                                       progress=progress)
+        summary = await pipeline.run(keys)
+        task_status[task_id].update({
+            "status": "completed",
+            "message": "一括分析完了",
+            "progress": 100,
+            "result": summary
+        })
+    except Exception as e:
+        logger.exception("一括分析エラー", extra=fields(error=str(e)))
+        task_status[task_id].update({
+            "status": "failed",
+            "message": "一括分析中にエラーが発生しました",
+            "error": str(e),
+            "progress": 100
+        })
+    finally:
+        metrics.TASKS_IN_FLIGHT.dec()
+        metrics.TASKS.inc(status=task_status[task_id]["status"])
+
+
 async def execute_sed_analysis(task_id: str, device_id: str, date: str):
     """
     SED分析の実行（バックグラウンドタスク）
@@ -158,8 +757,10 @@ async def execute_sed_analysis(task_id: str, device_id: str, date: str):
         device_id: デバイスID
         date: 対象日付（YYYY-MM-DD形式）
     """
+    metrics.TASKS_IN_FLIGHT.inc()
+    bind_task(task_id)
     try:
-        logger.info(f"🚀 バックグラウンドタスク開始: task_id={task_id}, device_id={device_id}, date={date}")
+        logger.debug("バックグラウンドタスク開始", extra=fields(device_id=device_id, date=date))
 
         # ステップ1: データ収集・集計
         task_status[task_id].update({
@@ -168,35 +769,44 @@ async def execute_sed_analysis(task_id: str, device_id: str, date: str):
             "progress": 50
         })
 
-        logger.info(f"📊 SEDAggregator インスタンス作成中...")
-        aggregator = SEDAggregator()
-        logger.info(f"📡 Supabaseからデータ取得開始...")
-        result = await aggregator.run(device_id, date)
-        logger.info(f"📄 データ取得結果: {result}")
-        
+        # プロファイルの取得（オプトイン、またはサンプリングで遅かったタスク）
+        requested = task_id in profile_requests
+        profile_requests.discard(task_id)
+        with task_profiler.capture(task_id, requested) as captured:
+            result = await get_aggregator().run(device_id, date)
+        if captured.profile is not None:
+            task_status[task_id]["profile"] = captured.profile.summary()
+
+        # 集計結果全体（time_blocks含む）はDEBUG時のみ出力
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("データ取得結果", extra=fields(result=result))
+
         if not result["success"]:
-            logger.error(f"❌ データ収集・保存失敗: {result.get('message', '不明なエラー')}")
-            
+            logger.warning("データ収集・保存失敗", extra=fields(
+                device_id=device_id, date=date, reason=result.get("reason"),
+                stages_ms=stage_durations.get()
+            ))
+
             # データがない場合の適切なエラーメッセージ
             if result.get("reason") == "no_data":
                 task_status[task_id].update({
                     "status": "failed",
                     "message": f"{date}のデータがありませんでした",
                     "error": result.get("message", "データが存在しません"),
+                    "reason": "no_data",
                     "progress": 100
                 })
             else:
+                # 取得・保存の失敗（タイムアウト・接続エラー・遮断中など）はデータなしと区別する
                 task_status[task_id].update({
                     "status": "failed",
-                    "message": "データ収集に失敗しました",
+                    "message": FAILURE_MESSAGES.get(result.get("reason"), "データ収集に失敗しました"),
                     "error": result.get("message", "不明なエラー"),
+                    "reason": result.get("reason"),
                     "progress": 100
                 })
             return
-        
-        logger.info(f"✅ データ収集・Supabase保存成功")
-        logger.info(f"🎉 分析完了")
-        
+
         # 成功
         task_status[task_id].update({
             "status": "completed",
@@ -205,24 +815,28 @@ async def execute_sed_analysis(task_id: str, device_id: str, date: str):
             "result": {
                 "message": "データはSupabaseのbehavior_summaryテーブルに保存されました",
                 "device_id": device_id,
-                "date": date
+                "date": date,
+                "rules_version": result["result"]["rules_version"],
+                "written": result["written"]
             }
         })
-        
-        logger.info(f"✅ SED分析完了: task_id={task_id}")
-        
+
+        logger.info("SED分析完了", extra=fields(
+            device_id=device_id, date=date, rules_version=result["result"]["rules_version"],
+            written=result["written"], stages_ms=stage_durations.get()
+        ))
+
     except Exception as e:
-        logger.error(f"💥 SED分析エラー: task_id={task_id}, error={e}")
-        logger.error(f"💥 エラー詳細: {type(e).__name__}: {str(e)}")
-        import traceback
-        logger.error(f"💥 スタックトレース: {traceback.format_exc()}")
+        logger.exception("SED分析エラー", extra=fields(device_id=device_id, date=date, error=str(e)))
         task_status[task_id].update({
             "status": "failed",
             "message": "分析中にエラーが発生しました",
             "error": str(e),
             "progress": 100
         })
-        logger.error(f"❌ SED分析エラー: task_id={task_id}, error={e}")
+    finally:
+        metrics.TASKS_IN_FLIGHT.dec()
+        metrics.TASKS.inc(status=task_status[task_id]["status"])
 
 
 if __name__ == "__main__":
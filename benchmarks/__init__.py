@@ -0,0 +1,10 @@
+"""
+集計パイプラインのオフラインベンチマーク
+
+Supabaseに接続せず、合成データ（synthetic.py）とインメモリの保存先（storage.MemoryStorage）で
+SEDAggregatorの各処理ステージと run 全体の処理時間を計測する。
+
+    python -m benchmarks            # 全ケースを実行して結果を表示
+    python -m benchmarks --check    # thresholds.json の上限を超えたら終了コード1
+    SED_BENCH_THRESHOLDS=1 python -m pytest benchmarks  # 回帰チェックをpytestで実行
+"""
@@ -0,0 +1,54 @@
+"""
+ベンチマークの実行
+
+    python -m benchmarks [--filter NAME] [--repeat N] [--memory] [--check] [--json PATH]
+"""
+
+import argparse
+import json
+import sys
+from dataclasses import asdict
+
+from .suite import run_all, run_memory
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="SED集計パイプラインのベンチマーク")
+    parser.add_argument("--filter", default="", help="名前にこの文字列を含むケースのみ実行")
+    parser.add_argument("--repeat", type=int, default=None, help="計測回数（デフォルトはケース毎の設定）")
+    parser.add_argument("--memory", action="store_true", help="1日分の処理で確保されるメモリのピークも計測")
+    parser.add_argument("--check", action="store_true", help="thresholds.json の上限を超えたら終了コード1")
+    parser.add_argument("--json", default=None, help="計測結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    results = run_all(args.filter, args.repeat)
+
+    print(f"{'case':<32} {'median(ms)':>12} {'min(ms)':>10} {'limit(ms)':>10}")
+    print("-" * 68)
+    for m in results:
+        limit = f"{m.threshold_ms:.1f}" if m.threshold_ms is not None else "-"
+        mark = "  ❌" if m.regressed else ""
+        print(f"{m.name:<32} {m.median_ms:>12.3f} {m.min_ms:>10.3f} {limit:>10}{mark}")
+
+    memory = run_memory(args.filter) if args.memory else []
+    if memory:
+        print(f"\n{'case':<32} {'peak(KiB)':>12} {'limit(KiB)':>21}")
+        print("-" * 68)
+        for m in memory:
+            limit = f"{m.threshold_kib:.0f}" if m.threshold_kib is not None else "-"
+            mark = "  ❌" if m.regressed else ""
+            print(f"{m.name:<32} {m.peak_kib:>12.1f} {limit:>21}{mark}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump([asdict(m) for m in results + memory], f, ensure_ascii=False, indent=2)
+
+    regressed = [m.name for m in results + memory if m.regressed]
+    if args.check and regressed:
+        print(f"\n❌ 上限超過: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
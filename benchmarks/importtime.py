@@ -0,0 +1,75 @@
+"""
+起動時のimport時間の計測（python -X importtime）
+
+    python -m benchmarks.importtime [--module api_server] [--top 20]
+
+新しいプロセスで module をimportし、-X importtime の出力（モジュールごとの自身・累積のマイクロ秒）を
+累積時間の大きい順に表示する。コンテナのコールドスタートで /health に応答するまでの時間の目安になる。
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# import time:       self [us] |  cumulative | imported package
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+# 起動時にimportしない（遅延importする）モジュール
+DEFERRED_MODULES = ("supabase", "httpx", "multiprocessing", "sed_pipeline", "sed_reaggregator", "pyarrow")
+
+
+@dataclass
+class ImportEntry:
+    """1モジュールのimport時間（マイクロ秒）"""
+    name: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def profile_imports(module: str = "api_server") -> List[ImportEntry]:
+    """新しいプロセスで module をimportし、importしたモジュールの一覧を返す"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    entries = []
+    for line in completed.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append(ImportEntry(name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return entries
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="起動時のimport時間の計測")
+    parser.add_argument("--module", default="api_server", help="importするモジュール")
+    parser.add_argument("--top", type=int, default=20, help="表示するモジュール数")
+    args = parser.parse_args()
+
+    entries = profile_imports(args.module)
+    total = next((e.cumulative_us for e in entries if e.name == args.module and e.depth == 0), 0)
+
+    print(f"{'module':<48} {'self(ms)':>10} {'cumulative(ms)':>15}")
+    print("-" * 75)
+    for e in sorted(entries, key=lambda e: e.cumulative_us, reverse=True)[:args.top]:
+        print(f"{'  ' * e.depth + e.name:<48} {e.self_us / 1000:>10.1f} {e.cumulative_us / 1000:>15.1f}")
+    print(f"\n⏱️  {args.module}: {total / 1000:.1f}ms（{len(entries)}モジュール）")
+
+    imported = {e.name.split('.')[0] for e in entries}
+    eager = [name for name in DEFERRED_MODULES if name in imported]
+    if eager:
+        print(f"⚠️  起動時にimportされています: {', '.join(eager)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,365 @@
+"""
+api_server の負荷試験（到着レートを指定したオープンループ、レイテンシのSLOレポート）
+
+    python -m benchmarks.loadtest --spawn [--rate 20] [--duration 30] [--devices 20] [--dates 7]
+    python -m benchmarks.loadtest --url http://localhost:8010 [--mix analysis=1,aggregate=2,similar=1,tasks=0.1]
+
+リクエストはポアソン過程（平均 --rate 件/秒）で到着し、応答を待たずに次のリクエストを送る。
+操作は --mix の重みで選び、デバイス・日付は --devices × --dates の組み合わせから一様に選ぶ。
+
+- analysis:  POST /analysis/sed → 終了するまで GET /analysis/sed/{task_id} をポーリング
+             （analysis.task は受付から終了までの時間で、分解能は --poll-interval。
+              status はポーリング1回の応答時間）
+- aggregate: GET /aggregates/{device_id}/{date}
+- similar:   GET /aggregates/{device_id}/{date}/similar
+- tasks:     GET /analysis/sed?fields=task_id,status
+
+--spawn を指定すると、合成データ（benchmarks/synthetic.py）をNDJSONに書き出し、
+インメモリの保存先（SED_STORAGE=memory）で api_server を別プロセスで起動する。
+レート制限とデバウンスは無効にし、計測前に全てのデバイス・日付を一括分析しておく。
+
+応答は ok（2xx）・miss（404）・rejected（429 / 503）・error（その他・接続エラー・タイムアウト）に分類する。
+--slo OP:pNN=MS を満たさない、またはエラー率が --max-error-rate を超えた場合は終了コード1。
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import aiohttp
+
+from .synthetic import DENSE_DAY, SPARSE_DAY, TYPICAL_DAY, generate_rows
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROFILES = {"sparse": SPARSE_DAY, "typical": TYPICAL_DAY, "dense": DENSE_DAY}
+
+# LoadGenerator のメソッド名
+OPERATIONS = ("analysis", "aggregate", "similar", "tasks")
+DEFAULT_MIX = "analysis=1,aggregate=2,similar=1,tasks=0.1"
+
+# 応答の分類
+OK, MISS, REJECTED, ERROR = "ok", "miss", "rejected", "error"
+OUTCOMES = (OK, MISS, REJECTED, ERROR)
+
+
+@dataclass
+class OperationStats:
+    """1種類の操作のレイテンシ（ミリ秒）と分類ごとの件数"""
+    name: str
+    count: int
+    throughput: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+    outcomes: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.get(ERROR, 0) / self.count if self.count else 0.0
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """最近傍順位法によるパーセンタイル（sorted_values は昇順）"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def classify(status: int) -> str:
+    if 200 <= status < 300:
+        return OK
+    if status == 404:
+        return MISS
+    if status in (429, 503):
+        return REJECTED
+    return ERROR
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """"analysis=1,aggregate=2" → {"analysis": 1.0, "aggregate": 2.0}"""
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in OPERATIONS:
+            raise ValueError(f"不明な操作です: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def parse_slo(spec: str) -> Tuple[str, float, float]:
+    """"analysis:p99=250" → ("analysis", 99.0, 250.0)"""
+    target, _, limit = spec.partition('=')
+    name, _, pct = target.partition(':p')
+    if not name or not pct or not limit:
+        raise ValueError(f"SLOは OP:pNN=MS の形式で指定してください: {spec}")
+    return name, float(pct), float(limit)
+
+
+class Recorder:
+    """操作ごとのレイテンシと分類を記録"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.outcomes: Dict[str, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(OUTCOMES, 0))
+
+    def record(self, name: str, started: float, outcome: str) -> None:
+        self.latencies[name].append((time.perf_counter() - started) * 1000)
+        self.outcomes[name][outcome] += 1
+
+    def summarize(self, elapsed: float) -> List[OperationStats]:
+        stats = []
+        for name in sorted(self.latencies):
+            values = sorted(self.latencies[name])
+            stats.append(OperationStats(
+                name, len(values), len(values) / elapsed if elapsed else 0.0,
+                percentile(values, 50), percentile(values, 95), percentile(values, 99), values[-1],
+                dict(self.outcomes[name]),
+            ))
+        return stats
+
+
+class LoadGenerator:
+    """到着レートを指定して api_server にリクエストを送る"""
+
+    def __init__(self, url: str, keys: Sequence[Tuple[str, str]], mix: Dict[str, float],
+                 poll_interval: float = 0.2, task_timeout: float = 60.0, seed: int = 42):
+        self.url = url.rstrip('/')
+        self.keys = list(keys)
+        self.mix = mix
+        self.poll_interval = poll_interval
+        self.task_timeout = task_timeout
+        self.rng = random.Random(seed)
+        self.recorder = Recorder()
+        self.dropped = 0
+
+    async def _request(self, session: aiohttp.ClientSession, name: str, method: str, path: str,
+                       **kwargs) -> Tuple[str, Optional[dict]]:
+        started = time.perf_counter()
+        try:
+            async with session.request(method, self.url + path, **kwargs) as response:
+                body = await response.read()
+                outcome = classify(response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.recorder.record(name, started, ERROR)
+            return ERROR, None
+        self.recorder.record(name, started, outcome)
+        return outcome, json.loads(body) if outcome == OK and body else None
+
+    async def analysis(self, session: aiohttp.ClientSession, device_id: str, date: str) -> None:
+        started = time.perf_counter()
+        outcome, body = await self._request(session, "analysis", "POST", "/analysis/sed",
+                                            json={"device_id": device_id, "date": date})
+        if outcome != OK:
+            return
+
+        deadline = started + self.task_timeout
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            outcome, status = await self._request(session, "status", "GET", f"/analysis/sed/{body['task_id']}",
+                                                  params={"fields": "status"})
+            if outcome != OK:
+                self.recorder.record("analysis.task", started, outcome)
+                return
+            if status["status"] in ("completed", "failed"):
+                self.recorder.record("analysis.task", started, OK if status["status"] == "completed" else MISS)
+                return
+        self.recorder.record("analysis.task", started, ERROR)
+
+    async def aggregate(self, session: aiohttp.ClientSession, device_id: str, date: str) -> None:
+        await self._request(session, "aggregate", "GET", f"/aggregates/{device_id}/{date}")
+
+    async def similar(self, session: aiohttp.ClientSession, device_id: str, date: str) -> None:
+        await self._request(session, "similar", "GET", f"/aggregates/{device_id}/{date}/similar")
+
+    async def tasks(self, session: aiohttp.ClientSession, device_id: str, date: str) -> None:
+        await self._request(session, "tasks", "GET", "/analysis/sed", params={"fields": "task_id,status"})
+
+    async def run(self, rate: float, duration: float, max_in_flight: int = 1000) -> Tuple[List[OperationStats], float]:
+        """duration 秒間、平均 rate 件/秒でリクエストを送り、(操作ごとの統計, 経過秒数) を返す"""
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        in_flight = set()
+
+        timeout = aiohttp.ClientTimeout(total=30)
+        connector = aiohttp.TCPConnector(limit=max_in_flight)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            started = time.perf_counter()
+            next_at = started
+            while True:
+                next_at += self.rng.expovariate(rate)
+                if next_at - started >= duration:
+                    break
+                await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+                if len(in_flight) >= max_in_flight:
+                    # クライアント側が飽和（サーバーが到着レートに追いついていない）
+                    self.dropped += 1
+                    continue
+                operation = getattr(self, self.rng.choices(names, weights)[0])
+                device_id, date = self.rng.choice(self.keys)
+                task = asyncio.create_task(operation(session, device_id, date))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            if in_flight:
+                await asyncio.wait(in_flight, timeout=self.task_timeout)
+            elapsed = time.perf_counter() - started
+        return self.recorder.summarize(elapsed), elapsed
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_ready(url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url + "/ready") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"api_server が {timeout:.0f}秒以内に起動しませんでした")
+
+
+async def _prime(url: str, device_ids: Sequence[str], dates: Sequence[str], timeout: float = 600.0) -> None:
+    """全てのデバイス・日付を一括分析し、読み取り系の操作が集計結果を参照できるようにする"""
+    async with aiohttp.ClientSession() as session:
+        body = {"device_ids": list(device_ids), "start_date": dates[0], "end_date": dates[-1]}
+        async with session.post(url + "/analysis/sed/batch", json=body) as response:
+            response.raise_for_status()
+            task_id = (await response.json())["task_id"]
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            async with session.get(f"{url}/analysis/sed/{task_id}", params={"fields": "status"}) as response:
+                if (await response.json())["status"] in ("completed", "failed"):
+                    return
+            await asyncio.sleep(0.5)
+
+
+def spawn_server(seed_file: str, port: int, extra_env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    """インメモリの保存先で api_server を起動（レート制限・デバウンスは無効）"""
+    env = dict(os.environ)
+    env.update({
+        "SED_STORAGE": "memory",
+        "SED_SEED_FILE": seed_file,
+        "SED_DEBOUNCE_SECONDS": "0",
+        "SED_RATE_LIMIT_DEVICE": "0",
+        "SED_RATE_LIMIT_GLOBAL": "0",
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING"),
+    })
+    env.update(extra_env or {})
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api_server:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT, env=env,
+    )
+
+
+def _dates(start: str, days: int) -> List[str]:
+    first = datetime.strptime(start, "%Y-%m-%d")
+    return [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="api_server の負荷試験")
+    parser.add_argument("--url", default="http://localhost:8010", help="api_server のURL（--spawn 時は無視）")
+    parser.add_argument("--spawn", action="store_true", help="インメモリの保存先で api_server を起動して計測")
+    parser.add_argument("--rate", type=float, default=20.0, help="平均到着レート（件/秒）")
+    parser.add_argument("--duration", type=float, default=30.0, help="計測時間（秒）")
+    parser.add_argument("--devices", type=int, default=20, help="デバイス数")
+    parser.add_argument("--dates", type=int, default=7, help="日数")
+    parser.add_argument("--start-date", default="2025-01-01", help="最初の日付")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="typical", help="--spawn 時の合成データ")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="操作の重み（analysis / aggregate / similar / tasks）")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="タスク状況のポーリング間隔（秒）")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="同時に待つリクエスト数の上限")
+    parser.add_argument("--slo", action="append", default=[], help="OP:pNN=MS（例: aggregate:p95=50）、複数指定可")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="許容するエラー率（操作ごと）")
+    parser.add_argument("--json", default=None, help="結果をJSONで保存するパス")
+    parser.add_argument("--seed", type=int, default=42, help="乱数シード")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    slos = [parse_slo(spec) for spec in args.slo]
+    device_ids = [f"load-device-{i:04d}" for i in range(args.devices)]
+    dates = _dates(args.start_date, args.dates)
+    keys = [(device_id, date) for device_id in device_ids for date in dates]
+
+    server = None
+    seed_path = None
+    url = args.url
+    try:
+        if args.spawn:
+            with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False, encoding='utf-8') as f:
+                for row in generate_rows(device_ids, dates, PROFILES[args.profile]):
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                seed_path = f.name
+            port = _free_port()
+            url = f"http://127.0.0.1:{port}"
+            server = spawn_server(seed_path, port)
+            asyncio.run(_wait_ready(url))
+            print(f"🚀 api_server を起動しました: {url}（{len(keys)}デバイス・日）")
+            asyncio.run(_prime(url, device_ids, dates))
+
+        generator = LoadGenerator(url, keys, mix, args.poll_interval, seed=args.seed)
+        stats, elapsed = asyncio.run(generator.run(args.rate, args.duration, args.max_in_flight))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+        if seed_path:
+            os.unlink(seed_path)
+
+    print(f"\n{'operation':<16} {'count':>7} {'rps':>8} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9} "
+          f"{'max(ms)':>9} {'miss':>6} {'rej':>6} {'err%':>6}")
+    print("-" * 96)
+    for s in stats:
+        print(f"{s.name:<16} {s.count:>7} {s.throughput:>8.1f} {s.p50_ms:>9.1f} {s.p95_ms:>9.1f} {s.p99_ms:>9.1f} "
+              f"{s.max_ms:>9.1f} {s.outcomes[MISS]:>6} {s.outcomes[REJECTED]:>6} {s.error_rate * 100:>6.2f}")
+    requests = sum(s.count for s in stats if s.name != "analysis.task")
+    print(f"\n⏱️  {elapsed:.1f}秒で{requests}リクエスト（{requests / elapsed:.1f}件/秒、目標 {args.rate:.1f}件/秒）")
+    if generator.dropped:
+        print(f"⚠️  同時リクエスト数の上限により {generator.dropped}件を送信しませんでした")
+
+    violations = []
+    for name, pct, limit in slos:
+        values = sorted(generator.recorder.latencies.get(name, ()))
+        observed = percentile(values, pct)
+        if values and observed > limit:
+            violations.append(f"{name} p{pct:g}={observed:.1f}ms > {limit:g}ms")
+    violations += [f"{s.name} エラー率 {s.error_rate:.2%}" for s in stats if s.error_rate > args.max_error_rate]
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                "rate": args.rate, "duration": elapsed, "keys": len(keys), "mix": mix, "dropped": generator.dropped,
+                "operations": [asdict(s) for s in stats], "violations": violations,
+            }, f, ensure_ascii=False, indent=2)
+
+    if violations:
+        print(f"\n❌ SLO違反: {', '.join(violations)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
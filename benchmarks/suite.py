@@ -0,0 +1,282 @@
+"""
+ベンチマークケースと計測ランナー
+
+各ケースは setup() で入力を作り、計測対象の関数（引数なし）を返す。
+asvと同様に setup は計測に含めず、計測対象を repeat 回実行した中央値・最小値を記録する。
+回帰チェックでは中央値を thresholds.json の上限（ミリ秒）と比較する。
+
+MEMORY_CASES は計測対象の1回の実行で確保されたメモリのピーク（tracemalloc、setupで作った入力は含まない）を
+記録し、thresholds.json の上限（KiB）と比較する。
+"""
+
+import asyncio
+import gc
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import profiles
+import serialization
+from sed_aggregator import SEDAggregator
+from sed_rules import get_rules
+from storage import MemoryStorage, SQLiteStorage
+
+from .importtime import profile_imports
+from .synthetic import DENSE_DAY, SPARSE_DAY, TYPICAL_DAY, DayProfile, generate_day, generate_rows
+
+THRESHOLDS_PATH = Path(__file__).with_name('thresholds.json')
+
+
+@dataclass
+class Case:
+    """ベンチマークケース"""
+    name: str
+    setup: Callable[[], Callable[[], object]]
+    repeat: int = 20
+
+
+@dataclass
+class Measurement:
+    """計測結果（ミリ秒）"""
+    name: str
+    median_ms: float
+    min_ms: float
+    repeat: int
+    threshold_ms: Optional[float] = None
+
+    @property
+    def regressed(self) -> bool:
+        return self.threshold_ms is not None and self.median_ms > self.threshold_ms
+
+
+@dataclass
+class MemoryMeasurement:
+    """計測結果（確保されたメモリのピーク、KiB）"""
+    name: str
+    peak_kib: float
+    threshold_kib: Optional[float] = None
+
+    @property
+    def regressed(self) -> bool:
+        return self.threshold_kib is not None and self.peak_kib > self.threshold_kib
+
+
+def _aggregator(rows: Optional[List[Dict]] = None) -> SEDAggregator:
+    storage = MemoryStorage()
+    storage.load_features(rows or [])
+    return SEDAggregator(storage)
+
+
+def _extract_case(profile: DayProfile) -> Callable[[], Callable[[], object]]:
+    def setup():
+        aggregator = _aggregator()
+        day = generate_day(profile)
+
+        def run():
+            for frames in day.values():
+                aggregator._count_events_from_data(frames)
+        return run
+    return setup
+
+
+def _time_blocks_case(profile: DayProfile) -> Callable[[], Callable[[], object]]:
+    def setup():
+        aggregator = _aggregator()
+        day = generate_day(profile)
+        rules = get_rules()
+        return lambda: aggregator._create_time_blocks(day, rules)
+    return setup
+
+
+def _ranking_case(profile: DayProfile) -> Callable[[], Callable[[], object]]:
+    def setup():
+        aggregator = _aggregator()
+        rules = get_rules()
+        time_blocks = aggregator._create_time_blocks(generate_day(profile), rules)
+        return lambda: aggregator._create_summary_ranking(time_blocks, rules)
+    return setup
+
+
+def _run_case(profile: DayProfile) -> Callable[[], Callable[[], object]]:
+    """取得 → 集計 → 保存の run 全体
+
+    同じ日を繰り返し実行するため、変更のない書き込みの省略（skip_unchanged）を無効にして
+    毎回保存（条件付き書き込み）まで計測する。
+    """
+    def setup():
+        aggregator = _aggregator(generate_rows(["bench-device"], ["2025-01-01"], profile))
+        aggregator.skip_unchanged = False
+        return lambda: asyncio.run(aggregator.run("bench-device", "2025-01-01"))
+    return setup
+
+
+def _task_list(n: int) -> Dict:
+    """GET /analysis/sed のレスポンス相当（完了タスクn件）"""
+    tasks = [
+        {
+            "task_id": f"00000000-0000-0000-0000-{i:012d}",
+            "status": "completed",
+            "message": "分析完了",
+            "progress": 100,
+            "device_id": f"device-{i % 50}",
+            "date": "2025-01-01",
+            "coalesced": 1,
+            "created_at": "2025-01-01T00:00:00",
+            "result": {
+                "message": "データはSupabaseのbehavior_summaryテーブルに保存されました",
+                "device_id": f"device-{i % 50}",
+                "date": "2025-01-01",
+                "rules_version": "1"
+            }
+        }
+        for i in range(n)
+    ]
+    return {"tasks": tasks, "total": n}
+
+
+def _serialize_case(build: Callable[[], object], dumps: Callable[[object], bytes]) -> Callable[[], Callable[[], object]]:
+    def setup():
+        payload = build()
+        return lambda: dumps(payload)
+    return setup
+
+
+def _day_result_row(profile: DayProfile) -> Callable[[], object]:
+    """audio_aggregator へのUPSERT本文（1日分）"""
+    def build():
+        aggregator = _aggregator()
+        result = aggregator.aggregate_data(generate_day(profile))
+        return aggregator.build_result_row(result, "bench-device", "2025-01-01")
+    return build
+
+
+def _similarity_case(days: int) -> Callable[[], Callable[[], object]]:
+    """days 日分のプロファイル行列での類似日検索（NumPy、未インストール時は標準ライブラリ）"""
+    def setup():
+        time_blocks = _aggregator().aggregate_data(generate_day(TYPICAL_DAY))['time_blocks']
+        rng = random.Random(42)
+        vectors = []
+        for _ in range(days):
+            # 1日分の集計結果の回数を日ごとにばらつかせる
+            day = {
+                slot: None if events is None else [
+                    {**item, "count": rng.randint(0, item["count"] * 2)} for item in events
+                ]
+                for slot, events in time_blocks.items()
+            }
+            vectors.append(profiles.unpack(profiles.pack(profiles.build_profile(day))))
+        dates = [f"day-{i:04d}" for i in range(days)]
+        matrix = profiles.ProfileMatrix(dates, vectors)
+        return lambda: matrix.most_similar(dates[0], 10)
+    return setup
+
+
+def _import_case(module: str) -> Callable[[], Callable[[], object]]:
+    """新しいプロセスで module をimportする時間（インタプリタの起動を含む、コールドスタートの目安）"""
+    def setup():
+        return lambda: profile_imports(module)
+    return setup
+
+
+CASES: List[Case] = [
+    Case("extract_events.typical", _extract_case(TYPICAL_DAY)),
+    Case("extract_events.dense", _extract_case(DENSE_DAY), repeat=5),
+    Case("create_time_blocks.sparse", _time_blocks_case(SPARSE_DAY)),
+    Case("create_time_blocks.typical", _time_blocks_case(TYPICAL_DAY)),
+    Case("create_time_blocks.dense", _time_blocks_case(DENSE_DAY), repeat=5),
+    Case("summary_ranking.typical", _ranking_case(TYPICAL_DAY)),
+    Case("summary_ranking.dense", _ranking_case(DENSE_DAY), repeat=5),
+    Case("run.typical", _run_case(TYPICAL_DAY)),
+    Case("run.dense", _run_case(DENSE_DAY), repeat=5),
+    # serialization.dumps（orjson、未インストール時は標準json）と標準jsonの比較
+    Case("serialize.day_result", _serialize_case(_day_result_row(DENSE_DAY), serialization.dumps)),
+    Case("serialize.day_result.stdlib", _serialize_case(_day_result_row(DENSE_DAY), serialization.stdlib_dumps)),
+    Case("serialize.task_list", _serialize_case(lambda: _task_list(5000), serialization.dumps)),
+    Case("serialize.task_list.stdlib", _serialize_case(lambda: _task_list(5000), serialization.stdlib_dumps)),
+    Case("similarity.365_days", _similarity_case(365)),
+    Case("startup.import_api_server", _import_case("api_server"), repeat=3),
+]
+
+
+def _aggregate_case(profile: DayProfile) -> Callable[[], Callable[[], object]]:
+    def setup():
+        aggregator = _aggregator()
+        day = generate_day(profile)
+        rules = get_rules()
+        return lambda: aggregator.aggregate_data(day, rules)
+    return setup
+
+
+def _sqlite_fetch_case(profile: DayProfile) -> Callable[[], Callable[[], object]]:
+    """SQLiteからの1日分の取得（JSONのデコードを含む。取得結果を保持した状態のピーク）"""
+    def setup():
+        storage = SQLiteStorage(":memory:")
+        storage.load_features(generate_rows(["bench-device"], ["2025-01-01"], profile))
+        return lambda: storage._fetch_slots("bench-device", "2025-01-01")
+    return setup
+
+
+# 1日分の集計（aggregate_data）・取得から保存まで（run）・SQLiteからの取得で確保されるメモリのピーク
+MEMORY_CASES: List[Case] = [
+    Case("memory.aggregate.typical", _aggregate_case(TYPICAL_DAY)),
+    Case("memory.aggregate.dense", _aggregate_case(DENSE_DAY)),
+    Case("memory.run.dense", _run_case(DENSE_DAY)),
+    Case("memory.sqlite_fetch.dense", _sqlite_fetch_case(DENSE_DAY)),
+]
+
+
+def load_thresholds(path: Path = THRESHOLDS_PATH) -> Dict[str, float]:
+    """回帰チェックの上限（ケース名 → ミリ秒、memory.* のケースはKiB）を読み込む"""
+    if not path.is_file():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def measure(case: Case, repeat: Optional[int] = None, threshold_ms: Optional[float] = None) -> Measurement:
+    """ケースを計測（setupは計測に含めない）"""
+    target = case.setup()
+    target()  # ウォームアップ
+    timings = []
+    for _ in range(repeat or case.repeat):
+        started = time.perf_counter()
+        target()
+        timings.append((time.perf_counter() - started) * 1000)
+    return Measurement(case.name, statistics.median(timings), min(timings), len(timings), threshold_ms)
+
+
+def run_all(pattern: str = "", repeat: Optional[int] = None) -> List[Measurement]:
+    """名前に pattern を含むケースを全て計測"""
+    thresholds = load_thresholds()
+    return [
+        measure(case, repeat, thresholds.get(case.name))
+        for case in CASES if pattern in case.name
+    ]
+
+
+def measure_memory(case: Case, threshold_kib: Optional[float] = None) -> MemoryMeasurement:
+    """ケースの1回の実行で確保されたメモリのピークを計測（setupは計測に含めない）"""
+    target = case.setup()
+    target()  # ウォームアップ（ルールのメモ化・ラベル表などの初回のみの確保を除く）
+    gc.collect()
+    tracemalloc.start()
+    try:
+        target()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return MemoryMeasurement(case.name, peak / 1024, threshold_kib)
+
+
+def run_memory(pattern: str = "") -> List[MemoryMeasurement]:
+    """名前に pattern を含むメモリのケースを全て計測"""
+    thresholds = load_thresholds()
+    return [
+        measure_memory(case, thresholds.get(case.name))
+        for case in MEMORY_CASES if pattern in case.name
+    ]
@@ -0,0 +1,114 @@
+"""
+behavior_extractor_result の合成データ生成
+
+audio_features.behavior_extractor_result と同じ形式
+（[{"time": 0.0, "events": [{"label": ..., "score": ...}, ...]}, ...]）の
+1日分（48スロット）のデータを、乱数シード固定で再現可能に生成する。
+"""
+
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 生活環境で検出されやすいAudioSetラベル（出現しやすい順）
+COMMON_LABELS: Tuple[str, ...] = (
+    "Speech", "Silence", "Inside, small room", "Music", "Television", "Conversation",
+    "Walk, footsteps", "Dishes, pots, and pans", "Water tap, faucet", "Sink (filling or washing)",
+    "Computer keyboard", "Typing", "Door", "Laughter", "Child speech, kid speaking",
+    "Cough", "Sneeze", "Sniff", "Snoring", "Breathing", "Throat clearing", "Hiccup",
+    "Vacuum cleaner", "Microwave oven", "Mechanical fan", "Air conditioning", "Clock", "Tick",
+    "Dog", "Bark", "Cat", "Bird", "Car", "Vehicle", "Rain", "Wind", "White noise", "Mains hum",
+    "Insect", "Cricket", "Snake", "Telephone bell ringing", "Alarm", "Beep, bleep", "Knock",
+    "Drawer open or close", "Cupboard open or close", "Keys jangling", "Toilet flush", "Pour",
+    "Drip", "Frying (food)", "Chopping (food)", "Cutlery, silverware", "Crying, sobbing",
+    "Baby cry, infant cry", "Singing", "Humming", "Whistling", "Clapping",
+)
+
+
+@dataclass
+class DayProfile:
+    """合成データの設定
+
+    Attributes:
+        frames_per_slot: 1スロットあたりのフレーム数
+        events_per_frame: 1フレームあたりのイベント数（上位N件）
+        labels: 使用するラベル
+        zipf_s: ラベル出現分布の偏り（大きいほど上位ラベルに集中）
+        empty_slot_ratio: データはあるがイベントが空（[]）のスロットの割合
+        null_slot_ratio: データが存在しない（行がない / null）スロットの割合
+        seed: 乱数シード
+    """
+    frames_per_slot: int = 60
+    events_per_frame: int = 3
+    labels: Sequence[str] = field(default=COMMON_LABELS)
+    zipf_s: float = 1.1
+    empty_slot_ratio: float = 0.05
+    null_slot_ratio: float = 0.1
+    seed: int = 42
+
+
+# ベンチマークで使う代表的な設定
+SPARSE_DAY = DayProfile(frames_per_slot=10, events_per_frame=2, null_slot_ratio=0.4)
+TYPICAL_DAY = DayProfile()
+DENSE_DAY = DayProfile(frames_per_slot=600, events_per_frame=5, null_slot_ratio=0.0, empty_slot_ratio=0.0)
+
+
+def time_slots() -> List[str]:
+    """30分スロットのリスト（00-00 から 23-30 まで）"""
+    return [f"{hour:02d}-{minute:02d}" for hour in range(24) for minute in (0, 30)]
+
+
+def generate_slot(rng: random.Random, profile: DayProfile, weights: List[float]) -> List[Dict]:
+    """1スロット分のbehavior_extractor_resultを生成"""
+    frames = []
+    k = min(profile.events_per_frame, len(profile.labels))
+    for i in range(profile.frames_per_slot):
+        labels = set()
+        while len(labels) < k:
+            labels.add(rng.choices(profile.labels, weights)[0])
+        frames.append({
+            "time": float(i),
+            "events": [
+                {"label": label, "score": round(rng.uniform(0.1, 0.99), 3)}
+                for label in labels
+            ]
+        })
+    return frames
+
+
+def generate_day(profile: DayProfile = TYPICAL_DAY) -> Dict[str, Optional[List[Dict]]]:
+    """1日分のスロットデータを生成
+
+    fetch_all_data の戻り値と同じく、データが存在しないスロットはキー自体を含めない。
+    イベントが空のスロットは、フレームはあるがeventsが空のリストとして生成する。
+    """
+    rng = random.Random(profile.seed)
+    weights = [1.0 / (rank ** profile.zipf_s) for rank in range(1, len(profile.labels) + 1)]
+
+    day: Dict[str, Optional[List[Dict]]] = {}
+    for slot in time_slots():
+        roll = rng.random()
+        if roll < profile.null_slot_ratio:
+            continue
+        if roll < profile.null_slot_ratio + profile.empty_slot_ratio:
+            day[slot] = [{"time": 0.0, "events": []}]
+            continue
+        day[slot] = generate_slot(rng, profile, weights)
+    return day
+
+
+def generate_rows(device_ids: Sequence[str], dates: Sequence[str],
+                  profile: DayProfile = TYPICAL_DAY) -> List[Dict]:
+    """audio_features の行形式（device_id, date, time_block, behavior_extractor_result）で生成"""
+    rows = []
+    for d, device_id in enumerate(device_ids):
+        for i, date in enumerate(dates):
+            day_profile = DayProfile(**{**profile.__dict__, "seed": profile.seed + d * 1000 + i})
+            for slot, result in generate_day(day_profile).items():
+                rows.append({
+                    "device_id": device_id,
+                    "date": date,
+                    "time_block": slot,
+                    "behavior_extractor_result": result,
+                })
+    return rows
@@ -0,0 +1,68 @@
+"""
+ベンチマークの回帰チェック（pytest）
+
+thresholds.json は通常の計測値の約5倍に設定しており、
+明らかな性能劣化（アルゴリズムの変更など）のみを検出する。
+処理時間は実行環境の負荷で変わるため、上限との比較は SED_BENCH_THRESHOLDS=1 の場合のみ行う。
+"""
+
+import os
+
+import pytest
+
+from .importtime import DEFERRED_MODULES, profile_imports
+from .loadtest import Recorder, parse_mix, parse_slo, percentile
+from .suite import CASES, MEMORY_CASES, load_thresholds, measure, measure_memory
+from .synthetic import DENSE_DAY, TYPICAL_DAY, generate_day
+
+thresholds_enabled = pytest.mark.skipif(os.getenv("SED_BENCH_THRESHOLDS") != "1",
+                                        reason="処理時間の上限チェックは SED_BENCH_THRESHOLDS=1 で有効")
+
+
+@thresholds_enabled
+@pytest.mark.parametrize("case", CASES, ids=[case.name for case in CASES])
+def test_case_within_threshold(case):
+    thresholds = load_thresholds()
+    assert case.name in thresholds, f"{case.name} の上限が thresholds.json にありません"
+    result = measure(case, repeat=3, threshold_ms=thresholds[case.name])
+    assert not result.regressed, f"{case.name}: {result.median_ms:.2f}ms > {result.threshold_ms}ms"
+
+
+@pytest.mark.parametrize("case", MEMORY_CASES, ids=[case.name for case in MEMORY_CASES])
+def test_memory_case_within_threshold(case):
+    thresholds = load_thresholds()
+    assert case.name in thresholds, f"{case.name} の上限が thresholds.json にありません"
+    result = measure_memory(case, threshold_kib=thresholds[case.name])
+    assert not result.regressed, f"{case.name}: {result.peak_kib:.0f}KiB > {result.threshold_kib}KiB"
+
+
+def test_synthetic_day_is_reproducible():
+    assert generate_day(TYPICAL_DAY) == generate_day(TYPICAL_DAY)
+
+
+def test_synthetic_day_shape():
+    day = generate_day(DENSE_DAY)
+    assert len(day) == 48
+    assert all(len(frames) == DENSE_DAY.frames_per_slot for frames in day.values())
+
+
+def test_api_server_defers_heavy_imports():
+    imported = {entry.name.split('.')[0] for entry in profile_imports("api_server")}
+    assert "api_server" in imported
+    assert not imported & set(DEFERRED_MODULES)
+
+
+def test_loadtest_report_helpers():
+    assert percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.0
+    assert percentile([1.0, 2.0, 3.0, 4.0], 99) == 4.0
+    assert parse_mix("analysis=1,aggregate=0,similar") == {"analysis": 1.0, "similar": 1.0}
+    assert parse_slo("aggregate:p95=50") == ("aggregate", 95.0, 50.0)
+    with pytest.raises(ValueError):
+        parse_mix("unknown=1")
+
+    recorder = Recorder()
+    for outcome in ("ok", "ok", "miss", "error"):
+        recorder.record("aggregate", 0.0, outcome)
+    [stats] = recorder.summarize(elapsed=2.0)
+    assert (stats.count, stats.throughput, stats.error_rate) == (4, 2.0, 0.25)
+    assert stats.outcomes == {"ok": 2, "miss": 1, "rejected": 0, "error": 1}
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+デバイス・日付単位のデバウンス
+
+同じキー（device_id, date）への更新が短時間に続いた場合に、
+最後の更新から一定時間（window）更新がなくなった時点で1回だけ処理するためのキュー。
+更新が続き続けても、最初の更新から max_wait 秒経過したら処理対象にする。
+
+時刻は呼び出し側から渡す（テストで時間を進められるようにするため）。
+"""
+
+from typing import Dict, Generic, Hashable, List, Optional, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+
+
+class _Pending:
+    __slots__ = ('first_seen', 'last_seen', 'count')
+
+    def __init__(self, now: float):
+        self.first_seen = now
+        self.last_seen = now
+        self.count = 1
+
+
+class Debouncer(Generic[K]):
+    """キー単位のデバウンスキュー"""
+
+    def __init__(self, window: float, max_wait: Optional[float] = None):
+        """
+        Args:
+            window: 最後の更新からこの秒数だけ更新がなければ処理対象にする
+            max_wait: 最初の更新からこの秒数経過したら更新が続いていても処理対象にする
+        """
+        self.window = window
+        self.max_wait = max_wait
+        self._pending: Dict[K, _Pending] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._pending
+
+    def touch(self, key: K, now: float) -> bool:
+        """更新を記録（新しく待機を開始したキーならTrue）"""
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = _Pending(now)
+            return True
+        pending.last_seen = now
+        pending.count += 1
+        return False
+
+    def deadline(self, key: K) -> Optional[float]:
+        """キーが処理対象になる時刻"""
+        pending = self._pending.get(key)
+        if pending is None:
+            return None
+        deadline = pending.last_seen + self.window
+        if self.max_wait is not None:
+            deadline = min(deadline, pending.first_seen + self.max_wait)
+        return deadline
+
+    def next_deadline(self) -> Optional[float]:
+        """最も早く処理対象になる時刻"""
+        deadlines = [self.deadline(key) for key in self._pending]
+        return min(deadlines) if deadlines else None
+
+    def pop_due(self, now: float, limit: Optional[int] = None) -> List[K]:
+        """処理対象になったキーを取り出す（古い順、最大limit件）"""
+        due = sorted(
+            (key for key in self._pending if self.deadline(key) <= now),
+            key=lambda key: self._pending[key].first_seen
+        )
+        if limit is not None:
+            due = due[:limit]
+        for key in due:
+            del self._pending[key]
+        return due
+
+    def discard(self, key: K) -> None:
+        """キーの待機を終了（処理を開始したキーを取り除く）"""
+        self._pending.pop(key, None)
+
+    def coalesced(self, key: K) -> int:
+        """キーに対してまとめられた更新の件数"""
+        pending = self._pending.get(key)
+        return pending.count if pending else 0
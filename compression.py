@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+レスポンス圧縮ミドルウェア
+
+Accept-Encoding に応じて brotli（brotliがインストールされている場合）または gzip で
+レスポンス本文を圧縮する。minimum_size 未満の本文・圧縮済みのレスポンス・
+圧縮済みの形式（Parquetなど）はそのまま返す。
+
+通常のレスポンスは本文をまとめてから圧縮する。ストリーミングのレスポンス（/export）は
+本文を保持せず、届いた分から逐次圧縮して送る。
+
+環境変数:
+    SED_COMPRESS_MIN_BYTES  圧縮する最小サイズ（バイト、デフォルト: 1024）
+"""
+
+import gzip
+import os
+import zlib
+from typing import List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotliは任意（未インストール時はgzipのみ）
+    brotli = None
+
+BROTLI_AVAILABLE = brotli is not None
+
+# 圧縮する最小サイズ（バイト）
+COMPRESS_MIN_BYTES = int(os.getenv('SED_COMPRESS_MIN_BYTES', '1024'))
+
+# 本文がすでに圧縮されている Content-Type
+INCOMPRESSIBLE_TYPES = ("application/vnd.apache.parquet",)
+
+
+def _accepted_encodings(accept_encoding: str) -> List[str]:
+    """Accept-Encodingから受け入れ可能な（q>0の）エンコーディングを取得"""
+    accepted = []
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name and quality > 0:
+            accepted.append(name)
+    return accepted
+
+
+class CompressionMiddleware:
+    """brotli / gzip 圧縮ミドルウェア"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESS_MIN_BYTES,
+                 gzip_level: int = 6, brotli_quality: int = 4):
+        """
+        Args:
+            app: ASGIアプリ
+            minimum_size: 圧縮する最小サイズ（バイト）
+            gzip_level: gzipの圧縮レベル（1-9）
+            brotli_quality: brotliの品質（0-11、大きいほど遅い）
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def choose_encoding(self, accept_encoding: str) -> Optional[str]:
+        """使用するエンコーディング（brotliを優先、どちらも不可ならNone）"""
+        accepted = _accepted_encodings(accept_encoding)
+        if BROTLI_AVAILABLE and 'br' in accepted:
+            return 'br'
+        if 'gzip' in accepted or '*' in accepted:
+            return 'gzip'
+        return None
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    def compressor(self, encoding: str):
+        """逐次圧縮用のオブジェクト（compress(chunk) / flush()）"""
+        if encoding == 'br':
+            return _BrotliStream(self.brotli_quality)
+        return zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        encoding = self.choose_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        chunks: List[bytes] = []
+        stream = None
+        passthrough = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, stream, passthrough
+            if message['type'] == 'http.response.start':
+                start = message
+                return
+            if message['type'] != 'http.response.body' or start is None or passthrough:
+                await send(message)
+                return
+
+            more_body = message.get('more_body', False)
+            if stream is None and not chunks and more_body:
+                # ストリーミングのレスポンス: 本文をまとめずに逐次圧縮する
+                headers = MutableHeaders(raw=start['headers'])
+                content_type = headers.get('content-type', '')
+                if 'content-encoding' in headers or content_type.startswith(INCOMPRESSIBLE_TYPES):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                stream = self.compressor(encoding)
+                headers['Content-Encoding'] = encoding
+                if 'content-length' in headers:
+                    del headers['content-length']
+                headers.add_vary_header('Accept-Encoding')
+                await send(start)
+
+            if stream is not None:
+                body = stream.compress(message.get('body', b''))
+                if not more_body:
+                    body += stream.flush()
+                if body or not more_body:
+                    await send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+                return
+
+            chunks.append(message.get('body', b''))
+            if more_body:
+                return
+
+            body = b''.join(chunks)
+            headers = MutableHeaders(raw=start['headers'])
+            if (len(body) >= self.minimum_size and 'content-encoding' not in headers
+                    and not headers.get('content-type', '').startswith(INCOMPRESSIBLE_TYPES)):
+                body = self.compress(body, encoding)
+                headers['Content-Encoding'] = encoding
+                headers['Content-Length'] = str(len(body))
+                headers.add_vary_header('Accept-Encoding')
+            await send(start)
+            await send({'type': 'http.response.body', 'body': body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+class _BrotliStream:
+    """brotli.Compressor を zlib の compressobj と同じ形で使うためのラッパー"""
+
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
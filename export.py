@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+集計結果のエクスポート（分析用のフラットな行）
+
+audio_aggregator の time_blocks を (device_id, date, slot, label, count) の行に展開し、
+NDJSON または Parquet（pyarrowがインストールされている場合）として少しずつ出力する。
+保存先からはページ単位（AggregatorStorage.iter_result_pages）で読み、1ページ分ずつ変換して出力するため、
+メモリ使用量は期間の長さによらず一定になる（1ページ = SED_EXPORT_PAGE_SIZE 日分）。
+"""
+
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import serialization
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrowは任意（未インストール時はNDJSONのみ）
+    pyarrow = None
+
+PARQUET_AVAILABLE = pyarrow is not None
+
+EXPORT_COLUMNS = ("device_id", "date", "slot", "label", "count")
+
+# NDJSONを出力する単位（バイト）
+CHUNK_BYTES = 256 * 1024
+
+# 出力形式 → Content-Type
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+ExportRow = Tuple[str, str, str, str, int]
+
+
+def flatten_result(device_id: str, date: str,
+                   time_blocks: Optional[Dict[str, Optional[List[Dict[str, Any]]]]]) -> Iterator[ExportRow]:
+    """time_blocksをスロット順・回数の多い順に (device_id, date, slot, label, count) に展開（イベントのないスロットは出力しない）"""
+    if not time_blocks:
+        return
+    for slot in sorted(time_blocks):
+        for item in time_blocks[slot] or ():
+            yield device_id, date, slot, item["event"], item["count"]
+
+
+def _flatten_page(page: List[Dict[str, Any]]) -> Iterator[ExportRow]:
+    for row in page:
+        yield from flatten_result(row['device_id'], row['date'], row.get('behavior_aggregator_result'))
+
+
+async def ndjson_stream(pages: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    """1ページ分ずつNDJSON（1行1イベント）に変換して出力"""
+    dumps = serialization.dumps
+    chunk = bytearray()
+    async for page in pages:
+        # 1行ずつ bytes のリストにすると、orjsonの出力（行ごとに確保される）がページ分残るため、1つのバッファに追記する
+        for row in _flatten_page(page):
+            chunk += dumps(dict(zip(EXPORT_COLUMNS, row)))
+            chunk += b"\n"
+            if len(chunk) >= CHUNK_BYTES:
+                yield bytes(chunk)
+                chunk = bytearray()
+    if chunk:
+        yield bytes(chunk)
+
+
+class _ChunkSink:
+    """ParquetWriterの書き込み先（書き込まれたバイト列を出力するまで保持する）"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data: Any) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parquet_schema():
+    return pyarrow.schema([
+        ("device_id", pyarrow.string()),
+        ("date", pyarrow.date32()),
+        ("slot", pyarrow.string()),
+        ("label", pyarrow.string()),
+        ("count", pyarrow.int32()),
+    ])
+
+
+async def parquet_stream(pages: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    """1ページ分ずつParquetの行グループとして書き込み、書き込まれた分から出力（pyarrowが必要）"""
+    if pyarrow is None:
+        raise RuntimeError("Parquet形式の出力には pyarrow が必要です")
+
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(sink, mode='w'), schema)
+    try:
+        async for page in pages:
+            columns: Dict[str, List[Any]] = {name: [] for name in EXPORT_COLUMNS}
+            for row in _flatten_page(page):
+                for name, value in zip(EXPORT_COLUMNS, row):
+                    columns[name].append(value)
+            if not columns["device_id"]:
+                continue
+            arrays = [
+                pyarrow.array(columns["device_id"], pyarrow.string()),
+                pyarrow.array(columns["date"], pyarrow.string()).cast(pyarrow.date32()),
+                pyarrow.array(columns["slot"], pyarrow.string()),
+                pyarrow.array(columns["label"], pyarrow.string()),
+                pyarrow.array(columns["count"], pyarrow.int32()),
+            ]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        # フッターを書き込む（途中で終了した場合もライターを閉じる）
+        writer.close()
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
+
+
+def export_stream(pages: AsyncIterator[List[Dict[str, Any]]], format: str) -> AsyncIterator[bytes]:
+    """出力形式（ndjson / parquet）に応じたストリーム"""
+    if format == "parquet":
+        return parquet_stream(pages)
+    return ndjson_stream(pages)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+ラベル文字列の共有表（インターン）
+
+JSONのデコードでは、同じラベルでもフレームごとに別のstrオブジェクトが作られる（1日で数万個）。
+取得したフレームのラベルをこの表の文字列に置き換えると、重複した文字列はすぐに解放され、
+集計で使うdictのキー・ルールのメモ・集計結果のイベント名も同じオブジェクトを共有する。
+表はプロセス全体（全リクエスト）で共有する。
+
+環境変数:
+    SED_LABEL_TABLE_SIZE  表に登録するラベル数の上限（デフォルト: 50000。超えたラベルはそのまま使う）
+"""
+
+import os
+from typing import Any, Dict, List
+
+LABEL_TABLE_SIZE = int(os.getenv('SED_LABEL_TABLE_SIZE', '50000'))
+
+
+class LabelTable:
+    """ラベル文字列の共有表"""
+
+    __slots__ = ('max_size', '_labels')
+
+    def __init__(self, max_size: int = LABEL_TABLE_SIZE):
+        self.max_size = max_size
+        self._labels: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    def intern(self, label: str) -> str:
+        """表に登録済みの同じ内容の文字列を返す（未登録なら登録する）"""
+        shared = self._labels.get(label)
+        if shared is not None:
+            return shared
+        if len(self._labels) >= self.max_size:
+            return label
+        return self._labels.setdefault(label, label)
+
+    def intern_frames(self, frames: Any) -> Any:
+        """behavior_extractor_result のイベントのラベルをその場で置き換え、frames を返す"""
+        if not isinstance(frames, list):
+            return frames
+        intern = self.intern
+        for frame in frames:
+            events: List[Any] = frame.get('events') if isinstance(frame, dict) else None
+            if not events:
+                continue
+            for event in events:
+                if isinstance(event, dict):
+                    label = event.get('label')
+                    if isinstance(label, str):
+                        event['label'] = intern(label)
+        return frames
+
+
+label_table = LabelTable()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+ラベル翻訳（ローカライズ）モジュール
+
+集計結果は英語ラベルのまま保存し、読み出し時（レスポンスのシリアライズ直前）に
+リクエストされた言語へ翻訳する。
+
+- 翻訳辞書は locales/<lang>.json（AudioSetラベル → 各言語）から言語ごとに一度だけ読み込み、
+  キー・値ともに sys.intern して保持する
+- 翻訳済みレスポンスは (キー, 言語) 単位でLRUキャッシュする
+- 辞書にないラベルは英語のまま返す
+"""
+
+import json
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+# 翻訳辞書のディレクトリ
+LOCALES_DIR = Path(__file__).with_name('locales')
+
+# 保存データの言語（翻訳しない）
+SOURCE_LANGUAGE = "en"
+
+# 翻訳済みレスポンスのキャッシュ件数
+RESPONSE_CACHE_SIZE = 1024
+
+_dictionaries: Dict[str, Dict[str, str]] = {}
+_lock = threading.Lock()
+
+
+def available_languages() -> List[str]:
+    """利用可能な言語の一覧"""
+    return [SOURCE_LANGUAGE] + sorted(p.stem for p in LOCALES_DIR.glob('*.json'))
+
+
+def get_dictionary(lang: str) -> Dict[str, str]:
+    """言語の翻訳辞書を取得（初回のみファイルから読み込む）
+
+    Raises:
+        ValueError: 対応していない言語の場合
+    """
+    dictionary = _dictionaries.get(lang)
+    if dictionary is not None:
+        return dictionary
+
+    with _lock:
+        if lang not in _dictionaries:
+            path = LOCALES_DIR / f"{lang}.json"
+            if lang == SOURCE_LANGUAGE:
+                _dictionaries[lang] = {}
+            elif path.parent != LOCALES_DIR or not path.is_file():
+                raise ValueError(f"対応していない言語です: {lang}")
+            else:
+                with open(path, 'r', encoding='utf-8') as f:
+                    _dictionaries[lang] = {
+                        sys.intern(label): sys.intern(translated)
+                        for label, translated in json.load(f).items()
+                    }
+        return _dictionaries[lang]
+
+
+def translate_label(label: str, dictionary: Dict[str, str]) -> str:
+    """ラベルを翻訳（"English / 日本語" 形式のラベルは英語部分で引く）"""
+    translated = dictionary.get(label)
+    if translated is not None:
+        return translated
+    if ' / ' in label:
+        return dictionary.get(label.split(' / ', 1)[0], label)
+    return label
+
+
+def translate_time_blocks(time_blocks: Dict[str, Optional[List[Dict[str, Any]]]],
+                          lang: str) -> Dict[str, Optional[List[Dict[str, Any]]]]:
+    """time_blocksのイベント名を翻訳（元のデータは変更しない）"""
+    dictionary = get_dictionary(lang)
+    if not dictionary:
+        return time_blocks
+    return {
+        slot: None if events is None else [
+            {**item, "event": translate_label(item["event"], dictionary)} for item in events
+        ]
+        for slot, events in time_blocks.items()
+    }
+
+
+def translate_ranking(ranking: List[Dict[str, Any]], lang: str) -> List[Dict[str, Any]]:
+    """summary_rankingのイベント名を翻訳（元のデータは変更しない）"""
+    dictionary = get_dictionary(lang)
+    if not dictionary:
+        return ranking
+    return [{**item, "event": translate_label(item["event"], dictionary)} for item in ranking]
+
+
+def translate_result(result: Dict[str, Any], lang: str) -> Dict[str, Any]:
+    """集計結果（time_blocks / summary_ranking / anomalies を含むdict）を翻訳"""
+    if lang == SOURCE_LANGUAGE:
+        return result
+    translated = dict(result)
+    if result.get("time_blocks") is not None:
+        translated["time_blocks"] = translate_time_blocks(result["time_blocks"], lang)
+    if result.get("summary_ranking") is not None:
+        translated["summary_ranking"] = translate_ranking(result["summary_ranking"], lang)
+    if result.get("anomalies") is not None:
+        translated["anomalies"] = translate_ranking(result["anomalies"], lang)
+    translated["lang"] = lang
+    return translated
+
+
+class TranslationCache:
+    """翻訳済みレスポンスのLRUキャッシュ"""
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_translate(self, key: Hashable, lang: str,
+                         build: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """キャッシュ済みの翻訳結果を返す（なければ build() の結果を翻訳して保存）
+
+        key には保存データの更新時刻など、内容が変わると変化する値を含めること。
+        """
+        cache_key = (key, lang)
+        with self._lock:
+            cached = self._entries.get(cache_key)
+            if cached is not None:
+                self._entries.move_to_end(cache_key)
+                return cached
+
+        translated = translate_result(build(), lang)
+
+        with self._lock:
+            self._entries[cache_key] = translated
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return translated
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = TranslationCache()
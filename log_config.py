@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+構造化ログ設定
+
+- JSON形式（1行1レコード）でログを出力し、タスク単位の相関ID（correlation_id）を付与する
+- モジュール別のログレベルを環境変数で設定できる
+- SEDAggregatorのステージ所要時間をタスク単位で集め、完了ログにまとめて出力する
+
+環境変数:
+    LOG_LEVEL   全体のログレベル（デフォルト: INFO）
+    LOG_LEVELS  モジュール別のログレベル（例: "sed_aggregator=DEBUG,httpx=WARNING"）
+    LOG_FORMAT  json（デフォルト）または text
+
+使い方:
+    logger.info("集計完了", extra=fields(total_events=42))
+"""
+
+import json
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+# タスク単位の相関ID
+correlation_id: ContextVar[Optional[str]] = ContextVar('correlation_id', default=None)
+
+# タスク単位のステージ所要時間（ミリ秒）
+stage_durations: ContextVar[Optional[Dict[str, float]]] = ContextVar('stage_durations', default=None)
+
+# ログレコードの標準属性（extraとして出力しない）
+_RESERVED = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+def fields(**values: Any) -> Dict[str, Any]:
+    """構造化フィールドを extra 引数の形式で返す"""
+    return {"fields": values}
+
+
+def bind_task(task_id: str) -> None:
+    """現在のコンテキストにタスクの相関IDを設定し、ステージ所要時間の記録を開始"""
+    correlation_id.set(task_id)
+    stage_durations.set({})
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """SEDAggregator.stage_hooks 用: 現在のタスクのステージ所要時間を記録"""
+    durations = stage_durations.get()
+    if durations is not None:
+        durations[stage] = round(durations.get(stage, 0.0) + seconds * 1000, 3)
+
+
+class JSONFormatter(logging.Formatter):
+    """1行1レコードのJSONフォーマッター"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        task_id = correlation_id.get()
+        if task_id is not None:
+            entry["correlation_id"] = task_id
+        values = getattr(record, 'fields', None)
+        if values:
+            entry.update(values)
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and key != 'fields' and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """人が読むためのテキストフォーマッター（CLI・ローカル開発用）"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        task_id = correlation_id.get()
+        values = dict(getattr(record, 'fields', None) or {})
+        if task_id is not None:
+            values = {"correlation_id": task_id, **values}
+        if values:
+            text += " " + " ".join(f"{key}={value}" for key, value in values.items())
+        return text
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """"module=LEVEL,module=LEVEL" 形式をパース"""
+    levels: Dict[str, int] = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        name, level = item.split('=', 1)
+        levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return {name: level for name, level in levels.items() if isinstance(level, int)}
+
+
+def configure_logging(default_format: str = "json") -> None:
+    """ルートロガーを構造化ログ用に設定"""
+    log_format = os.getenv('LOG_FORMAT', default_format).lower()
+    handler = logging.StreamHandler()
+    handler.setFormatter(TextFormatter() if log_format == 'text' else JSONFormatter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+    # リクエスト毎のhttpxログはデフォルトで抑制
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    for name, level in parse_levels(os.getenv('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level)
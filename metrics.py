@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Prometheus形式のメトリクス
+
+外部ライブラリに依存しない最小限のCounter / Gauge / Histogramを提供し、
+/metrics エンドポイントでテキスト形式（text/plain; version=0.0.4）として出力する。
+SEDAggregatorの計測フック（stage_hooks / counter_hooks）と
+SupabaseStorage.payload_hooks から値を受け取る。
+"""
+
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# レスポンスのContent-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 処理時間ヒストグラムのバケット（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """単調増加カウンター"""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """増減する値（collect を指定した場合は出力時に値を取得する）"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 collect: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._collect = collect
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterable[str]:
+        if self._collect is not None:
+            items = list(self._collect().items())
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """累積バケット付きヒストグラム"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # ラベル値 → [バケット毎の件数..., 合計, 件数]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels: str) -> int:
+        state = self._values.get(self._key(labels))
+        return int(state[-1]) if state else 0
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(state[-2])}"
+            yield f"{self.name}_count{labels} {int(state[-1])}"
+
+
+class Registry:
+    """メトリクスの登録と出力"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+# ==================== 集計パイプライン ====================
+
+STAGE_SECONDS = registry.register(Histogram(
+    "sed_stage_duration_seconds", "SEDAggregatorの処理ステージ別所要時間", ["stage"]
+))
+PAYLOAD_BYTES = registry.register(Counter(
+    "sed_fetch_payload_bytes_total", "audio_featuresから取得したレスポンスのバイト数"
+))
+FRAMES = registry.register(Counter(
+    "sed_frames_processed_total", "処理したbehavior_extractor_resultのフレーム数"
+))
+EVENTS = registry.register(Counter(
+    "sed_events_processed_total", "処理した生イベント数（ルール適用前）"
+))
+ANOMALIES = registry.register(Counter(
+    "sed_anomalies_flagged_total", "デバイスのベースラインと比べて異常と判定したスロット・ラベル数"
+))
+SUPABASE_ERRORS = registry.register(Counter(
+    "sed_supabase_errors_total", "Supabase呼び出しのエラー数", ["operation", "reason"]
+))
+RESULT_WRITES = registry.register(Counter(
+    "sed_result_writes_total",
+    "audio_aggregatorへの集計結果の書き込み数（skipped: 保存済みと同じため省略、stale: 保存済みの方が新しいため破棄、"
+    "merged: 保存済みの新しいスロットを取り込み、reaggregated: ルールバージョンが異なるため読み直して集計し直し、"
+    "conflict: 他の書き込みと競合して読み直し）", ["outcome"]
+))
+SUPABASE_EVENTS = registry.register(Counter(
+    "sed_supabase_resilience_events_total", "Supabase呼び出しのリトライ・遮断・最終失敗の回数", ["event", "operation"]
+))
+
+# ==================== タスク ====================
+
+TASKS = registry.register(Counter(
+    "sed_tasks_total", "終了した分析タスク数", ["status"]
+))
+TASKS_IN_FLIGHT = registry.register(Gauge(
+    "sed_tasks_in_flight", "実行中の分析タスク数"
+))
+COALESCED_REQUESTS = registry.register(Counter(
+    "sed_coalesced_requests_total", "デバウンスにより既存タスクにまとめた分析リクエスト数"
+))
+
+RATE_LIMITED = registry.register(Counter(
+    "sed_rate_limited_requests_total", "レート制限で拒否した分析リクエスト数（scope: device / global）", ["scope"]
+))
+
+# SEDAggregatorのcounter_hooksで受け取る名前 → Counter
+_COUNTERS = {
+    "frames": FRAMES,
+    "events": EVENTS,
+    "supabase_errors": SUPABASE_ERRORS,
+    "result_writes": RESULT_WRITES,
+    "anomalies": ANOMALIES,
+}
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """SEDAggregator.stage_hooks 用: ステージ所要時間を記録"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def count(name: str, amount: float, labels: Dict[str, str]) -> None:
+    """SEDAggregator.counter_hooks 用: カウンターを加算"""
+    counter = _COUNTERS.get(name)
+    if counter is not None:
+        counter.inc(amount, **labels)
+
+
+def observe_payload(size: int) -> None:
+    """SupabaseStorage.payload_hooks 用: 取得したレスポンスのバイト数を加算"""
+    PAYLOAD_BYTES.inc(size)
+
+
+def observe_storage_event(event: str, operation: str) -> None:
+    """ResiliencePolicy.event_hooks 用: リトライ・遮断・最終失敗を記録"""
+    SUPABASE_EVENTS.inc(event=event, operation=operation)
+
+
+def register_task_gauge(collect: Callable[[], Dict[str, int]]) -> None:
+    """タスク状態別の件数（出力時に collect() で取得）を登録"""
+    registry.register(Gauge(
+        "sed_tasks", "状態別のタスク数（task_status内）", ["status"],
+        collect=lambda: {(status,): n for status, n in collect().items()}
+    ))
+
+
+def render() -> str:
+    """全メトリクスをテキスト形式で出力"""
+    return registry.render()
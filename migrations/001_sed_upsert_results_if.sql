@@ -0,0 +1,61 @@
+-- 集計結果の条件付きUPSERT（storage.SupabaseStorage.upsert_results_if から呼び出す）
+--
+-- payload の各行を、保存済みの behavior_aggregator_processed_at が expected_processed_at と
+-- 一致する場合のみ書き込み、書き込んだ行の位置（0始まり）を返す。比較と書き込みは行ごとに不可分に行う。
+-- expected_processed_at が NULL の行は、未保存の場合、または保存済みの行に集計結果がない場合
+-- （audio_aggregator は他の集計と共有しているため、behavior_aggregator_processed_at が NULL の行がある）に書き込む。
+-- MemoryStorage / SQLiteStorage の upsert_results_if と同じ動作。
+
+CREATE OR REPLACE FUNCTION sed_upsert_results_if(payload JSONB)
+RETURNS SETOF INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    item JSONB;
+    idx INTEGER;
+    expected TIMESTAMPTZ;
+BEGIN
+    FOR item, idx IN SELECT value, ordinality - 1 FROM jsonb_array_elements(payload) WITH ORDINALITY LOOP
+        expected := (item ->> 'expected_processed_at')::TIMESTAMPTZ;
+        item := item - 'expected_processed_at';
+        -- 保存済みの更新時刻が一致する（expected が NULL なら集計結果が未保存の）行のみ更新
+        -- （指定のない列は保存済みの値のまま）
+        UPDATE audio_aggregator AS t
+        SET (
+            behavior_aggregator_result, behavior_aggregator_processed_at,
+            behavior_aggregator_rules_version, behavior_aggregator_labels,
+            behavior_aggregator_hash, behavior_aggregator_anomalies,
+            behavior_aggregator_profile, behavior_aggregator_slot_versions
+        ) = (
+            SELECT r.behavior_aggregator_result, r.behavior_aggregator_processed_at,
+                   r.behavior_aggregator_rules_version, r.behavior_aggregator_labels,
+                   r.behavior_aggregator_hash, r.behavior_aggregator_anomalies,
+                   r.behavior_aggregator_profile, r.behavior_aggregator_slot_versions
+            FROM jsonb_populate_record(t, item) AS r
+        )
+        WHERE t.device_id = item ->> 'device_id'
+          AND t.date = (item ->> 'date')::DATE
+          AND t.behavior_aggregator_processed_at IS NOT DISTINCT FROM expected;
+        IF NOT FOUND AND expected IS NULL THEN
+            -- 行がない場合のみ追加（並行して追加された場合は競合として扱う）
+            INSERT INTO audio_aggregator (
+                device_id, date,
+                behavior_aggregator_result, behavior_aggregator_processed_at,
+                behavior_aggregator_rules_version, behavior_aggregator_labels,
+                behavior_aggregator_hash, behavior_aggregator_anomalies,
+                behavior_aggregator_profile, behavior_aggregator_slot_versions
+            )
+            SELECT r.device_id, r.date,
+                   r.behavior_aggregator_result, r.behavior_aggregator_processed_at,
+                   r.behavior_aggregator_rules_version, r.behavior_aggregator_labels,
+                   r.behavior_aggregator_hash, r.behavior_aggregator_anomalies,
+                   r.behavior_aggregator_profile, r.behavior_aggregator_slot_versions
+            FROM jsonb_populate_record(NULL::audio_aggregator, item) AS r
+            ON CONFLICT (device_id, date) DO NOTHING;
+        END IF;
+        IF FOUND THEN
+            RETURN NEXT idx;
+        END IF;
+    END LOOP;
+END;
+$$;
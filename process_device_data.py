@@ -6,6 +6,7 @@
 import asyncio
 import os
 from datetime import datetime
+from localization import translate_result
 from sed_aggregator import SEDAggregator
 from dotenv import load_dotenv
 
@@ -32,13 +33,14 @@ async def process_device_data():
     print("処理を開始します...")
     print("-" * 40)
     
-    # 日本語翻訳ありで処理
-    result = await aggregator.run(device_id, date, translate=True)
+    result = await aggregator.run(device_id, date)
     
     if result["success"]:
         print("\n✅ 処理成功！")
         
         if "result" in result:
+            # 保存データは英語のまま、表示用に日本語へ翻訳
+            result["result"] = translate_result(result["result"], "ja")
             summary = result["result"]["summary_ranking"]
             
             print(f"\n📊 生活音ランキング（全{len(summary)}件）:")
@@ -91,6 +93,8 @@ async def process_device_data():
         if result.get("reason") == "no_data":
             print("\n💡 ヒント: この日付にはデータが存在しない可能性があります。")
             print("   behavior_yamnetテーブルにデータがあるか確認してください。")
+        elif result.get("reason"):
+            print(f"\n💡 ヒント: Supabaseの呼び出しに失敗しました（{result['reason']}）。時間をおいて再実行してください。")
     
     print()
     print("=" * 60)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+1日の活動プロファイル（固定長ベクトル）と類似日検索
+
+time_blocks から「30分スロット × イベントグループ」の回数行列を作り、log(1 + 回数) をL2正規化した
+固定長ベクトル（48 × len(PROFILE_GROUPS)）を1日のプロファイルとする。
+プロファイルは float32 のリトルエンディアン配列をbase64にした文字列として
+audio_aggregator.behavior_aggregator_profile に保存する。
+
+正規化済みのため、コサイン類似度はベクトルの内積になる。類似日検索ではデバイスの全プロファイルを
+行列として読み込み（デバイスごとにキャッシュ）、行列 × ベクトルで一度に計算する。
+NumPyがインストールされていればNumPyで、なければ標準ライブラリで計算する。
+
+環境変数:
+    SED_PROFILE_CACHE_TTL      デバイスごとのプロファイル行列のキャッシュ秒数（デフォルト: 300）
+    SED_PROFILE_CACHE_DEVICES  キャッシュするデバイス数（デフォルト: 256）
+"""
+
+import base64
+import math
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy
+except ImportError:  # NumPyは任意
+    numpy = None
+
+NUMPY_AVAILABLE = numpy is not None
+
+# プロファイルのイベントグループ（READMEの優先カテゴリー + その他）。順番を変えると保存済みのプロファイルと比較できなくなる
+PROFILE_GROUPS = ("biometric", "voice", "daily_life", "other")
+
+# 30分スロット（00-00 から 23-30 まで）
+PROFILE_SLOTS = tuple(f"{hour:02d}-{minute:02d}" for hour in range(24) for minute in (0, 30))
+
+PROFILE_LENGTH = len(PROFILE_SLOTS) * len(PROFILE_GROUPS)
+
+# イベント（英語ラベル、統合後の名前を含む） → グループ。ここにないイベントは "other"
+_GROUP_EVENTS = {
+    "biometric": (
+        "Cough", "Sneeze", "Sniff", "Snoring", "Breathing", "Hiccup", "Throat clearing", "Gasp",
+        "Wheeze", "Pant", "Snort", "Burping, eructation", "Chewing, mastication", "Heart sounds, heartbeat",
+    ),
+    "voice": (
+        "Speech", "Child speech", "Child speech, kid speaking", "Conversation", "Narration, monologue",
+        "Male speech, man speaking", "Female speech, woman speaking", "Laughter", "Baby laughter", "Giggle",
+        "Chuckle, chortle", "Crying, sobbing", "Baby cry, infant cry", "Shout", "Yell", "Screaming",
+        "Whispering", "Singing", "Babbling", "Children shouting", "Children playing",
+    ),
+    "daily_life": (
+        "Water sounds", "Water tap, faucet", "Sink (filling or washing)", "Pour", "Drip", "Dishes",
+        "Dishes, pots, and pans", "Cutlery, silverware", "Footsteps", "Walk, footsteps", "Run", "Shuffle",
+        "Typing", "Computer keyboard", "Typing (computer)", "Door", "Doorbell", "Door knocker", "Knock",
+        "Microwave oven", "Vacuum cleaner", "Toilet flush", "Frying (food)", "Chopping (food)",
+        "Television", "Writing", "Keys jangling", "Drawer open or close", "Cupboard open or close",
+    ),
+}
+_EVENT_GROUP: Dict[str, int] = {
+    sys.intern(event): PROFILE_GROUPS.index(group) for group, events in _GROUP_EVENTS.items() for event in events
+}
+_OTHER = PROFILE_GROUPS.index("other")
+
+PROFILE_CACHE_TTL = float(os.getenv('SED_PROFILE_CACHE_TTL', '300'))
+PROFILE_CACHE_DEVICES = int(os.getenv('SED_PROFILE_CACHE_DEVICES', '256'))
+
+
+def profile_group(event: str) -> int:
+    """イベントのグループ番号（"English / 日本語" 形式のラベルは英語部分で判定）"""
+    group = _EVENT_GROUP.get(event)
+    if group is None and ' / ' in event:
+        group = _EVENT_GROUP.get(event.split(' / ', 1)[0])
+    return _OTHER if group is None else group
+
+
+def build_profile(time_blocks: Dict[str, Optional[List[Dict[str, Any]]]]) -> List[float]:
+    """time_blocksから正規化済みのプロファイル（長さ PROFILE_LENGTH）を作成（イベントがなければ全て0）"""
+    groups = len(PROFILE_GROUPS)
+    vector = [0.0] * PROFILE_LENGTH
+    for i, slot in enumerate(PROFILE_SLOTS):
+        for item in time_blocks.get(slot) or ():
+            vector[i * groups + profile_group(item["event"])] += item["count"]
+
+    vector = [math.log1p(value) for value in vector]
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector] if norm else vector
+
+
+def pack(vector: Sequence[float]) -> str:
+    """プロファイルをfloat32のリトルエンディアン配列（base64）に変換"""
+    packed = array('f', vector)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode('ascii')
+
+
+def unpack(data: str) -> array:
+    """pack の逆変換"""
+    vector = array('f')
+    vector.frombytes(base64.b64decode(data))
+    if sys.byteorder != 'little':
+        vector.byteswap()
+    return vector
+
+
+class ProfileMatrix:
+    """デバイスの全プロファイル（日付順）を1つの行列にまとめたもの"""
+
+    def __init__(self, dates: List[str], vectors: List[array]):
+        self.dates = dates
+        self._row = {date: i for i, date in enumerate(dates)}
+        if numpy is not None and vectors:
+            self.matrix = numpy.frombuffer(b''.join(v.tobytes() for v in vectors), dtype=numpy.float32)
+            self.matrix = self.matrix.reshape(len(vectors), PROFILE_LENGTH)
+        else:
+            self.matrix = vectors
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def __contains__(self, date: str) -> bool:
+        return date in self._row
+
+    def similarities(self, date: str) -> List[float]:
+        """date のプロファイルと全ての日のコサイン類似度（正規化済みのため内積）"""
+        query = self.matrix[self._row[date]]
+        if numpy is not None and not isinstance(self.matrix, list):
+            return (self.matrix @ query).tolist()
+        return [math.fsum(a * b for a, b in zip(row, query)) for row in self.matrix]
+
+    def most_similar(self, date: str, limit: int) -> List[Tuple[str, float]]:
+        """date に似ている日を類似度の高い順に返す（date 自身は含めない）"""
+        scored = [(other, score) for other, score in zip(self.dates, self.similarities(date)) if other != date]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return [(other, round(score, 4)) for other, score in scored[:limit]]
+
+
+# デバイスIDからプロファイル行（date, behavior_aggregator_profile）を取得する関数
+ProfileLoader = Callable[[str], Awaitable[List[Dict[str, Any]]]]
+
+
+class ProfileIndex:
+    """デバイスごとのプロファイル行列のキャッシュ（TTL付きLRU）"""
+
+    def __init__(self, ttl: float = PROFILE_CACHE_TTL, max_devices: int = PROFILE_CACHE_DEVICES,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_devices = max_devices
+        self.clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, ProfileMatrix]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, device_id: str, load: ProfileLoader) -> ProfileMatrix:
+        """デバイスのプロファイル行列を取得（キャッシュがないか期限切れなら load で読み込む）"""
+        now = self.clock()
+        with self._lock:
+            cached = self._entries.get(device_id)
+            if cached is not None and now - cached[0] < self.ttl:
+                self._entries.move_to_end(device_id)
+                return cached[1]
+
+        vectors = {
+            row['date']: unpack(row['behavior_aggregator_profile'])
+            for row in await load(device_id) if row.get('behavior_aggregator_profile')
+        }
+        # 長さの異なるプロファイル（グループ定義の変更前に保存されたもの）は比較できないため除く
+        dates = sorted(date for date, vector in vectors.items() if len(vector) == PROFILE_LENGTH)
+        matrix = ProfileMatrix(dates, [vectors[date] for date in dates])
+
+        with self._lock:
+            self._entries[device_id] = (now, matrix)
+            self._entries.move_to_end(device_id)
+            while len(self._entries) > self.max_devices:
+                self._entries.popitem(last=False)
+        return matrix
+
+    def invalidate(self, device_id: str) -> None:
+        """デバイスのキャッシュを破棄（プロファイルを書き込んだとき）"""
+        with self._lock:
+            self._entries.pop(device_id, None)
+
+    def on_written(self, rows: List[Dict[str, Any]]) -> None:
+        """SEDAggregator.write_hooks 用: 書き込んだデバイスのキャッシュを破棄"""
+        for device_id in {row['device_id'] for row in rows}:
+            self.invalidate(device_id)
+
+
+profile_index = ProfileIndex()
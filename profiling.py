@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+分析タスクのプロファイル取得（オプトイン・遅いタスクのサンプリング）
+
+SEDAggregator.run の実行をプロファイラーで囲み、結果をタスクIDごとに保持する
+（GET /analysis/sed/{task_id}/profile でダウンロード）。
+
+- オプトイン: POST /analysis/sed?profile=true または X-SED-Profile: 1 ヘッダー
+  （SED_PROFILE_TOKEN を設定した場合は X-SED-Profile-Token ヘッダーが一致するときのみ）
+- サンプリング: SED_PROFILE_SAMPLE_RATE の割合のタスクをプロファイルし、
+  SED_PROFILE_SLOW_SECONDS 以上かかったものだけを保持する
+- プロファイラーはcProfile（標準ライブラリ）。pyinstrumentがインストールされていれば
+  SED_PROFILER=pyinstrument で使用できる（asyncioの待ち時間を呼び出し元に帰属できる）
+- 同時にプロファイルできるのは1タスクのみ（実行中の場合はプロファイルせずに実行する）。
+  cProfileはイベントループのスレッド全体を計測するため、並行して動いている他のタスクの処理も含まれる。
+  プロセスプール（SED_POOL_WORKERS）で実行した集計はワーカープロセス内のため含まれない
+
+環境変数:
+    SED_PROFILER              cprofile（デフォルト） / pyinstrument
+    SED_PROFILE_TOKEN         オプトインに必要なトークン（未設定ならトークンなしでオプトインできる。本番では設定してください）
+    SED_PROFILE_SAMPLE_RATE   自動でプロファイルするタスクの割合（デフォルト: 0、0〜1）
+    SED_PROFILE_SLOW_SECONDS  サンプリングしたタスクを保持する所要時間の下限（秒、デフォルト: 5）
+    SED_PROFILE_KEEP          保持するプロファイル数（デフォルト: 50、古い順に破棄）
+    SED_PROFILE_TOP           テキスト出力に含める関数の数（デフォルト: 50）
+"""
+
+import cProfile
+import hmac
+import io
+import logging
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+from log_config import fields
+
+try:
+    import pyinstrument
+except ImportError:  # pyinstrumentは任意
+    pyinstrument = None
+
+logger = logging.getLogger(__name__)
+
+CPROFILE = "cprofile"
+PYINSTRUMENT = "pyinstrument"
+
+# プロファイルを取得した理由
+REQUESTED = "requested"
+SAMPLED = "sampled"
+
+
+class CapturedProfile:
+    """1タスク分のプロファイル"""
+
+    __slots__ = ('task_id', 'profiler', 'reason', 'seconds', 'created_at', 'text', 'data', 'html')
+
+    def __init__(self, task_id: str, profiler: str, reason: str, seconds: float, text: str,
+                 data: Optional[bytes] = None, html: Optional[str] = None):
+        self.task_id = task_id
+        self.profiler = profiler
+        self.reason = reason
+        self.seconds = seconds
+        self.created_at = datetime.now().isoformat()
+        self.text = text
+        self.data = data  # cProfile: pstatsで読み込めるバイナリ（.prof）
+        self.html = html  # pyinstrument: HTMLレポート
+
+    def summary(self) -> Dict[str, Any]:
+        """タスク状況に含める概要"""
+        return {
+            "profiler": self.profiler,
+            "reason": self.reason,
+            "seconds": round(self.seconds, 3),
+            "formats": ["text"] + (["pstats"] if self.data else []) + (["html"] if self.html else []),
+        }
+
+
+class _Capture:
+    """capture() の中で取得したプロファイル（保持しなかった場合はNone）"""
+
+    __slots__ = ('profile',)
+
+    def __init__(self):
+        self.profile: Optional[CapturedProfile] = None
+
+
+class TaskProfiler:
+    """タスクのプロファイルの取得と保持"""
+
+    def __init__(self, profiler: Optional[str] = None, token: Optional[str] = None,
+                 sample_rate: Optional[float] = None, slow_seconds: Optional[float] = None,
+                 keep: Optional[int] = None, top: Optional[int] = None):
+        self.profiler = (profiler or os.getenv('SED_PROFILER', CPROFILE)).lower()
+        if self.profiler == PYINSTRUMENT and pyinstrument is None:
+            logger.warning("pyinstrumentがインストールされていないためcProfileを使用します")
+            self.profiler = CPROFILE
+        self.token = token if token is not None else os.getenv('SED_PROFILE_TOKEN') or None
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv('SED_PROFILE_SAMPLE_RATE', '0'))
+        self.slow_seconds = slow_seconds if slow_seconds is not None else float(os.getenv('SED_PROFILE_SLOW_SECONDS', '5'))
+        self.keep = keep if keep is not None else int(os.getenv('SED_PROFILE_KEEP', '50'))
+        self.top = top if top is not None else int(os.getenv('SED_PROFILE_TOP', '50'))
+        self._profiles: "OrderedDict[str, CapturedProfile]" = OrderedDict()
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+
+    def authorized(self, token: Optional[str]) -> bool:
+        """オプトインのトークンが一致するか（SED_PROFILE_TOKEN 未設定なら常にTrue）"""
+        if self.token is None:
+            return True
+        return token is not None and hmac.compare_digest(token, self.token)
+
+    def get(self, task_id: str) -> Optional[CapturedProfile]:
+        with self._lock:
+            return self._profiles.get(task_id)
+
+    def discard(self, task_id: str) -> None:
+        with self._lock:
+            self._profiles.pop(task_id, None)
+
+    def _store(self, profile: CapturedProfile) -> None:
+        with self._lock:
+            self._profiles[profile.task_id] = profile
+            while len(self._profiles) > self.keep:
+                self._profiles.popitem(last=False)
+
+    def _cprofile_output(self, profiler: cProfile.Profile) -> Dict[str, Any]:
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        return {"text": stream.getvalue(), "data": marshal.dumps(stats.stats)}
+
+    @contextmanager
+    def capture(self, task_id: str, requested: bool = False) -> Iterator[_Capture]:
+        """requested またはサンプリングで選ばれた場合、囲んだ処理をプロファイルする"""
+        captured = _Capture()
+        reason = REQUESTED if requested else SAMPLED if self.sample_rate > 0 and random.random() < self.sample_rate else None
+        if reason is None:
+            yield captured
+            return
+        if not self._active.acquire(blocking=False):
+            logger.info("他のタスクをプロファイル中のためプロファイルせずに実行します", extra=fields(task_id=task_id))
+            yield captured
+            return
+
+        try:
+            if self.profiler == PYINSTRUMENT:
+                profiler = pyinstrument.Profiler(async_mode='enabled')
+                profiler.start()
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+            started = time.perf_counter()
+            try:
+                yield captured
+            finally:
+                seconds = time.perf_counter() - started
+                if self.profiler == PYINSTRUMENT:
+                    profiler.stop()
+                    output = {"text": profiler.output_text(), "html": profiler.output_html()}
+                else:
+                    profiler.disable()
+                    output = self._cprofile_output(profiler)
+        finally:
+            self._active.release()
+
+        if reason == SAMPLED and seconds < self.slow_seconds:
+            return
+        captured.profile = CapturedProfile(task_id, self.profiler, reason, seconds, **output)
+        self._store(captured.profile)
+        logger.info("タスクのプロファイルを保存しました", extra=fields(
+            task_id=task_id, profiler=self.profiler, reason=reason, seconds=round(seconds, 3)
+        ))
+
+
+task_profiler = TaskProfiler()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+分析リクエストのレート制限（トークンバケット）
+
+POST /analysis/sed をデバイスごと・全体の2つのトークンバケットで制限する。
+どちらかのバケットにトークンがなければ、タスクを作成する前に 429（Retry-After付き）で拒否する。
+2つのバケットは同時に判定し、拒否した場合はどちらのトークンも消費しない
+（制限中のデバイスが全体のトークンを使い切らないようにするため）。
+
+- 保存先はプロセス内（デフォルト）か、複数のコンテナで共有するRedis（任意、redisパッケージが必要）
+- Redisに接続できない場合は制限せずに受け付ける（レート制限の障害で分析を止めない）
+
+環境変数:
+    SED_RATE_LIMIT_DEVICE        デバイスごとの1秒あたりのリクエスト数（デフォルト: 0.2、0で無効）
+    SED_RATE_LIMIT_DEVICE_BURST  デバイスごとに連続で受け付けるリクエスト数（デフォルト: 10）
+    SED_RATE_LIMIT_GLOBAL        全体の1秒あたりのリクエスト数（デフォルト: 50、0で無効）
+    SED_RATE_LIMIT_GLOBAL_BURST  全体で連続で受け付けるリクエスト数（デフォルト: 100）
+    SED_RATE_LIMIT_DEVICES       プロセス内で保持するデバイスのバケット数（デフォルト: 100000、古い順に破棄）
+    SED_RATE_LIMIT_REDIS_URL     共有するRedisのURL（例: redis://localhost:6379/0、未設定ならプロセス内）
+"""
+
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, List, NamedTuple, Optional, Sequence
+
+from log_config import fields
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # redisは任意（共有する場合のみ）
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+# バケットの種類
+DEVICE = "device"
+GLOBAL = "global"
+
+
+class Limit(NamedTuple):
+    """1つのバケットの判定条件"""
+    scope: str    # DEVICE / GLOBAL
+    key: str      # 保存先のキー
+    rate: float   # 1秒あたりに補充するトークン数
+    burst: float  # バケットの容量
+
+
+class Decision(NamedTuple):
+    """判定結果（拒否した場合は scope と再試行までの秒数）"""
+    allowed: bool
+    scope: Optional[str] = None
+    retry_after: float = 0.0
+
+
+ALLOWED = Decision(True)
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimitStore(ABC):
+    """トークンバケットの保存先"""
+
+    @abstractmethod
+    async def acquire(self, limits: Sequence[Limit]) -> Decision:
+        """全てのバケットにトークンがあれば1つずつ消費して許可、なければどれも消費せずに拒否"""
+
+
+class LocalRateLimitStore(RateLimitStore):
+    """プロセス内のトークンバケット（デバイス数の上限を超えたら最も古いバケットを破棄）"""
+
+    def __init__(self, max_keys: int = 100000, clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: "OrderedDict[str, _Bucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def acquire(self, limits: Sequence[Limit]) -> Decision:
+        now = self.clock()
+        with self._lock:
+            buckets: List[_Bucket] = []
+            rejected = ALLOWED
+            for limit in limits:
+                bucket = self._buckets.get(limit.key)
+                if bucket is None:
+                    bucket = self._buckets[limit.key] = _Bucket(limit.burst, now)
+                else:
+                    bucket.tokens = min(limit.burst, bucket.tokens + (now - bucket.updated) * limit.rate)
+                    bucket.updated = now
+                    self._buckets.move_to_end(limit.key)
+                buckets.append(bucket)
+                if bucket.tokens < 1 and rejected.allowed:
+                    rejected = Decision(False, limit.scope, (1 - bucket.tokens) / limit.rate)
+
+            if rejected.allowed:
+                for bucket in buckets:
+                    bucket.tokens -= 1
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return rejected
+
+
+# KEYS: バケットのキー、ARGV: [rate, burst] × キー数
+# 戻り値: 許可なら {-1, 0}、拒否なら {拒否したバケットの番号（0始まり）, 再試行までのミリ秒}
+_ACQUIRE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local state = redis.call('HMGET', key, 'tokens', 'updated')
+    local current = burst
+    if state[1] then
+        current = math.min(burst, tonumber(state[1]) + (now - tonumber(state[2])) * rate)
+    end
+    if current < 1 then
+        return {i - 1, math.ceil((1 - current) / rate * 1000)}
+    end
+    tokens[i] = current
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    redis.call('HSET', key, 'tokens', tokens[i] - 1, 'updated', now)
+    redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000))
+end
+return {-1, 0}
+"""
+
+
+class RedisRateLimitStore(RateLimitStore):
+    """Redisで複数のコンテナが共有するトークンバケット（判定はLuaスクリプトで不可分に行う）"""
+
+    def __init__(self, url: str, prefix: str = "sed:rate:"):
+        if redis_asyncio is None:
+            raise RuntimeError("SED_RATE_LIMIT_REDIS_URL を使うには redis パッケージが必要です")
+        self.prefix = prefix
+        self.client = redis_asyncio.from_url(url)
+        self._script = self.client.register_script(_ACQUIRE_SCRIPT)
+
+    async def acquire(self, limits: Sequence[Limit]) -> Decision:
+        args: List[float] = []
+        for limit in limits:
+            args += [limit.rate, limit.burst]
+        try:
+            index, retry_ms = await self._script(keys=[self.prefix + limit.key for limit in limits], args=args)
+        except Exception as e:
+            logger.warning("レート制限の判定に失敗したため受け付けます", extra=fields(error=str(e)))
+            return ALLOWED
+        if int(index) < 0:
+            return ALLOWED
+        return Decision(False, limits[int(index)].scope, int(retry_ms) / 1000)
+
+
+class RateLimiter:
+    """デバイスごと・全体のレート制限"""
+
+    def __init__(self, store: RateLimitStore, device_rate: float, device_burst: float,
+                 global_rate: float, global_burst: float):
+        self.store = store
+        self.device_rate = device_rate
+        self.device_burst = device_burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+
+    @property
+    def enabled(self) -> bool:
+        return self.device_rate > 0 or self.global_rate > 0
+
+    async def check(self, device_id: str) -> Decision:
+        """device_id のリクエストを受け付けるか判定（受け付ける場合はトークンを消費）"""
+        limits = []
+        if self.device_rate > 0:
+            limits.append(Limit(DEVICE, f"device:{device_id}", self.device_rate, self.device_burst))
+        if self.global_rate > 0:
+            limits.append(Limit(GLOBAL, "global", self.global_rate, self.global_burst))
+        if not limits:
+            return ALLOWED
+        return await self.store.acquire(limits)
+
+
+def create_rate_limiter() -> RateLimiter:
+    """環境変数に応じてレート制限を作成（SED_RATE_LIMIT_REDIS_URL があればRedisで共有）"""
+    redis_url = os.getenv('SED_RATE_LIMIT_REDIS_URL')
+    store: RateLimitStore
+    if redis_url:
+        store = RedisRateLimitStore(redis_url)
+    else:
+        store = LocalRateLimitStore(int(os.getenv('SED_RATE_LIMIT_DEVICES', '100000')))
+    return RateLimiter(
+        store,
+        device_rate=float(os.getenv('SED_RATE_LIMIT_DEVICE', '0.2')),
+        device_burst=float(os.getenv('SED_RATE_LIMIT_DEVICE_BURST', '10')),
+        global_rate=float(os.getenv('SED_RATE_LIMIT_GLOBAL', '50')),
+        global_burst=float(os.getenv('SED_RATE_LIMIT_GLOBAL_BURST', '100')),
+    )
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Supabase呼び出しの耐障害性（タイムアウト・リトライ・サーキットブレーカー）
+
+- 呼び出しごとのタイムアウト
+- 同時に実行中の呼び出し（スレッド）数の上限
+- 一時的な障害（タイムアウト・接続エラー・5xx・429・PostgRESTの接続系エラー）のみ、
+  ジッター付き指数バックオフでリトライ（冪等な読み取り・UPSERTのみ。条件付き書き込みなど idempotent=False の呼び出しはリトライしない）
+- 一時的な障害が連続したらサーキットを開き、一定時間は呼び出さずに即座に失敗する
+  （期間経過後は1回だけ試行し、成功すれば閉じる）
+
+失敗は StorageError（reason 付き）として送出し、呼び出し側で「データなし」と区別できるようにする。
+
+タイムアウトしても実行中の呼び出し（スレッド）は中断できず、HTTPクライアントのタイムアウト
+（SupabaseStorage は postgrest_client_timeout に同じ秒数を設定）まで動き続ける。
+そのため実行中の呼び出しは終了するまで上限の枠を使い続け、応答しない呼び出しが
+スレッドを使い尽くさないようにする（枠が空くのを待つ時間もタイムアウトに含む）。
+
+環境変数:
+    SUPABASE_TIMEOUT            1回の呼び出しのタイムアウト（秒、デフォルト: 10）
+    SUPABASE_RETRIES            一時的な障害時の最大試行回数（デフォルト: 3）
+    SUPABASE_BREAKER_THRESHOLD  サーキットを開く連続失敗回数（デフォルト: 5）
+    SUPABASE_BREAKER_RESET      サーキットを開いておく秒数（デフォルト: 30）
+    SUPABASE_MAX_IN_FLIGHT      同時に実行中の呼び出し数の上限（デフォルト: 16）
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Callable, List, Optional, TypeVar
+
+from log_config import fields
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# 失敗理由
+TIMEOUT = "timeout"            # タイムアウト
+UNAVAILABLE = "unavailable"    # 接続エラー・5xx などの一時的な障害
+CIRCUIT_OPEN = "circuit_open"  # サーキットが開いているため呼び出さなかった
+REJECTED = "rejected"          # リクエスト自体のエラー（4xx、リトライしない）
+CONFLICT = "conflict"          # 条件付き書き込みが他の書き込みと競合し続けた（SEDAggregator.save_rows）
+
+# 一時的な障害とみなすPostgREST / PostgreSQLのエラーコード
+_TRANSIENT_CODE_PREFIXES = (
+    "PGRST000", "PGRST001", "PGRST002", "PGRST003",  # DB接続・プール枯渇
+    "08",     # connection_exception
+    "53",     # insufficient_resources（too_many_connections 等）
+    "57P",    # operator_intervention（admin_shutdown 等）
+    "57014",  # query_canceled（statement_timeout）
+    "40001",  # serialization_failure
+    "40P01",  # deadlock_detected
+)
+
+
+class StorageError(Exception):
+    """ストレージ呼び出しの失敗（reason で種類を区別）"""
+
+    def __init__(self, reason: str, operation: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+        self.operation = operation
+
+
+def classify(error: BaseException) -> str:
+    """例外を失敗理由に分類"""
+    import httpx
+
+    if isinstance(error, StorageError):
+        return error.reason
+    if isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return TIMEOUT
+    if isinstance(error, httpx.TransportError):
+        return UNAVAILABLE
+
+    code = getattr(error, 'code', None)
+    if code is not None:
+        # JSON以外のエラー応答（プロキシの502/503など）ではHTTPステータスが入る
+        if isinstance(code, int) or str(code).isdigit():
+            status = int(code)
+            return UNAVAILABLE if status >= 500 or status == 429 else REJECTED
+        if str(code).startswith(_TRANSIENT_CODE_PREFIXES):
+            return UNAVAILABLE
+        return REJECTED
+    return UNAVAILABLE
+
+
+class CircuitBreaker:
+    """連続失敗でサーキットを開くブレーカー（closed → open → half_open → closed）"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """呼び出してよいか（half_openでは同時に1回だけ試行する）"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """サーキットが閉じる（試行可能になる）までの秒数"""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> bool:
+        """失敗を記録（サーキットを開いた場合はTrue）"""
+        self.failures += 1
+        was_probing, self._probing = self._probing, False
+        if was_probing or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+            return True
+        return False
+
+    def release(self) -> None:
+        """障害と無関係な失敗（REJECTED）・取り消しで試行を終えた場合"""
+        self._probing = False
+
+
+class ResiliencePolicy:
+    """タイムアウト・リトライ・サーキットブレーカーをまとめた呼び出しポリシー"""
+
+    # (イベント名, 操作名) の通知先（api_server.py で metrics を登録する）。イベント: retry / circuit_open / failure
+    event_hooks: List[Callable[[str, str], None]] = []
+
+    def __init__(self, timeout: Optional[float] = None, attempts: Optional[int] = None,
+                 base_delay: float = 0.2, max_delay: float = 2.0,
+                 breaker: Optional[CircuitBreaker] = None, max_in_flight: Optional[int] = None):
+        """
+        Args:
+            timeout: 1回の呼び出しのタイムアウト（秒）
+            attempts: 一時的な障害時の最大試行回数（冪等な呼び出しのみ）
+            base_delay: リトライ待機時間の基準（秒、試行ごとに2倍）
+            max_delay: リトライ待機時間の上限（秒）
+            breaker: サーキットブレーカー
+            max_in_flight: 同時に実行中の呼び出し数の上限（タイムアウト後も終了するまで数える）
+        """
+        self.timeout = timeout if timeout is not None else float(os.getenv('SUPABASE_TIMEOUT', '10'))
+        self.attempts = max(1, attempts if attempts is not None else int(os.getenv('SUPABASE_RETRIES', '3')))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker(
+            int(os.getenv('SUPABASE_BREAKER_THRESHOLD', '5')),
+            float(os.getenv('SUPABASE_BREAKER_RESET', '30'))
+        )
+        self.max_in_flight = max(1, max_in_flight if max_in_flight is not None
+                                 else int(os.getenv('SUPABASE_MAX_IN_FLIGHT', '16')))
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self.in_flight = 0
+
+    def _notify(self, event: str, operation: str) -> None:
+        for hook in self.event_hooks:
+            hook(event, operation)
+
+    def backoff(self, attempt: int) -> float:
+        """attempt回目の失敗後の待機時間（full jitter）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def _finished(self, task: "asyncio.Future") -> None:
+        """スレッドの終了時に枠を返す（タイムアウト後に終了した呼び出しの例外は読み捨てる）"""
+        self.in_flight -= 1
+        self._slots.release()
+        if not task.cancelled():
+            task.exception()
+
+    async def _run_in_thread(self, func: Callable[[], T]) -> T:
+        """枠を確保してスレッドで実行（呼び出し側がタイムアウトしても、枠はスレッドの終了まで返さない）"""
+        await self._slots.acquire()
+        self.in_flight += 1
+        task = asyncio.ensure_future(asyncio.to_thread(func))
+        task.add_done_callback(self._finished)
+        return await asyncio.shield(task)
+
+    async def call(self, operation: str, func: Callable[[], T], idempotent: bool = True) -> T:
+        """同期関数をスレッドで実行（タイムアウト・リトライ・ブレーカー・同時実行数の上限を適用）
+
+        タイムアウトは待つのをやめるだけで、実行中の呼び出しは取り消さない。
+        """
+        attempts = self.attempts if idempotent else 1
+        attempt = 0
+        while True:
+            attempt += 1
+            if not self.breaker.allow():
+                self._notify(CIRCUIT_OPEN, operation)
+                raise StorageError(CIRCUIT_OPEN, operation,
+                                   f"Supabaseが不安定なため呼び出しを停止中です（{operation}）")
+            try:
+                result = await asyncio.wait_for(self._run_in_thread(func), self.timeout)
+            except asyncio.CancelledError:
+                # 呼び出し側の取り消し（先読みの中止など）は障害ではない。half_openの試行枠だけ返す
+                self.breaker.release()
+                raise
+            except Exception as e:
+                reason = classify(e)
+                if reason == REJECTED:
+                    self.breaker.release()
+                    self._notify("failure", operation)
+                    raise StorageError(REJECTED, operation, str(e)) from e
+
+                if self.breaker.record_failure():
+                    logger.warning("サーキットを開きました", extra=fields(
+                        operation=operation, failures=self.breaker.failures, reset_seconds=self.breaker.reset_timeout
+                    ))
+                if attempt >= attempts:
+                    self._notify("failure", operation)
+                    raise StorageError(reason, operation, f"{operation}: {reason} ({e})") from e
+
+                delay = self.backoff(attempt)
+                self._notify("retry", operation)
+                logger.info("Supabase呼び出しをリトライします", extra=fields(
+                    operation=operation, attempt=attempt, reason=reason, delay=round(delay, 3)
+                ))
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
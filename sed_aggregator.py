@@ -4,55 +4,146 @@ SED（Sound Event Detection）データ集計ツール
 
 Supabaseのaudio_featuresテーブルから音響イベント検出データを収集し、
 日次集計結果をaudio_aggregatorテーブルに保存する。
+保存先は storage.py のバックエンド（SED_STORAGE=supabase / memory / sqlite）で切り替えられる。
 
 処理フロー:
 1. audio_features.behavior_extractor_resultから生データ取得
 2. フィルタリング（不要なイベント除外）
 3. 統合（類似イベントをまとめる）
+   ※ 除外・統合・カテゴリーのルールは sed_rules.json から読み込む（sed_rules.py 参照）
 4. time_blocks作成（30分スロット別の集計）
 5. summary_ranking作成（time_blocksから1日全体を集計、アプリ側で使用）
-6. time_blocksをaudio_aggregator.behavior_aggregator_resultに保存
+6. 異常検出（time_blocksをデバイスごとのベースラインと比較。anomaly.py 参照）
+7. time_blocksをaudio_aggregator.behavior_aggregator_resultに保存
+   （類似日検索用の活動プロファイルも保存。profiles.py 参照）
+   （保存済みの内容とハッシュ・ルールバージョンが同じ場合は書き込まない）
+   （スロットごとに集計に使ったデータの更新時刻をバージョンとして保存し、保存済みの方が新しいスロットは
+     保存済みの集計を残す。書き込みは読み込んだ時点から他の書き込みがない場合のみ行う。SEDAggregator.save_rows 参照）
+8. 書き込んだ行の time_blocks でベースラインを更新（再集計の場合は更新しない。SEDAggregator.update_baselines 参照）
+
+環境変数:
+    SED_SKIP_UNCHANGED     保存済みの内容と同じ集計結果の書き込みを省略する（デフォルト: 1、0で常に書き込む）
+    SED_RESULT_CACHE_SIZE  書き込み済みの内容の指紋を保持するデバイス・日付の数（デフォルト: 10000）
+    SED_SAVE_ATTEMPTS      他の書き込みと競合した場合に読み直して保存を試みる回数（デフォルト: 3）
 """
 
 import asyncio
+import hashlib
+import logging
 import os
+import time
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
-from collections import Counter
-from typing import Dict, List, Optional, Any
-from datetime import datetime
+from collections import OrderedDict
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, Iterator, List, Optional, Any, Set
+from datetime import datetime, timezone
 import argparse
-from supabase import create_client, Client
 from dotenv import load_dotenv
 
-# 環境変数を読み込み
-load_dotenv()
+import profiles
+import serialization
+from anomaly import AnomalyDetector, create_detector
+from labels import label_table
+from log_config import configure_logging, fields
+from resilience import CONFLICT, StorageError
+from sed_rules import CompiledRules, get_rules
+from storage import AggregatorStorage, DeviceDay, Fingerprint, SlotData, create_storage
 
-# ==================== 設定 ====================
+if TYPE_CHECKING:
+    from aggregation_pool import AggregationPool
 
-# 除外するイベントラベルのリスト（最初は空）
-EXCLUDED_EVENTS = []
+logger = logging.getLogger(__name__)
 
-# 音の統合マッピング（最初は空）
-SOUND_CONSOLIDATION = {}
+SKIP_UNCHANGED = os.getenv('SED_SKIP_UNCHANGED', '1').lower() not in ('0', 'false', 'no')
+RESULT_CACHE_SIZE = int(os.getenv('SED_RESULT_CACHE_SIZE', '10000'))
+SAVE_ATTEMPTS = max(1, int(os.getenv('SED_SAVE_ATTEMPTS', '3')))
 
-# カテゴリー定義（最初は空）
-PRIORITY_CATEGORIES = {}
+# 計測フックの型
+# - ステージ所要時間: (ステージ名, 秒)
+# - カウンター: (名前, 加算値, ラベル)
+# - 書き込み: (書き込んだ audio_aggregator の行)
+StageHook = Callable[[str, float], None]
+CounterHook = Callable[[str, float, Dict[str, str]], None]
+WriteHook = Callable[[List[Dict[str, Any]]], None]
+
+
+def failure_reason(error: BaseException) -> str:
+    """保存先の例外から失敗理由を取得
+
+    SupabaseStorage の StorageError は timeout / unavailable / circuit_open / rejected、
+    それ以外のバックエンドの例外は storage_error。
+    """
+    return error.reason if isinstance(error, StorageError) else "storage_error"
+
+
+def result_hash(result: Dict[str, Any]) -> str:
+    """保存する内容（time_blocks・label_map・anomalies・スロット別バージョン・プロファイルの長さ）の安定したハッシュ
+
+    プロファイルは time_blocks から決まるため、長さ（グループ定義）のみ含める。
+    """
+    payload = serialization.canonical_dumps({
+        'time_blocks': result['time_blocks'],
+        'label_map': result['label_map'],
+        'anomalies': result.get('anomalies'),
+        'slot_versions': result.get('slot_versions'),
+        'profile_length': profiles.PROFILE_LENGTH,
+    })
+    return hashlib.sha256(payload).hexdigest()
+
+
+def newer_slots(versions: Dict[str, str], than: Dict[str, str]) -> List[str]:
+    """versions のうち than より新しい（than にない場合を含む）スロット"""
+    return [slot for slot, version in versions.items() if version > than.get(slot, '')]
 
 
 class SEDAggregator:
     """SED データ集計クラス"""
 
-    def __init__(self):
-        # Supabaseクライアントの初期化
-        supabase_url = os.getenv('SUPABASE_URL')
-        supabase_key = os.getenv('SUPABASE_KEY')
-
-        if not supabase_url or not supabase_key:
-            raise ValueError("SUPABASE_URLおよびSUPABASE_KEYが設定されていません")
+    # 計測フック（api_server.py で metrics を登録する。未登録時は何もしない）
+    stage_hooks: List[StageHook] = []
+    counter_hooks: List[CounterHook] = []
+    # 書き込み後の通知（api_server.py で類似日検索のキャッシュ破棄を登録する）
+    write_hooks: List[WriteHook] = []
 
-        self.supabase: Client = create_client(supabase_url, supabase_key)
+    def __init__(self, storage: Optional[AggregatorStorage] = None, pool: Optional["AggregationPool"] = None,
+                 detector: Optional[AnomalyDetector] = None):
+        """
+        Args:
+            storage: 保存先（省略時は環境変数 SED_STORAGE に応じて作成。デフォルトはSupabase）
+            pool: 大きい日の集計を実行するプロセスプール（省略時は常にこのプロセスで集計）
+            detector: 異常検出（省略時は環境変数 SED_ANOMALY_DETECTION に応じて作成）
+        """
+        self.storage = storage or create_storage()
+        self.pool = pool
+        self.detector = detector or create_detector()
+        self.skip_unchanged = SKIP_UNCHANGED
+        # 書き込み済み（または読み込み済み）の内容の指紋。ヒットすれば保存先への問い合わせも省略する
+        self._fingerprints: "OrderedDict[DeviceDay, Fingerprint]" = OrderedDict()
+        # デバイスごとのベースライン更新のロック（ロック, 使用中の数）。使い終わったら削除する
+        self._baseline_locks: Dict[str, List[Any]] = {}
         self.time_slots = self._generate_time_slots()
-        print(f"✅ Supabase接続設定完了")
+        logger.debug("ストレージ設定完了", extra=fields(storage=self.storage.name))
+
+    @contextmanager
+    def _stage(self, stage: str) -> Iterator[None]:
+        """ステージ所要時間を計測してstage_hooksに通知"""
+        if not self.stage_hooks:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._observe_stage(stage, time.perf_counter() - started)
+
+    def _observe_stage(self, stage: str, seconds: float) -> None:
+        for hook in self.stage_hooks:
+            hook(stage, seconds)
+
+    def _count(self, name: str, amount: float = 1, **labels: str) -> None:
+        """カウンターをcounter_hooksに通知"""
+        for hook in self.counter_hooks:
+            hook(name, amount, labels)
 
     def _generate_time_slots(self) -> List[str]:
         """30分スロットのリストを生成（00-00 から 23-30 まで）"""
@@ -63,101 +154,91 @@ class SEDAggregator:
         return slots
 
     async def fetch_all_data(self, device_id: str, date: str) -> Dict[str, List[Dict]]:
-        """指定日の全SEDデータをSupabaseから取得"""
-        print(f"📊 Supabaseからデータ取得開始: device_id={device_id}, date={date}")
+        """指定日の全SEDデータをaudio_featuresテーブルから取得
 
-        try:
-            # Supabaseからデータを取得（audio_featuresテーブル）
-            response = self.supabase.table('audio_features').select('time_block, behavior_extractor_result').eq(
-                'device_id', device_id
-            ).eq(
-                'date', date
-            ).execute()
-
-            # 結果をtime_blockごとに整理
-            results = {}
-            for row in response.data:
-                time_block = row['time_block']
-                events = row['behavior_extractor_result']  # jsonb型なのでそのまま辞書として扱える
-                if events:  # データが存在する場合のみ追加
-                    results[time_block] = events
-
-            print(f"✅ データ取得完了: {len(results)}/{len(self.time_slots)} スロット")
-            return results
+        取得に失敗した場合は例外を送出する（空のdictは「データなし」の意味）。
+        """
+        logger.debug("データ取得開始", extra=fields(device_id=device_id, date=date))
 
+        try:
+            # time_blockごとに整理済み（データが存在するスロットのみ）
+            results = await self.storage.fetch_slots(device_id, date)
         except Exception as e:
-            print(f"❌ Supabaseからのデータ取得エラー: {e}")
-            return {}
+            self._count('supabase_errors', operation='fetch', reason=failure_reason(e))
+            logger.error("データ取得エラー", extra=fields(
+                device_id=device_id, date=date, reason=failure_reason(e), error=str(e)
+            ))
+            raise
+
+        logger.debug("データ取得完了", extra=fields(slots=len(results), total_slots=len(self.time_slots)))
+        return results
 
-    def _extract_events_from_data(self, events_data: List[Dict]) -> List[str]:
-        """Supabaseのeventsカラムから音響イベントラベルを抽出
+    def _count_events_from_data(self, events_data: List[Dict]) -> Dict[str, int]:
+        """Supabaseのeventsカラムから音響イベントラベルを、リストを作らずに回数として数える（最初に出現した順）
 
         新形式対応:
         [
           {"time": 0, "events": [{"label": "Speech / 会話・発話", "score": 0.85}, ...]},
           ...
         ]
+        キーのラベルは共有表の文字列に置き換える（集計結果やルールのメモと同じオブジェクトを使う）。
         """
-        events = []
+        counts: Dict[str, int] = {}
+        if not events_data:
+            return counts
 
-        if not events_data or len(events_data) == 0:
-            return events
-
-        # 新形式チェック: {"time": 0.0, "events": [...]}
+        intern = label_table.intern
         for time_block in events_data:
             if isinstance(time_block, dict) and 'events' in time_block:
                 for event in time_block['events']:
                     if isinstance(event, dict) and 'label' in event:
                         label = event['label']
-                        events.append(label)
-
-        return events
-
-    def _filter_events(self, events: List[str]) -> List[str]:
-        """除外リストに基づいてイベントをフィルタリング"""
-        if not EXCLUDED_EVENTS:
-            return events
-        return [e for e in events if e not in EXCLUDED_EVENTS]
-
-    def _consolidate_events(self, events: List[str]) -> List[str]:
-        """音の統合マッピングを適用"""
-        if not SOUND_CONSOLIDATION:
-            return events
-        return [SOUND_CONSOLIDATION.get(e, e) for e in events]
-
-    def _get_category(self, event: str) -> str:
-        """イベントのカテゴリーを判定（最初は全て "other"）"""
-        if not PRIORITY_CATEGORIES:
-            return "other"
-
-        for category, events in PRIORITY_CATEGORIES.items():
-            if event in events:
-                return category
-        return "other"
-
-    def _create_time_blocks(self, slot_data: Dict[str, List[Dict]]) -> Dict[str, Optional[List[Dict[str, Any]]]]:
-        """スロット別のイベント集計を作成"""
+                        count = counts.get(label)
+                        if count is None:
+                            counts[intern(label)] = 1
+                        else:
+                            counts[label] = count + 1
+
+        return counts
+
+    def _get_category(self, event: str, rules: CompiledRules) -> str:
+        """イベントのカテゴリーを判定（未定義は "other"）"""
+        return rules.category(event)
+
+    def _create_time_blocks(self, slot_data: Dict[str, List[Dict]], rules: CompiledRules,
+                            seen_labels: Optional[Set[str]] = None) -> Dict[str, Optional[List[Dict[str, Any]]]]:
+        """スロット別のイベント集計を作成
+
+        seen_labels を渡した場合、出現した生ラベル（ルール適用前）を追加する。
+        """
         time_blocks = {}
+        instrumented = bool(self.stage_hooks or self.counter_hooks)
+        extract_seconds = 0.0
+        frames = events = 0
+        started = time.perf_counter() if instrumented else 0.0
 
         for slot in self.time_slots:
             if slot in slot_data:
-                # 生イベント抽出
-                raw_events = self._extract_events_from_data(slot_data[slot])
-
-                if raw_events:
-                    # フィルタリング
-                    filtered_events = self._filter_events(raw_events)
+                # 生イベントをラベルごとに数える（フレーム数分のリストは作らない）
+                if instrumented:
+                    extract_started = time.perf_counter()
+                    raw_counts = self._count_events_from_data(slot_data[slot])
+                    extract_seconds += time.perf_counter() - extract_started
+                    frames += len(slot_data[slot])
+                    events += sum(raw_counts.values())
+                else:
+                    raw_counts = self._count_events_from_data(slot_data[slot])
 
-                    # 統合
-                    consolidated_events = self._consolidate_events(filtered_events)
+                if raw_counts:
+                    if seen_labels is not None:
+                        seen_labels.update(raw_counts)
 
-                    # カウント
-                    counter = Counter(consolidated_events)
-                    event_list = []
-                    for event, count in counter.most_common():
-                        event_list.append({"event": event, "count": count})
+                    # フィルタリング + 統合（ラベル単位で1回ずつ）
+                    counts = rules.apply_counts(raw_counts)
 
-                    time_blocks[slot] = event_list
+                    # 回数の多い順（同数は最初に出現した順、Counter.most_common と同じ）
+                    ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+                    time_blocks[slot] = [{"event": event, "count": count} for event, count in ranked]
                 else:
                     # データは存在するがイベントが空の場合
                     time_blocks[slot] = []
@@ -165,28 +246,33 @@ class SEDAggregator:
                 # データが存在しない場合はnull
                 time_blocks[slot] = None
 
+        if instrumented:
+            # 抽出とそれ以外（フィルタリング・統合・カウント）を別ステージとして通知
+            self._observe_stage('extract', extract_seconds)
+            self._observe_stage('time_blocks', time.perf_counter() - started - extract_seconds)
+            self._count('frames', frames)
+            self._count('events', events)
+
         return time_blocks
 
-    def _create_summary_ranking(self, time_blocks: Dict[str, Optional[List[Dict]]]) -> List[Dict[str, Any]]:
+    def _create_summary_ranking(self, time_blocks: Dict[str, Optional[List[Dict]]],
+                                rules: CompiledRules) -> List[Dict[str, Any]]:
         """time_blocksから1日全体のランキングを作成"""
-        # time_blocksから全イベントを収集
-        all_events = []
+        # time_blocksの回数をイベントごとに合計（最初に出現した順）
+        counts: Dict[str, int] = {}
         for events_list in time_blocks.values():
             if events_list:
                 for item in events_list:
-                    # item["count"]回分のイベントを追加
-                    all_events.extend([item["event"]] * item["count"])
+                    if item["count"] > 0:
+                        counts[item["event"]] = counts.get(item["event"], 0) + item["count"]
 
-        if not all_events:
+        if not counts:
             return []
 
-        # カウント
-        counter = Counter(all_events)
-
         # カテゴリー別に分類
         categorized = {}
-        for event, count in counter.items():
-            category = self._get_category(event)
+        for event, count in counts.items():
+            category = self._get_category(event, rules)
             if category not in categorized:
                 categorized[category] = []
             categorized[category].append({
@@ -199,96 +285,391 @@ class SEDAggregator:
         for category in categorized:
             categorized[category].sort(key=lambda x: x['count'], reverse=True)
 
-        # カテゴリーの優先順位（定義されていない場合は出現順）
-        if PRIORITY_CATEGORIES:
-            priority_order = list(PRIORITY_CATEGORIES.keys()) + ['other']
-        else:
-            priority_order = ['other']
-
-        # カテゴリー順に結合
+        # カテゴリー順に結合（ルールで定義された優先順位 + 'other'）
         result = []
-        for category in priority_order:
+        for category in rules.priority_order:
             if category in categorized:
                 result.extend(categorized[category])
 
         return result
 
-    def aggregate_data(self, slot_data: Dict[str, List[Dict]]) -> Dict:
-        """収集したデータを集計して結果形式を生成"""
-        print("📊 データ集計開始...")
+    def aggregate_data(self, slot_data: Dict[str, List[Dict]], rules: Optional[CompiledRules] = None) -> Dict:
+        """収集したデータを集計して結果形式を生成（rules省略時は現在有効なルール）"""
+        # 集計中にルールが差し替えられても1回の集計では同じバージョンを使う
+        rules = rules or get_rules()
 
         # Step 1: time_blocks作成（フィルタリング + 統合適用）
-        time_blocks = self._create_time_blocks(slot_data)
+        seen_labels: Set[str] = set()
+        time_blocks = self._create_time_blocks(slot_data, rules, seen_labels)
 
         # Step 2: summary_ranking作成（time_blocksから集計 + カテゴリー分け）
-        summary_ranking = self._create_summary_ranking(time_blocks)
+        with self._stage('ranking'):
+            summary_ranking = self._create_summary_ranking(time_blocks, rules)
 
         result = {
             "summary_ranking": summary_ranking,
-            "time_blocks": time_blocks
+            "time_blocks": time_blocks,
+            "rules_version": rules.version,
+            # 生ラベル → 適用結果（除外はNone）。ルール変更時の影響判定に使う
+            "label_map": {label: rules.map_label(label) for label in sorted(seen_labels)}
         }
 
-        total_events = sum(item["count"] for item in summary_ranking)
-        print(f"✅ 集計完了: 総イベント数 {total_events}, ユニークイベント数 {len(summary_ranking)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            total_events = sum(item["count"] for item in summary_ranking)
+            logger.debug("集計完了", extra=fields(total_events=total_events, unique_events=len(summary_ranking)))
+        return result
+
+    async def aggregate(self, slot_data: Dict[str, List[Dict]], rules: Optional[CompiledRules] = None) -> Dict:
+        """aggregate_data をプロセスプール（設定時かつフレーム数が多い日）またはこのプロセスで実行
+
+        保存先から取得したデータ（storage.SlotData）の場合は、スロット別バージョンを result["slot_versions"] に追加する。
+        """
+        if self.pool is None or not self.pool.should_offload(slot_data):
+            result = self.aggregate_data(slot_data, rules)
+        else:
+            rules = rules or get_rules()
+            with self._stage('pool'):
+                result, stages, counters = await self.pool.aggregate(slot_data, rules.source)
+
+            # ワーカー内の計測値をこのプロセスのフックに通知
+            for stage, seconds in stages:
+                self._observe_stage(stage, seconds)
+            for name, amount, labels in counters:
+                self._count(name, amount, **labels)
+
+        if isinstance(slot_data, SlotData):
+            result['slot_versions'] = dict(slot_data.versions)
         return result
 
-    async def save_to_supabase(self, result: Dict, device_id: str, date: str) -> bool:
-        """結果をSupabaseのaudio_aggregatorテーブルに保存"""
+    async def detect_anomalies(self, result: Dict, device_id: str, date: str) -> Optional[List[Dict[str, Any]]]:
+        """time_blocksをデバイスのベースラインと比較して異常を検出し、result["anomalies"] に追加
+
+        ベースラインは更新しない（書き込めた行だけ save_rows の後に update_baselines で反映する）。
+        最後に反映した日（as_of）の再集計では、その日を反映する前のベースライン（previous）と比較する
+        （再実行してもフラグは変わらない）。ベースラインの取得に失敗した場合は検出を省略する（anomalies は None）。
+        """
+        if self.detector is None:
+            return None
+
+        flags: Optional[List[Dict[str, Any]]] = None
+        with self._stage('anomaly'):
+            try:
+                stored = await self.storage.fetch_baseline(device_id) or {}
+                flags, _ = self.detector.evaluate(self._compared_baseline(stored, date), result['time_blocks'])
+            except Exception as e:
+                logger.warning("異常検出を省略しました", extra=fields(
+                    device_id=device_id, date=date, reason=failure_reason(e), error=str(e)
+                ))
+                flags = None
+
+        result['anomalies'] = flags
+        if flags:
+            self._count('anomalies', len(flags))
+        return flags
+
+    @staticmethod
+    def _compared_baseline(stored: Dict[str, Any], date: str) -> Dict[str, Any]:
+        """date の集計と比較するベースライン（as_of の日はその日を反映する前のもの）"""
+        if stored.get('as_of') == date:
+            return stored.get('previous') or {}
+        return stored.get('baseline') or {}
+
+    @asynccontextmanager
+    async def _baseline_lock(self, device_id: str) -> AsyncIterator[None]:
+        entry = self._baseline_locks.setdefault(device_id, [asyncio.Lock(), 0])
+        entry[1] += 1
         try:
-            # Supabaseにデータを保存（UPSERT）
-            # summary_rankingは保存せず、time_blocksのみ保存（アプリ側で計算）
-            response = self.supabase.table('audio_aggregator').upsert({
-                'device_id': device_id,
-                'date': date,
-                'behavior_aggregator_result': result['time_blocks'],  # time_blocksを保存
-                'behavior_aggregator_processed_at': datetime.utcnow().isoformat()
-            }).execute()
-
-            print(f"💾 Supabase保存完了: audio_aggregator テーブル")
-            print(f"   device_id: {device_id}, date: {date}")
-            print(f"   behavior_aggregator_result に time_blocks を保存")
-            return True
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._baseline_locks[device_id]
+
+    async def update_baselines(self, rows: List[Dict[str, Any]]) -> None:
+        """書き込んだ行の time_blocks でデバイスのベースラインを日付順に更新
+
+        as_of より前の日は反映しない。as_of の日は反映する前のベースライン（previous）から置き換える（二重に反映しない）。
+        読み込みから保存までをデバイスごとに直列にする（このプロセス内のみ）。
+        失敗した場合は警告のみ（集計結果の保存は成功している）。
+        """
+        if self.detector is None:
+            return
+        for row in sorted(rows, key=lambda row: (row['device_id'], row['date'])):
+            device_id, date = row['device_id'], row['date']
+            async with self._baseline_lock(device_id):
+                try:
+                    stored = await self.storage.fetch_baseline(device_id) or {}
+                    as_of = stored.get('as_of')
+                    if as_of is not None and date < as_of:
+                        continue
+                    previous = self._compared_baseline(stored, date)
+                    _, baseline = self.detector.evaluate(previous, row['behavior_aggregator_result'])
+                    await self.storage.upsert_baseline({
+                        'device_id': device_id, 'baseline': baseline, 'previous': previous, 'as_of': date
+                    })
+                except Exception as e:
+                    logger.warning("ベースラインの更新を省略しました", extra=fields(
+                        device_id=device_id, date=date, reason=failure_reason(e), error=str(e)
+                    ))
+
+    def create_summary_ranking(self, time_blocks: Dict[str, Optional[List[Dict]]]) -> List[Dict[str, Any]]:
+        """保存済みのtime_blocksから現在のルールでsummary_rankingを作成"""
+        return self._create_summary_ranking(time_blocks, get_rules())
+
+    async def fetch_aggregate(self, device_id: str, date: str) -> Optional[Dict[str, Any]]:
+        """保存済みの集計結果をaudio_aggregatorテーブルから取得（存在しない場合はNone）"""
+        return await self.storage.fetch_result(device_id, date)
+
+    def build_result_row(self, result: Dict, device_id: str, date: str) -> Dict[str, Any]:
+        """集計結果からaudio_aggregatorの保存行を作成
+
+        summary_rankingは保存せず、time_blocksのみ保存（アプリ側で計算）
+        異常検出が有効な場合は behavior_aggregator_anomalies も保存する（全行で列を揃える）
+        """
+        row = {
+            'device_id': device_id,
+            'date': date,
+            'behavior_aggregator_result': result['time_blocks'],  # time_blocksを保存
+            'behavior_aggregator_rules_version': result['rules_version'],  # 集計に使ったルールのバージョン
+            'behavior_aggregator_labels': result['label_map'],  # 出現した生ラベルとその適用結果
+            'behavior_aggregator_hash': result_hash(result),  # 変更のない書き込みの判定用
+            'behavior_aggregator_profile': profiles.pack(profiles.build_profile(result['time_blocks'])),  # 類似日検索用
+            'behavior_aggregator_slot_versions': result.get('slot_versions'),  # スロット → 集計に使ったデータの更新時刻
+            'behavior_aggregator_processed_at': datetime.now(timezone.utc).isoformat()  # 条件付き書き込みの比較にも使う
+        }
+        if self.detector is not None:
+            row['behavior_aggregator_anomalies'] = result.get('anomalies')
+        return row
+
+    def _remember(self, key: DeviceDay, fingerprint: Fingerprint) -> None:
+        if RESULT_CACHE_SIZE <= 0:
+            return
+        self._fingerprints[key] = fingerprint
+        self._fingerprints.move_to_end(key)
+        while len(self._fingerprints) > RESULT_CACHE_SIZE:
+            self._fingerprints.popitem(last=False)
+
+    def merge_rows(self, row: Dict[str, Any], stored: Dict[str, Any], slots: List[str]) -> Dict[str, Any]:
+        """row の slots を保存済みの行（より新しいデータで集計されたスロット）の集計で置き換えた行を作成
+
+        異常のフラグはスロットごとに取り込み、label_map は両方の和集合にする（ルール変更の影響判定には多い分には問題ない）。
+        """
+        taken = set(slots)
+        time_blocks = dict(row['behavior_aggregator_result'])
+        versions = dict(row['behavior_aggregator_slot_versions'])
+        stored_blocks = stored.get('behavior_aggregator_result') or {}
+        stored_versions = stored.get('behavior_aggregator_slot_versions') or {}
+        for slot in slots:
+            time_blocks[slot] = stored_blocks.get(slot)
+            versions[slot] = stored_versions[slot]
+
+        anomalies = row.get('behavior_aggregator_anomalies')
+        if anomalies is not None or stored.get('behavior_aggregator_anomalies'):
+            anomalies = [flag for flag in anomalies or () if flag['slot'] not in taken] + [
+                flag for flag in stored.get('behavior_aggregator_anomalies') or () if flag['slot'] in taken
+            ]
+            anomalies.sort(key=lambda flag: abs(flag['z']), reverse=True)
+
+        result = {
+            'time_blocks': time_blocks,
+            'rules_version': row['behavior_aggregator_rules_version'],
+            'label_map': {**(stored.get('behavior_aggregator_labels') or {}), **row['behavior_aggregator_labels']},
+            'anomalies': anomalies,
+            'slot_versions': versions,
+        }
+        return self.build_result_row(result, row['device_id'], row['date'])
+
+    async def _reconcile(self, row: Dict[str, Any], fingerprint: Optional[Fingerprint]) -> Optional[Dict[str, Any]]:
+        """保存済みの方が新しいデータで集計されたスロットがあれば取り込んだ行を返す
+
+        ルールバージョンが異なりスロットを取り込めない場合は、データを読み直して現在のルールで集計し直した行を返す。
+        同じルールで row のどのスロットも保存済みより新しくない場合（遅れて終わった古い集計）は None（書き込まない）。
+        """
+        versions = row.get('behavior_aggregator_slot_versions')
+        if fingerprint is None or not versions or not fingerprint.slot_versions:
+            return row
+        if not newer_slots(fingerprint.slot_versions, versions):
+            return row
+        if fingerprint.rules_version != row['behavior_aggregator_rules_version']:
+            return await self._reaggregate_row(row)
+        if not newer_slots(versions, fingerprint.slot_versions):
+            return None
+
+        stored = await self.storage.fetch_result(row['device_id'], row['date'])
+        if stored is None:
+            return row
+        slots = newer_slots(stored.get('behavior_aggregator_slot_versions') or {}, versions)
+        self._count('result_writes', outcome='merged')
+        return self.merge_rows(row, stored, slots) if slots else row
+
+    async def _reaggregate_row(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """row のデバイス・日付のデータを読み直し、現在のルールで集計し直した行を作成"""
+        device_id, date = row['device_id'], row['date']
+        slot_data = await self.storage.fetch_slots(device_id, date)
+        if not slot_data:
+            return row
+        result = await self.aggregate(slot_data)
+        await self.detect_anomalies(result, device_id, date)
+        self._count('result_writes', outcome='reaggregated')
+        logger.info("保存済みの集計とルールバージョンが異なるため集計し直しました", extra=fields(
+            device_id=device_id, date=date, rules_version=result['rules_version']
+        ))
+        return self.build_result_row(result, device_id, date)
+
+    async def _stored_fingerprints(self, keys: List[DeviceDay], refresh: bool) -> Dict[DeviceDay, Fingerprint]:
+        """保存済みの指紋（refresh=False ならキャッシュにないキーのみ保存先から取得）"""
+        unknown = keys if refresh else [key for key in keys if key not in self._fingerprints]
+        if unknown:
+            stored = await self.storage.fetch_fingerprints(unknown)
+            for key in unknown:
+                if key in stored:
+                    self._remember(key, stored[key])
+                else:
+                    self._fingerprints.pop(key, None)
+        return {key: self._fingerprints[key] for key in keys if key in self._fingerprints}
 
+    async def save_rows(self, rows: List[Dict[str, Any]], update_baseline: bool = True) -> List[Dict[str, Any]]:
+        """集計結果の行を条件付きで保存し、書き込んだ行を返す
+
+        1. 保存済みの指紋（キャッシュにない場合は保存先から取得）と比べ、保存済みの方が新しいスロットを取り込む
+           （取り込める新しいスロットがない古い集計は書き込まない）
+        2. 保存済みの内容と同じ行は書き込まない（skip_unchanged）
+        3. 保存済みの更新時刻が読み込んだ時点と同じ行だけを書き込む（upsert_results_if）
+        4. 他の書き込みが先に行われた行は指紋を読み直して 1 からやり直す（SAVE_ATTEMPTS 回まで）
+        5. update_baseline=True なら書き込んだ行で異常検出のベースラインを更新する（update_baselines）
+
+        指紋の取得・書き込みに失敗した場合、競合が続いた場合は例外を送出する（ベースラインは更新しない）。
+        """
+        written: List[Dict[str, Any]] = []
+        pending = list(rows)
+        for attempt in range(SAVE_ATTEMPTS):
+            keys = [(row['device_id'], row['date']) for row in pending]
+            stored = await self._stored_fingerprints(keys, refresh=attempt > 0)
+
+            batch: List[Dict[str, Any]] = []
+            expected: List[Optional[str]] = []
+            for key, row in zip(keys, pending):
+                fingerprint = stored.get(key)
+                row = await self._reconcile(row, fingerprint)
+                if row is None:
+                    self._count('result_writes', outcome='stale')
+                elif self.skip_unchanged and fingerprint is not None and \
+                        (fingerprint.hash, fingerprint.rules_version) == (row['behavior_aggregator_hash'],
+                                                                          row['behavior_aggregator_rules_version']):
+                    self._count('result_writes', outcome='skipped')
+                else:
+                    batch.append(row)
+                    expected.append(fingerprint.written_at if fingerprint is not None else None)
+            if not batch:
+                break
+
+            conflicts = set(await self.storage.upsert_results_if(batch, expected))
+            done = [row for row in batch if (row['device_id'], row['date']) not in conflicts]
+            self.mark_written(done)
+            written.extend(done)
+            pending = [row for row in batch if (row['device_id'], row['date']) in conflicts]
+            if not pending:
+                break
+            self._count('result_writes', len(pending), outcome='conflict')
+            logger.info("他の書き込みと競合したため読み直します", extra=fields(rows=len(pending), attempt=attempt + 1))
+        else:
+            raise StorageError(CONFLICT, 'upsert', f"{len(pending)}件の保存が他の書き込みと競合し続けました")
+        if update_baseline and written:
+            await self.update_baselines(written)
+        return written
+
+    def mark_written(self, rows: List[Dict[str, Any]]) -> None:
+        """書き込んだ行の指紋を記録"""
+        for row in rows:
+            self._remember((row['device_id'], row['date']), Fingerprint.of(row))
+        if rows:
+            self._count('result_writes', len(rows), outcome='written')
+            for hook in self.write_hooks:
+                hook(rows)
+
+    async def restamp(self, device_id: str, date: str, rules_version: str) -> None:
+        """保存済みの行のルールバージョンのみ更新（集計結果・更新時刻は変えない）
+
+        キャッシュした指紋のルールバージョンも合わせて更新し、次の run で変更のない行を書き直さないようにする。
+        """
+        await self.storage.update_result(device_id, date, {'behavior_aggregator_rules_version': rules_version})
+        key = (device_id, date)
+        fingerprint = self._fingerprints.get(key)
+        if fingerprint is not None:
+            self._fingerprints[key] = fingerprint._replace(rules_version=rules_version)
+
+    async def save_to_supabase(self, result: Dict, device_id: str, date: str, update_baseline: bool = True) -> bool:
+        """結果をaudio_aggregatorテーブルに保存（条件付きUPSERT、save_rows 参照）
+
+        保存済みの内容と同じ場合・保存済みの方が新しい場合は書き込まずにFalseを返す。失敗した場合は例外を送出する。
+        """
+        row = self.build_result_row(result, device_id, date)
+        try:
+            written = await self.save_rows([row], update_baseline)
         except Exception as e:
-            print(f"❌ Supabase保存エラー: {e}")
+            self._count('supabase_errors', operation='upsert', reason=failure_reason(e))
+            logger.error("保存エラー", extra=fields(
+                device_id=device_id, date=date, reason=failure_reason(e), error=str(e)
+            ))
+            raise
+
+        if not written:
+            logger.debug("変更がない（または保存済みの方が新しい）ため保存を省略", extra=fields(device_id=device_id, date=date))
             return False
+        logger.debug("保存完了", extra=fields(table='audio_aggregator', device_id=device_id, date=date))
+        return True
 
-    async def run(self, device_id: str, date: str) -> dict:
+    async def run(self, device_id: str, date: str, rules: Optional[CompiledRules] = None,
+                  update_baseline: bool = True) -> dict:
         """メイン処理実行
 
         Args:
             device_id: デバイスID
             date: 対象日付（YYYY-MM-DD形式）
+            rules: 集計ルール（省略時は現在有効なルール）
+            update_baseline: 書き込んだ場合に異常検出のベースラインを更新する（ルール変更時の再集計ではFalse）
         """
-        print(f"🚀 SED集計処理開始: {device_id}, {date}")
+        logger.debug("SED集計処理開始", extra=fields(device_id=device_id, date=date))
 
-        # Supabaseからデータ取得
-        slot_data = await self.fetch_all_data(device_id, date)
+        # データ取得（失敗は「データなし」と区別して理由を返す）
+        try:
+            with self._stage('fetch'):
+                slot_data = await self.fetch_all_data(device_id, date)
+        except Exception as e:
+            return {"success": False, "reason": failure_reason(e), "operation": "fetch",
+                    "message": f"データの取得に失敗しました: {e}"}
 
         if not slot_data:
-            print(f"⚠️ {date}のデータがありません")
+            logger.warning("データがありません", extra=fields(device_id=device_id, date=date))
             return {"success": False, "reason": "no_data", "message": f"{date}のデータがありません"}
 
-        # データ集計
-        result = self.aggregate_data(slot_data)
+        # データ集計・異常検出
+        result = await self.aggregate(slot_data, rules)
+        await self.detect_anomalies(result, device_id, date)
 
-        # Supabaseに保存
-        success = await self.save_to_supabase(result, device_id, date)
+        # 保存
+        try:
+            with self._stage('upsert'):
+                written = await self.save_to_supabase(result, device_id, date, update_baseline)
+        except Exception as e:
+            return {"success": False, "reason": failure_reason(e), "operation": "upsert",
+                    "message": f"データの保存に失敗しました: {e}"}
 
-        if success:
-            print("🎉 SED集計処理完了")
-            return {"success": True, "message": "処理完了", "result": result}
-        else:
-            return {"success": False, "reason": "save_error", "message": "データの保存に失敗しました"}
+        logger.debug("SED集計処理完了", extra=fields(device_id=device_id, date=date,
+                                                 rules_version=result["rules_version"], written=written))
+        return {"success": True, "message": "処理完了", "result": result, "written": written}
 
 
 async def main():
     """コマンドライン実行用メイン関数"""
+    load_dotenv()
     parser = argparse.ArgumentParser(description="SED データ集計ツール (Supabase版)")
     parser.add_argument("device_id", help="デバイスID（例: d067d407-cf73-4174-a9c1-d91fb60d64d0）")
     parser.add_argument("date", help="対象日付（YYYY-MM-DD形式）")
 
     args = parser.parse_args()
+    configure_logging(default_format="text")
 
     # 日付形式検証
     try:
@@ -303,7 +684,10 @@ async def main():
 
     if result["success"]:
         print(f"\n✅ 処理完了")
-        print(f"💾 データはSupabaseのaudio_aggregatorテーブルに保存されました")
+        if result["written"]:
+            print(f"💾 データはSupabaseのaudio_aggregatorテーブルに保存されました")
+        else:
+            print(f"💾 保存済みの集計結果と同じため、書き込みを省略しました")
     else:
         print(f"\n❌ 処理失敗: {result['message']}")
 
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+変更フィード駆動のSED集計コンシューマー
+
+Lambdaからの POST /analysis/sed を待つ代わりに、audio_features の
+behavior_extractor_processed_at をウォーターマークとしてポーリングし、
+更新されたデバイス・日付をプロセス内で集計する。
+
+処理フロー:
+1. ウォーターマーク以降に更新された audio_features の行を取得
+2. (device_id, date) 単位でデバウンス（更新が落ち着くまで待つ）
+3. 処理対象になったデバイス・日付をバッチで取得・集計
+4. 集計結果をまとめて条件付きでUPSERTし、ウォーターマークを保存
+
+取得は (processed_at, device_id, date, time_block) のキーセットで続きから行う（同時刻の行が1ページより多くても進む）。
+ウォーターマークは「未処理の更新のうち最も古い時刻」（未処理がなければ最新の取得時刻）を保存するため、
+途中で停止しても再起動時に未処理の更新から再開する（その時刻の行は一度だけ再取得する）。
+
+※ Postgres の LISTEN/NOTIFY は使わず、ストレージバックエンド共通のポーリングで実装している
+"""
+
+import asyncio
+import argparse
+import logging
+import os
+import signal
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from coalescer import Debouncer
+from log_config import configure_logging, fields
+from sed_aggregator import SEDAggregator
+from storage import DeviceDay, FeedCursor, feed_cursor
+
+logger = logging.getLogger(__name__)
+
+# ウォーターマークの保存先
+DEFAULT_WATERMARK_PATH = os.getenv('SED_CONSUMER_WATERMARK_FILE', '.sed_consumer_watermark')
+
+
+class ChangeFeedConsumer:
+    """audio_featuresの更新をポーリングして集計するコンシューマー"""
+
+    def __init__(self, aggregator: SEDAggregator, poll_interval: float = 5.0, debounce: float = 30.0,
+                 max_wait: float = 300.0, batch_size: int = 20, page_size: int = 1000,
+                 watermark_path: Optional[str] = DEFAULT_WATERMARK_PATH, since: Optional[str] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            aggregator: 集計クライアント（保存先を含む）
+            poll_interval: ポーリング間隔（秒）
+            debounce: 最後の更新からこの秒数だけ更新がなければ集計する
+            max_wait: 最初の更新からこの秒数経過したら更新が続いていても集計する
+            batch_size: 1回にまとめて取得・保存するデバイス・日付の数
+            page_size: 1回のポーリングで取得する更新行の最大数
+            watermark_path: ウォーターマークの保存先（Noneで保存しない）
+            since: 開始時のウォーターマーク（保存済みのものより優先）
+            clock: 現在時刻（秒）を返す関数
+        """
+        self.aggregator = aggregator
+        self.storage = aggregator.storage
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.page_size = page_size
+        self.watermark_path = Path(watermark_path) if watermark_path else None
+        self.clock = clock
+
+        self.debouncer: Debouncer[DeviceDay] = Debouncer(debounce, max_wait)
+        # 取得済みの最後の行の位置（ウォーターマークから再開する場合はその時刻の全ての行の手前）
+        start = since or self._load_watermark()
+        self.cursor: Optional[FeedCursor] = (start, '', '', '') if start else None
+        # 待機中のキー → 最も古い未処理の更新時刻
+        self._pending_since: Dict[DeviceDay, str] = {}
+
+        self.stats = {"updates": 0, "aggregated": 0, "written": 0, "skipped": 0, "no_data": 0, "failed": 0}
+
+    # ==================== ウォーターマーク ====================
+
+    def _load_watermark(self) -> Optional[str]:
+        if self.watermark_path and self.watermark_path.is_file():
+            return self.watermark_path.read_text(encoding='utf-8').strip() or None
+        return None
+
+    @property
+    def watermark(self) -> Optional[str]:
+        """再開位置（未処理の更新のうち最も古い時刻）"""
+        if self._pending_since:
+            return min(self._pending_since.values())
+        return self.cursor[0] if self.cursor else None
+
+    def _save_watermark(self) -> None:
+        watermark = self.watermark
+        if self.watermark_path and watermark:
+            tmp = self.watermark_path.with_suffix('.tmp')
+            tmp.write_text(watermark, encoding='utf-8')
+            tmp.replace(self.watermark_path)
+
+    # ==================== ポーリング ====================
+
+    async def poll_once(self) -> int:
+        """ウォーターマーク以降の更新を取得してデバウンスキューに追加（新しい更新の件数を返す）"""
+        now = self.clock()
+        new_updates = 0
+
+        while True:
+            rows = await self.storage.fetch_feature_updates(self.cursor, self.page_size)
+            for row in rows:
+                key = (row['device_id'], row['date'])
+                self.debouncer.touch(key, now)
+                self._pending_since.setdefault(key, row['behavior_extractor_processed_at'])
+                self.cursor = feed_cursor(row)
+
+            new_updates += len(rows)
+            # ページが埋まっている場合は続きを取得
+            if len(rows) < self.page_size:
+                break
+
+        self.stats["updates"] += new_updates
+        return new_updates
+
+    # ==================== 集計 ====================
+
+    async def _process_batch(self, keys: List[DeviceDay]) -> None:
+        """デバイス・日付のバッチを取得・集計・保存（取得できたデバイス・日付から順に集計）"""
+        rows: List[Dict[str, Any]] = []
+        async for (device_id, date), slot_data in self.storage.iter_slots(keys):
+            result = await self.aggregator.aggregate(slot_data)
+            await self.aggregator.detect_anomalies(result, device_id, date)
+            rows.append(self.aggregator.build_result_row(result, device_id, date))
+
+        changed = await self.aggregator.save_rows(rows)
+        self.stats["no_data"] += len(keys) - len(rows)
+        self.stats["aggregated"] += len(rows)
+        self.stats["written"] += len(changed)
+        self.stats["skipped"] += len(rows) - len(changed)
+
+    async def flush(self, force: bool = False) -> int:
+        """処理対象になったデバイス・日付を集計（force=Trueで待機中の全件）。集計した件数を返す"""
+        processed = 0
+        while True:
+            now = float('inf') if force else self.clock()
+            keys = self.debouncer.pop_due(now, self.batch_size)
+            if not keys:
+                break
+
+            try:
+                await self._process_batch(keys)
+            except Exception as e:
+                # 失敗したキーは再度待機させ、次のポーリング後に再試行する
+                self.stats["failed"] += len(keys)
+                retry_at = self.clock()
+                for key in keys:
+                    self.debouncer.touch(key, retry_at)
+                logger.error("変更フィードの集計に失敗しました", extra=fields(keys=len(keys), error=str(e)))
+                break
+
+            for key in keys:
+                self._pending_since.pop(key, None)
+            processed += len(keys)
+            logger.info("変更フィードの集計完了", extra=fields(
+                batch=len(keys), pending=len(self.debouncer), watermark=self.watermark
+            ))
+
+        self._save_watermark()
+        return processed
+
+    async def run_forever(self, stop: asyncio.Event) -> None:
+        """stopがセットされるまでポーリングと集計を繰り返す（停止時は待機中の全件を集計）"""
+        logger.info("変更フィードのコンシューマー開始", extra=fields(
+            storage=self.storage.name, watermark=self.watermark, debounce=self.debouncer.window
+        ))
+        while not stop.is_set():
+            try:
+                await self.poll_once()
+            except Exception as e:
+                logger.error("変更フィードの取得に失敗しました", extra=fields(error=str(e)))
+            await self.flush()
+
+            # 次のポーリングか、最も早いデバウンス期限まで待つ
+            timeout = self.poll_interval
+            next_deadline = self.debouncer.next_deadline()
+            if next_deadline is not None:
+                timeout = max(0.0, min(timeout, next_deadline - self.clock()))
+            try:
+                await asyncio.wait_for(stop.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        await self.flush(force=True)
+        logger.info("変更フィードのコンシューマー停止", extra=fields(**self.stats))
+
+
+async def main():
+    """コマンドライン実行用メイン関数"""
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="変更フィード駆動のSED集計コンシューマー")
+    parser.add_argument("--poll-interval", type=float, default=5.0, help="ポーリング間隔（秒）")
+    parser.add_argument("--debounce", type=float, default=30.0, help="更新が落ち着くまで待つ秒数")
+    parser.add_argument("--max-wait", type=float, default=300.0, help="更新が続いても集計するまでの最大秒数")
+    parser.add_argument("--batch-size", type=int, default=20, help="まとめて集計するデバイス・日付の数")
+    parser.add_argument("--since", default=None, help="開始時のウォーターマーク（ISO 8601形式）")
+    parser.add_argument("--watermark-file", default=DEFAULT_WATERMARK_PATH, help="ウォーターマークの保存先")
+    args = parser.parse_args()
+    configure_logging()
+
+    consumer = ChangeFeedConsumer(
+        SEDAggregator(), poll_interval=args.poll_interval, debounce=args.debounce, max_wait=args.max_wait,
+        batch_size=args.batch_size, watermark_path=args.watermark_file, since=args.since
+    )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await consumer.run_forever(stop)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+複数デバイス・日付のパイプライン集計（バックフィル・一括集計用）
+
+SEDAggregator.run は取得 → 集計 → 保存を1件ずつ順番に行うため、集計中はDBが、取得中はCPUが遊ぶ。
+このパイプラインは3つのステージを上限付きキューでつなぎ、並行して動かす。
+
+    取得（iter_slots、ページ先読み） → [キュー] → 集計（aggregate） → [キュー] → 保存（複数行UPSERT）
+
+- 日N+1の取得、日Nの集計、日N-1の保存が重なって実行される
+- 保存はキューに溜まっている行をまとめて（最大 save_batch 件）1回の条件付きUPSERTで書き込む
+  （保存済みの内容と同じ行・保存済みの方が新しい行は書き込まない。SEDAggregator.save_rows 参照）
+- キューに上限があるため、保存が遅い場合は取得も待つ（メモリ使用量が増え続けない）
+"""
+
+import asyncio
+import argparse
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from log_config import configure_logging, fields
+from sed_aggregator import SEDAggregator, failure_reason
+from sed_rules import CompiledRules, get_rules
+from storage import DeviceDay
+
+logger = logging.getLogger(__name__)
+
+# 進捗通知コールバック: (処理済み件数, 対象件数)
+ProgressCallback = Callable[[int, int], None]
+
+# ステージ終了の目印
+_DONE = object()
+
+
+def date_range(start: str, end: str) -> List[str]:
+    """start から end まで（両端を含む）の日付（YYYY-MM-DD）"""
+    first = datetime.strptime(start, "%Y-%m-%d").date()
+    last = datetime.strptime(end, "%Y-%m-%d").date()
+    if last < first:
+        raise ValueError("終了日は開始日以降を指定してください")
+    return [(first + timedelta(days=i)).isoformat() for i in range((last - first).days + 1)]
+
+
+class AggregationPipeline:
+    """取得・集計・保存を重ねて実行するパイプライン"""
+
+    def __init__(self, aggregator: Optional[SEDAggregator] = None, fetch_batch: int = 10,
+                 save_batch: int = 20, queue_size: int = 8, progress: Optional[ProgressCallback] = None):
+        """
+        Args:
+            aggregator: 集計クライアント（保存先を含む）
+            fetch_batch: 1回の取得でまとめるデバイス・日付の数
+            save_batch: 1回のUPSERTでまとめる最大行数
+            queue_size: ステージ間キューの上限
+            progress: 進捗通知コールバック
+        """
+        self.aggregator = aggregator or SEDAggregator()
+        self.storage = self.aggregator.storage
+        self.fetch_batch = max(1, fetch_batch)
+        self.save_batch = max(1, save_batch)
+        self.queue_size = max(1, queue_size)
+        self.progress = progress
+
+    async def run(self, keys: Sequence[DeviceDay], rules: Optional[CompiledRules] = None) -> Dict[str, Any]:
+        """デバイス・日付をまとめて集計・保存し、件数の概要を返す"""
+        # 1回の実行では同じバージョンのルールを使う
+        rules = rules or get_rules()
+        keys = list(dict.fromkeys(keys))
+        total = len(keys)
+        done = aggregated = written = skipped = no_data = upserts = 0
+        failed: List[Dict[str, str]] = []
+
+        fetched: asyncio.Queue = asyncio.Queue(self.queue_size)
+        built: asyncio.Queue = asyncio.Queue(self.queue_size)
+
+        def report(count: int = 0) -> None:
+            nonlocal done
+            done += count
+            if self.progress:
+                self.progress(done, total)
+
+        def fail(batch: Sequence[DeviceDay], error: BaseException, operation: str) -> None:
+            reason = failure_reason(error)
+            failed.extend({"device_id": device_id, "date": date, "reason": reason} for device_id, date in batch)
+            logger.error("パイプライン処理エラー", extra=fields(
+                operation=operation, keys=len(batch), reason=reason, error=str(error)
+            ))
+            report(len(batch))
+
+        async def fetch_stage() -> None:
+            nonlocal no_data
+            try:
+                for i in range(0, total, self.fetch_batch):
+                    batch = keys[i:i + self.fetch_batch]
+                    found = set()
+                    try:
+                        async for key, slot_data in self.storage.iter_slots(batch):
+                            found.add(key)
+                            await fetched.put((key, slot_data))
+                    except Exception as e:
+                        fail([key for key in batch if key not in found], e, 'fetch')
+                        continue
+                    missing = len(batch) - len(found)
+                    no_data += missing
+                    report(missing)
+            finally:
+                await fetched.put(_DONE)
+
+        async def aggregate_stage() -> None:
+            try:
+                while True:
+                    item = await fetched.get()
+                    if item is _DONE:
+                        break
+                    (device_id, date), slot_data = item
+                    try:
+                        result = await self.aggregator.aggregate(slot_data, rules)
+                        await self.aggregator.detect_anomalies(result, device_id, date)
+                    except Exception as e:
+                        fail([(device_id, date)], e, 'aggregate')
+                        continue
+                    await built.put(((device_id, date), self.aggregator.build_result_row(result, device_id, date)))
+            finally:
+                await built.put(_DONE)
+
+        async def save_stage() -> None:
+            nonlocal aggregated, written, skipped, upserts
+            finished = False
+            while not finished:
+                item = await built.get()
+                if item is _DONE:
+                    break
+                batch: List[Tuple[DeviceDay, Dict[str, Any]]] = [item]
+                # キューに溜まっている行をまとめて1回で書き込む
+                while len(batch) < self.save_batch and not built.empty():
+                    item = built.get_nowait()
+                    if item is _DONE:
+                        finished = True
+                        break
+                    batch.append(item)
+
+                try:
+                    rows = await self.aggregator.save_rows([row for _, row in batch])
+                except Exception as e:
+                    fail([key for key, _ in batch], e, 'upsert')
+                    continue
+                if rows:
+                    upserts += 1
+                aggregated += len(batch)
+                written += len(rows)
+                skipped += len(batch) - len(rows)
+                report(len(batch))
+
+        report()
+        stages = [
+            asyncio.ensure_future(fetch_stage()),
+            asyncio.ensure_future(aggregate_stage()),
+            asyncio.ensure_future(save_stage()),
+        ]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            for stage in stages:
+                stage.cancel()
+
+        summary = {
+            "rules_version": rules.version,
+            "total": total,
+            "aggregated": aggregated,
+            "written": written,
+            "skipped": skipped,
+            "no_data": no_data,
+            "upserts": upserts,
+            "failed": failed,
+        }
+        logger.info("パイプライン集計完了", extra=fields(**{**summary, "failed": len(failed)}))
+        return summary
+
+
+async def main():
+    """コマンドライン実行用メイン関数（バックフィル）"""
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="複数デバイス・日付のバックフィル集計")
+    parser.add_argument("--device-id", action="append", required=True, help="デバイスID（複数指定可）")
+    parser.add_argument("--start", required=True, help="開始日（YYYY-MM-DD形式）")
+    parser.add_argument("--end", default=None, help="終了日（YYYY-MM-DD形式、省略時は開始日のみ）")
+    parser.add_argument("--fetch-batch", type=int, default=10, help="1回の取得でまとめるデバイス・日付の数")
+    parser.add_argument("--save-batch", type=int, default=20, help="1回のUPSERTでまとめる最大行数")
+    args = parser.parse_args()
+    configure_logging(default_format="text")
+
+    dates = date_range(args.start, args.end or args.start)
+    keys = [(device_id, date) for device_id in args.device_id for date in dates]
+
+    def progress(done: int, total: int) -> None:
+        print(f"📊 進捗: {done}/{total}")
+
+    pipeline = AggregationPipeline(fetch_batch=args.fetch_batch, save_batch=args.save_batch, progress=progress)
+    summary = await pipeline.run(keys)
+    print(f"\n✅ バックフィル完了: 集計 {summary['aggregated']}（書き込み {summary['written']}, "
+          f"変更なし {summary['skipped']}）, データなし {summary['no_data']}, "
+          f"UPSERT {summary['upserts']}回, 失敗 {len(summary['failed'])}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
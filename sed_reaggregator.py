@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+ルール変更時の選択的再集計ツール
+
+audio_aggregatorの各行には集計時のルールバージョン（behavior_aggregator_rules_version）と
+出現した生ラベルとその適用結果（behavior_aggregator_labels）が記録されている。
+新しいルールで生ラベルの適用結果が変わる行だけを再集計し、
+影響のない行はルールバージョンの更新のみ行う。
+
+処理フロー:
+1. 現在のルールと異なるバージョンで集計された行を取得
+2. 記録済みの生ラベルを新ルールで再評価し、結果が変わる行を抽出
+3. 影響のある行を並列数を制限して再集計（進捗を通知）
+4. 影響のない行はルールバージョンのみ更新
+
+※ カテゴリー（priority_categories）はDBに保存されないため、再集計の対象判定には使わない
+"""
+
+import asyncio
+import argparse
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from log_config import configure_logging, fields
+from sed_aggregator import SEDAggregator
+from sed_rules import CompiledRules, get_rules
+
+logger = logging.getLogger(__name__)
+
+# 1ページあたりの取得行数（PostgRESTの最大行数より小さくする）
+PAGE_SIZE = 500
+
+# 進捗通知コールバック: (処理済み件数, 対象件数)
+ProgressCallback = Callable[[int, int], None]
+
+
+def is_affected(label_map: Optional[Dict[str, Optional[str]]], rules: CompiledRules) -> bool:
+    """記録済みの生ラベルの適用結果が新ルールで変わるか判定
+
+    ラベル記録がない行（この仕組みの導入前に集計された行）は常に対象とする。
+    """
+    if label_map is None:
+        return True
+    return any(rules.map_label(label) != mapped for label, mapped in label_map.items())
+
+
+class SelectiveReaggregator:
+    """ルールバージョンに基づく選択的再集計クラス"""
+
+    def __init__(self, aggregator: Optional[SEDAggregator] = None, concurrency: int = 4,
+                 progress: Optional[ProgressCallback] = None):
+        self.aggregator = aggregator or SEDAggregator()
+        self.concurrency = max(1, concurrency)
+        self.progress = progress
+
+    async def find_stale_rows(self, rules: CompiledRules) -> List[Dict[str, Any]]:
+        """現在のルールと異なるバージョンで集計された行を取得"""
+        rows: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            page = await self.aggregator.storage.fetch_stale_results(rules.version, offset, PAGE_SIZE)
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                return rows
+            offset += PAGE_SIZE
+
+    def plan(self, rows: List[Dict[str, Any]], rules: CompiledRules) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+        """再集計が必要な行とバージョン更新のみでよい行に分ける"""
+        affected: List[Tuple[str, str]] = []
+        unchanged: List[Tuple[str, str]] = []
+        for row in rows:
+            key = (row['device_id'], row['date'])
+            if is_affected(row.get('behavior_aggregator_labels'), rules):
+                affected.append(key)
+            else:
+                unchanged.append(key)
+        return affected, unchanged
+
+    async def _restamp(self, device_id: str, date: str, rules: CompiledRules) -> None:
+        """集計結果が変わらない行のルールバージョンのみ更新"""
+        await self.aggregator.restamp(device_id, date, rules.version)
+
+    async def run(self, rules: Optional[CompiledRules] = None) -> Dict[str, Any]:
+        """選択的再集計を実行
+
+        Returns:
+            rules_version, stale, reaggregated, restamped, failed を含む集計結果
+        """
+        rules = rules or get_rules()
+        rows = await self.find_stale_rows(rules)
+        affected, unchanged = self.plan(rows, rules)
+        logger.info("選択的再集計の対象を決定", extra=fields(
+            rules_version=rules.version, stale=len(rows), reaggregate=len(affected), restamp=len(unchanged)
+        ))
+
+        total = len(affected) + len(unchanged)
+        done = reaggregated = restamped = 0
+        failed: List[Dict[str, str]] = []
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        def report() -> None:
+            if self.progress:
+                self.progress(done, total)
+
+        async def reaggregate(device_id: str, date: str) -> None:
+            nonlocal done, reaggregated
+            async with semaphore:
+                try:
+                    result = await self.aggregator.run(device_id, date, rules, update_baseline=False)
+                    if result["success"]:
+                        reaggregated += 1
+                    else:
+                        failed.append({"device_id": device_id, "date": date, "reason": result.get("reason", "unknown")})
+                except Exception as e:
+                    failed.append({"device_id": device_id, "date": date, "reason": str(e)})
+                done += 1
+                report()
+
+        async def restamp(device_id: str, date: str) -> None:
+            nonlocal done, restamped
+            async with semaphore:
+                try:
+                    await self._restamp(device_id, date, rules)
+                    restamped += 1
+                except Exception as e:
+                    failed.append({"device_id": device_id, "date": date, "reason": str(e)})
+                done += 1
+                report()
+
+        report()
+        await asyncio.gather(
+            *(reaggregate(device_id, date) for device_id, date in affected),
+            *(restamp(device_id, date) for device_id, date in unchanged),
+        )
+
+        return {
+            "rules_version": rules.version,
+            "stale": len(rows),
+            "reaggregated": reaggregated,
+            "restamped": restamped,
+            "failed": failed,
+        }
+
+
+async def main():
+    """コマンドライン実行用メイン関数"""
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="ルール変更時の選択的再集計")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に再集計する最大件数")
+    parser.add_argument("--dry-run", action="store_true", help="対象の行を表示するだけで再集計しない")
+    args = parser.parse_args()
+    configure_logging(default_format="text")
+
+    def progress(done: int, total: int) -> None:
+        print(f"📊 進捗: {done}/{total}")
+
+    reaggregator = SelectiveReaggregator(concurrency=args.concurrency, progress=progress)
+    rules = get_rules()
+
+    if args.dry_run:
+        affected, unchanged = reaggregator.plan(await reaggregator.find_stale_rows(rules), rules)
+        for device_id, date in affected:
+            print(f"  再集計: {device_id} {date}")
+        print(f"\n再集計 {len(affected)} 行, バージョン更新のみ {len(unchanged)} 行")
+        return
+
+    summary = await reaggregator.run(rules)
+    print(f"\n✅ 再集計完了: 再集計 {summary['reaggregated']}, バージョン更新 {summary['restamped']}, "
+          f"失敗 {len(summary['failed'])}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
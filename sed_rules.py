@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+SED集計ルールエンジン
+
+除外イベント・音の統合マッピング・優先カテゴリーをバージョン付きのルールファイル
+（デフォルト: sed_rules.json）から読み込み、ハッシュ/frozensetベースの
+ルックアップテーブルにコンパイルする。
+
+ルールファイルの形式:
+{
+  "version": "2025-10-01.1",
+  "excluded_events": ["Snake", "White noise"],
+  "consolidation": {"Water tap, faucet": "Water sounds", "Walk*": "Footsteps"},
+  "consolidation_regex": [["^Child .*$", "Child speech"]],
+  "priority_categories": {"biometric": ["Cough", "Sneeze"], "voice": ["Speech"]}
+}
+
+- `*` / `?` を含むキーはワイルドカードとして扱い、読み込み時に一度だけ正規表現へコンパイルする
+- ファイルの更新は実行中に検知して再読み込みし、参照の差し替えでアトミックに切り替える
+"""
+
+import fnmatch
+import json
+import logging
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Optional, Pattern, Tuple
+
+from log_config import fields
+
+logger = logging.getLogger(__name__)
+
+# ルールファイルのパス（環境変数で上書き可能）
+DEFAULT_RULES_PATH = Path(__file__).with_name('sed_rules.json')
+
+# ルールファイルが存在しない場合のバージョン
+BUILTIN_RULES_VERSION = "builtin"
+
+# ラベル解決結果のメモ上限（AudioSetのラベル数に対して十分な大きさ）
+_MEMO_LIMIT = 10000
+
+# 除外されたラベルを表すメモ上の番兵
+_EXCLUDED = object()
+
+
+def _is_wildcard(pattern: str) -> bool:
+    return '*' in pattern or '?' in pattern
+
+
+class CompiledRules:
+    """コンパイル済みルール（不変。差し替えは RulesRegistry で行う）"""
+
+    __slots__ = (
+        'version', 'source', 'excluded', 'excluded_patterns', 'consolidation',
+        'consolidation_patterns', 'categories', 'priority_order', '_memo'
+    )
+
+    def __init__(self, source: Dict[str, Any]):
+        self.version: str = str(source.get('version') or BUILTIN_RULES_VERSION)
+        self.source = source
+
+        excluded = source.get('excluded_events') or []
+        self.excluded: FrozenSet[str] = frozenset(e for e in excluded if not _is_wildcard(e))
+        self.excluded_patterns: Tuple[Pattern, ...] = tuple(
+            re.compile(fnmatch.translate(e)) for e in excluded if _is_wildcard(e)
+        )
+
+        consolidation = source.get('consolidation') or {}
+        self.consolidation: Dict[str, str] = {
+            k: v for k, v in consolidation.items() if not _is_wildcard(k)
+        }
+        patterns: List[Tuple[Pattern, str]] = [
+            (re.compile(fnmatch.translate(k)), v) for k, v in consolidation.items() if _is_wildcard(k)
+        ]
+        patterns.extend(
+            (re.compile(pattern), target) for pattern, target in source.get('consolidation_regex') or []
+        )
+        self.consolidation_patterns: Tuple[Tuple[Pattern, str], ...] = tuple(patterns)
+
+        # イベント → カテゴリーの逆引きテーブル（先に定義されたカテゴリーを優先）
+        priority_categories = source.get('priority_categories') or {}
+        categories: Dict[str, str] = {}
+        for category, events in priority_categories.items():
+            for event in events:
+                categories.setdefault(event, category)
+        self.categories: Dict[str, str] = categories
+        self.priority_order: Tuple[str, ...] = tuple(priority_categories.keys()) + ('other',)
+
+        self._memo: Dict[str, Any] = {}
+
+    @property
+    def is_noop(self) -> bool:
+        """除外・統合ルールが一つもないか"""
+        return not (self.excluded or self.excluded_patterns
+                    or self.consolidation or self.consolidation_patterns)
+
+    def _resolve(self, label: str) -> Optional[str]:
+        if label in self.excluded:
+            return None
+        for pattern in self.excluded_patterns:
+            if pattern.match(label):
+                return None
+        target = self.consolidation.get(label)
+        if target is not None:
+            return target
+        for pattern, target in self.consolidation_patterns:
+            if pattern.match(label):
+                return target
+        return label
+
+    def map_label(self, label: str) -> Optional[str]:
+        """生ラベルを統合後のラベルに変換（除外対象はNone）"""
+        resolved = self._memo.get(label)
+        if resolved is None:
+            resolved = self._resolve(label)
+            if len(self._memo) < _MEMO_LIMIT:
+                self._memo[label] = _EXCLUDED if resolved is None else resolved
+            return resolved
+        return None if resolved is _EXCLUDED else resolved
+
+    def apply_counts(self, counts: Dict[str, int]) -> Dict[str, int]:
+        """ラベルごとの回数にフィルタリングと統合を適用（順番は最初に出現した順）"""
+        if self.is_noop:
+            return counts
+        map_label = self.map_label
+        mapped: Dict[str, int] = {}
+        for label, count in counts.items():
+            target = map_label(label)
+            if target is not None:
+                mapped[target] = mapped.get(target, 0) + count
+        return mapped
+
+    def category(self, event: str) -> str:
+        """イベントのカテゴリーを判定（未定義は "other"）"""
+        return self.categories.get(event, 'other')
+
+    def summary(self) -> Dict[str, Any]:
+        """ルールの概要（API表示用）"""
+        return {
+            "version": self.version,
+            "excluded_events": len(self.excluded) + len(self.excluded_patterns),
+            "consolidation": len(self.consolidation) + len(self.consolidation_patterns),
+            "priority_categories": list(self.priority_order[:-1]),
+        }
+
+
+def compile_rules(source: Dict[str, Any]) -> CompiledRules:
+    """ルール定義（dict）をコンパイル"""
+    return CompiledRules(source)
+
+
+def load_rules_file(path: Path) -> CompiledRules:
+    """ルールファイルを読み込んでコンパイル"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return compile_rules(json.load(f))
+
+
+class RulesRegistry:
+    """現在有効なルールを保持し、ファイル更新時にアトミックに差し替える"""
+
+    def __init__(self, path: Optional[Path] = None, check_interval: float = 5.0):
+        self.path = Path(path or os.getenv('SED_RULES_PATH') or DEFAULT_RULES_PATH)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._rules = compile_rules({})
+        self.reload(force=True)
+
+    def _current_mtime(self) -> Optional[float]:
+        try:
+            return self.path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def reload(self, force: bool = False) -> CompiledRules:
+        """ルールファイルを再読み込み（変更がなければ現在のルールを返す）
+
+        読み込みやコンパイルに失敗した場合は現在のルールを維持したまま例外を送出する。
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            mtime = self._current_mtime()
+            if not force and mtime == self._mtime:
+                return self._rules
+            rules = load_rules_file(self.path) if mtime is not None else compile_rules({})
+            # 参照の差し替えのみで切り替える（実行中の集計は旧ルールのまま完了する）
+            self._rules = rules
+            self._mtime = mtime
+            return rules
+
+    def get(self) -> CompiledRules:
+        """現在のルールを取得（check_interval毎にファイル更新を確認）"""
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            try:
+                self.reload()
+            except (OSError, ValueError, TypeError, re.error) as e:
+                logger.warning("ルールファイルの再読み込みに失敗しました（現在のルールを継続）",
+                               extra=fields(path=str(self.path), error=str(e)))
+        return self._rules
+
+
+rules_registry = RulesRegistry()
+
+
+def get_rules() -> CompiledRules:
+    """現在有効なルールを取得"""
+    return rules_registry.get()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+JSONシリアライズ
+
+orjsonがインストールされていればorjsonを使い、なければ標準ライブラリのjsonにフォールバックする。
+どちらもUTF-8のbytesを返し、日本語などの非ASCII文字はエスケープしない。
+APIレスポンス（api_server.FastJSONResponse）と audio_aggregator へのUPSERT本文で使用する。
+canonical_dumps はキーを並べ替えた出力で、集計結果のハッシュ（変更のない書き込みの判定）に使う。
+ハッシュは保存先に残るため、canonical_dumps は orjson の有無に関わらず標準ライブラリで出力する
+（orjson は 1e-07 を 1e-7 と書くなど、浮動小数点数の表記が標準ライブラリと異なる）。
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # orjsonは任意
+    orjson = None
+
+ORJSON_AVAILABLE = orjson is not None
+
+# orjsonのオプション（dictの非文字列キーを許可）
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def stdlib_dumps(obj: Any) -> bytes:
+    """標準ライブラリでシリアライズ（orjsonと同じく区切りの空白なし・非ASCIIをそのまま出力）"""
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def dumps(obj: Any) -> bytes:
+    """JSONのbytesにシリアライズ（シリアライズできない値は文字列化する）"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=_ORJSON_OPTIONS)
+    return stdlib_dumps(obj)
+
+
+def canonical_dumps(obj: Any) -> bytes:
+    """キーを並べ替えてシリアライズ（同じ内容なら orjson の有無に関わらず同じbytes）"""
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str, sort_keys=True).encode('utf-8')
+
+
+def loads(data: Any) -> Any:
+    """JSONを読み込む（bytes / str）"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,837 @@
+#!/usr/bin/env python3
+"""
+集計データの保存先（ストレージバックエンド）
+
+SEDAggregatorが読み書きする audio_features（入力）と audio_aggregator（出力）、
+異常検出のベースライン audio_aggregator_baselines を抽象化する。
+
+- SupabaseStorage: 本番用（Supabase / PostgREST）
+- MemoryStorage:   プロセス内のdict（負荷試験・ベンチマーク用）
+- SQLiteStorage:   ローカルのSQLiteファイル（オフライン実行・テスト用）
+
+環境変数:
+    SED_STORAGE      supabase（デフォルト） / memory / sqlite
+    SED_SQLITE_PATH  SQLiteのファイルパス（デフォルト: sed_local.db）
+    SED_SEED_FILE    起動時に audio_features へ読み込むNDJSONファイル（memory / sqlite のみ）
+    SED_FETCH_PAGE_SIZE    audio_featuresを取得する1ページの行数（supabaseのみ、デフォルト: 500）
+    SED_FETCH_CONCURRENCY  同時に先読みするページ数（supabaseのみ、デフォルト: 4）
+    SED_EXPORT_PAGE_SIZE   エクスポートで audio_aggregator を取得する1ページの行数（デフォルト: 50）
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import serialization
+from labels import label_table
+from resilience import REJECTED, ResiliencePolicy, StorageError
+
+# (device_id, date)
+DeviceDay = Tuple[str, str]
+# audio_features の変更フィードの位置 (behavior_extractor_processed_at, device_id, date, time_block)
+FeedCursor = Tuple[str, str, str, str]
+
+
+
+def feed_cursor(row: Dict[str, Any]) -> FeedCursor:
+    """fetch_feature_updates の行の位置"""
+    return (row['behavior_extractor_processed_at'], row['device_id'], row['date'], row['time_block'])
+
+
+class SlotData(dict):
+    """time_block → behavior_extractor_result
+
+    versions には取得した全スロット（結果が空のスロットを含む）の behavior_extractor_processed_at
+    （未設定は空文字列）を保持する。集計結果のスロット別バージョンとして保存する。
+    """
+
+    __slots__ = ('versions',)
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.versions: Dict[str, str] = {}
+
+
+# audio_aggregatorの列のうち、集計結果として保存するもの
+RESULT_COLUMNS = (
+    'behavior_aggregator_result',
+    'behavior_aggregator_rules_version',
+    'behavior_aggregator_labels',
+    'behavior_aggregator_anomalies',
+    'behavior_aggregator_profile',
+    'behavior_aggregator_slot_versions',
+    'behavior_aggregator_processed_at',
+)
+
+# 指紋（Fingerprint）の列
+FINGERPRINT_COLUMNS = ('behavior_aggregator_hash', 'behavior_aggregator_rules_version',
+                       'behavior_aggregator_slot_versions', 'behavior_aggregator_processed_at')
+
+
+class Fingerprint(NamedTuple):
+    """保存済みの内容の指紋（変更のない書き込みの省略・条件付き書き込みに使う）"""
+
+    hash: Optional[str]  # behavior_aggregator_hash
+    rules_version: Optional[str]  # behavior_aggregator_rules_version
+    slot_versions: Optional[Dict[str, str]]  # behavior_aggregator_slot_versions（スロット → 集計に使ったデータの更新時刻）
+    written_at: Optional[str]  # behavior_aggregator_processed_at（条件付き書き込みの比較値）
+
+    @classmethod
+    def of(cls, row: Dict[str, Any]) -> "Fingerprint":
+        """audio_aggregatorの行の指紋"""
+        return cls(*(row.get(column) for column in FINGERPRINT_COLUMNS))
+
+
+# audio_featuresのページサイズ（PostgRESTのmax-rows以下にする）と先読みページ数
+FETCH_PAGE_SIZE = int(os.getenv('SED_FETCH_PAGE_SIZE', '500'))
+FETCH_CONCURRENCY = int(os.getenv('SED_FETCH_CONCURRENCY', '4'))
+
+# エクスポートの1ページの行数（1行 = 1日分のtime_blocks。デコード後は1行あたり数百KBになる）
+EXPORT_PAGE_SIZE = int(os.getenv('SED_EXPORT_PAGE_SIZE', '50'))
+
+
+class AggregatorStorage(ABC):
+    """ストレージバックエンドのインターフェース"""
+
+    name = ""
+
+    # ==================== audio_features ====================
+
+    @abstractmethod
+    async def fetch_slots(self, device_id: str, date: str) -> SlotData:
+        """指定デバイス・日付のスロット別データを取得（データが空のスロットは含めない）"""
+
+    @abstractmethod
+    async def fetch_many(self, keys: Sequence[DeviceDay]) -> Dict[DeviceDay, SlotData]:
+        """複数のデバイス・日付のスロット別データをまとめて取得"""
+
+    async def iter_slots(self, keys: Sequence[DeviceDay]) -> AsyncIterator[Tuple[DeviceDay, SlotData]]:
+        """複数のデバイス・日付のスロット別データを、取得できたものから順に返す
+
+        データがないデバイス・日付は返さない。呼び出し側は次の取得と並行して集計できる。
+        """
+        results = await self.fetch_many(keys)
+        for key in keys:
+            if results.get(key):
+                yield key, results[key]
+
+    @abstractmethod
+    async def fetch_feature_updates(self, after: Optional[FeedCursor], limit: int) -> List[Dict[str, Any]]:
+        """位置（feed_cursor）が after より後の行を (processed_at, device_id, date, time_block) 順に取得
+
+        戻り値の各行は device_id, date, time_block, behavior_extractor_processed_at を含む。
+        同時刻の行が limit より多くても、最後の行の位置を次の after にすれば取りこぼさずに続きを取得できる。
+        """
+
+    # ==================== audio_aggregator ====================
+
+    @abstractmethod
+    async def fetch_result(self, device_id: str, date: str) -> Optional[Dict[str, Any]]:
+        """保存済みの集計結果を取得（存在しない場合はNone）"""
+
+    @abstractmethod
+    async def fetch_fingerprints(self, keys: Sequence[DeviceDay]) -> Dict[DeviceDay, Fingerprint]:
+        """保存済みの集計結果の指紋（ハッシュ・ルールバージョン・スロット別バージョン・更新時刻）をまとめて取得
+
+        保存されていないキーは含めない。
+        """
+
+    @abstractmethod
+    async def upsert_results_if(self, rows: List[Dict[str, Any]],
+                                expected: Sequence[Optional[str]]) -> List[DeviceDay]:
+        """保存済みの behavior_aggregator_processed_at が expected と一致する行だけを保存（条件付きUPSERT）
+
+        expected が None の行は未保存の場合のみ保存する。比較と書き込みは行ごとに不可分に行い、
+        一致しなかった（他の書き込みが先に行われた）行のキーを返す。
+        """
+
+    @abstractmethod
+    async def update_result(self, device_id: str, date: str, values: Dict[str, Any]) -> None:
+        """保存済みの集計結果の一部の列を更新"""
+
+    @abstractmethod
+    async def fetch_stale_results(self, rules_version: str, offset: int, limit: int) -> List[Dict[str, Any]]:
+        """rules_versionと異なる（またはNULLの）ルールで集計された行を device_id, date 順に取得
+
+        戻り値の各行は device_id, date, behavior_aggregator_labels を含む。
+        """
+
+    @abstractmethod
+    async def fetch_profiles(self, device_id: str) -> List[Dict[str, Any]]:
+        """デバイスの全ての日の活動プロファイル（date, behavior_aggregator_profile）を取得"""
+
+    @abstractmethod
+    def iter_result_pages(self, date_from: str, date_to: str, device_ids: Optional[Sequence[str]] = None,
+                          page_size: int = EXPORT_PAGE_SIZE) -> AsyncIterator[List[Dict[str, Any]]]:
+        """期間内（device_idsを指定した場合はそのデバイスのみ）の集計結果を device_id, date 順にページ単位で取得
+
+        各行は device_id, date, behavior_aggregator_result を含む。保持するのは先読み分のページのみ。
+        """
+
+    # ==================== audio_aggregator_baselines ====================
+
+    @abstractmethod
+    async def fetch_baseline(self, device_id: str) -> Optional[Dict[str, Any]]:
+        """デバイスの異常検出ベースライン（device_id, baseline, previous, as_of）を取得（存在しない場合はNone）
+
+        previous は as_of の日を反映する前のベースライン（as_of の日の再集計で使う）。
+        """
+
+    @abstractmethod
+    async def upsert_baseline(self, row: Dict[str, Any]) -> None:
+        """デバイスの異常検出ベースラインを保存（device_id で UPSERT）"""
+
+
+def _written_at(row: Optional[Dict[str, Any]]) -> Optional[str]:
+    """保存済みの行の behavior_aggregator_processed_at（未保存はNone）"""
+    return row.get('behavior_aggregator_processed_at') if row is not None else None
+
+
+def _slots_from_rows(rows: Iterable[Dict[str, Any]]) -> SlotData:
+    slots = SlotData()
+    for row in rows:
+        slots.versions[row['time_block']] = row.get('behavior_extractor_processed_at') or ''
+        if row['behavior_extractor_result']:
+            slots[row['time_block']] = row['behavior_extractor_result']
+    return slots
+
+
+class SupabaseStorage(AggregatorStorage):
+    """Supabase（PostgREST）を保存先とするバックエンド
+
+    supabase-pyは同期クライアントのため、呼び出しはスレッドで実行してイベントループを止めない。
+    呼び出しには ResiliencePolicy（タイムアウト・リトライ・サーキットブレーカー）を適用し、
+    失敗は resilience.StorageError として送出する。
+    """
+
+    name = "supabase"
+
+    # audio_featuresのレスポンスサイズ（バイト）の通知先
+    payload_hooks: List[Callable[[int], None]] = []
+
+    def __init__(self, url: Optional[str] = None, key: Optional[str] = None,
+                 policy: Optional[ResiliencePolicy] = None):
+        from dotenv import load_dotenv
+        from supabase import ClientOptions, create_client
+
+        # import時には読み込まないため、クライアント作成時に .env を読む（設定済みの環境変数は上書きしない）
+        load_dotenv()
+        url = url or os.getenv('SUPABASE_URL')
+        key = key or os.getenv('SUPABASE_KEY')
+        if not url or not key:
+            raise ValueError("SUPABASE_URLおよびSUPABASE_KEYが設定されていません")
+
+        self.policy = policy or ResiliencePolicy()
+        self.page_size = FETCH_PAGE_SIZE
+        self.fetch_concurrency = max(1, FETCH_CONCURRENCY)
+        self.client = create_client(url, key, ClientOptions(postgrest_client_timeout=self.policy.timeout))
+
+        session = self.client.postgrest.session
+        session.event_hooks = {
+            **session.event_hooks,
+            'response': [*session.event_hooks['response'], self._on_response]
+        }
+
+    def _on_response(self, response) -> None:
+        """httpxのレスポンスフック: audio_featuresの取得サイズを通知"""
+        if self.payload_hooks and response.request.method == 'GET' \
+                and response.request.url.path.endswith('/audio_features'):
+            response.read()
+            for hook in self.payload_hooks:
+                hook(len(response.content))
+
+    async def _fetch_pages(self, operation: str, build: Callable[[bool], Any],
+                           page_size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+        """offset / limit でページ分割して取得し、ページ順に返す
+
+        1ページ目で総件数（count=exact）を取得し、2ページ目以降は最大 fetch_concurrency ページを先読みする。
+        build(count) は並び順を指定したクエリを返す関数。
+        """
+        first = await self.policy.call(operation, build(True).range(0, page_size - 1).execute)
+        total = first.count if first.count is not None else len(first.data)
+        self._check_page(operation, first.data, 0, page_size, total)
+        yield first.data
+
+        offsets = list(range(page_size, total, page_size))
+        tasks: Dict[int, asyncio.Future] = {}
+        scheduled = 0
+        try:
+            for i, offset in enumerate(offsets):
+                while scheduled < min(i + self.fetch_concurrency, len(offsets)):
+                    start = offsets[scheduled]
+                    query = build(False).range(start, start + page_size - 1)
+                    tasks[scheduled] = asyncio.ensure_future(self.policy.call(operation, query.execute))
+                    scheduled += 1
+                response = await tasks.pop(i)
+                self._check_page(operation, response.data, offset, page_size, total)
+                yield response.data
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    @staticmethod
+    def _check_page(operation: str, rows: List[Dict[str, Any]], offset: int, page_size: int, total: int) -> None:
+        """PostgRESTのmax-rowsで行が切り詰められていないか確認（黙って欠損させない）"""
+        expected = min(page_size, max(0, total - offset))
+        if len(rows) < expected:
+            raise StorageError(REJECTED, operation,
+                               f"{operation}: ページの行数が不足しています（{len(rows)}/{expected}）。"
+                               f"SED_FETCH_PAGE_SIZE をPostgRESTのmax-rows以下にしてください")
+
+    async def iter_slots(self, keys: Sequence[DeviceDay]) -> AsyncIterator[Tuple[DeviceDay, SlotData]]:
+        if not keys:
+            return
+        wanted = set(keys)
+        device_ids = sorted({device_id for device_id, _ in wanted})
+        dates = sorted({date for _, date in wanted})
+
+        def build(count: bool):
+            return self.client.table('audio_features').select(
+                'device_id, date, time_block, behavior_extractor_result, behavior_extractor_processed_at',
+                count='exact' if count else None
+            ).in_('device_id', device_ids).in_('date', dates).order('device_id').order('date').order('time_block')
+
+        # device_id, date 順に並んでいるため、キーが変わった時点で前のデバイス・日付は揃っている
+        current: Optional[DeviceDay] = None
+        rows: List[Dict[str, Any]] = []
+        async for page in self._fetch_pages('fetch_many', build, self.page_size):
+            for row in page:
+                key = (row['device_id'], row['date'])
+                if key not in wanted:
+                    continue
+                if key != current:
+                    slots = _slots_from_rows(rows)
+                    if slots:
+                        yield current, slots
+                    current, rows = key, []
+                # ページ単位でラベルを共有表の文字列に置き換え、重複した文字列を解放する
+                label_table.intern_frames(row['behavior_extractor_result'])
+                rows.append(row)
+        slots = _slots_from_rows(rows)
+        if slots:
+            yield current, slots
+
+    async def fetch_slots(self, device_id: str, date: str) -> SlotData:
+        results = await self.fetch_many([(device_id, date)])
+        return results[(device_id, date)]
+
+    async def fetch_many(self, keys: Sequence[DeviceDay]) -> Dict[DeviceDay, SlotData]:
+        results: Dict[DeviceDay, SlotData] = {key: {} for key in keys}
+        async for key, slots in self.iter_slots(keys):
+            results[key] = slots
+        return results
+
+    async def fetch_feature_updates(self, after: Optional[FeedCursor], limit: int) -> List[Dict[str, Any]]:
+        query = self.client.table('audio_features').select(
+            'device_id, date, time_block, behavior_extractor_processed_at'
+        ).not_.is_('behavior_extractor_processed_at', 'null')
+        if after:
+            # (processed_at, device_id, date, time_block) > after（gte はインデックスで範囲を絞るため）
+            columns = ('behavior_extractor_processed_at', 'device_id', 'date', 'time_block')
+            values = [f'"{value}"' for value in after]
+            conditions = [f'{columns[0]}.gt.{values[0]}']
+            for i in range(1, len(columns)):
+                equal = [f'{columns[j]}.eq.{values[j]}' for j in range(i)]
+                conditions.append(f"and({','.join(equal + [f'{columns[i]}.gt.{values[i]}'])})")
+            query = query.gte('behavior_extractor_processed_at', after[0]).or_(','.join(conditions))
+        query = query.order('behavior_extractor_processed_at').order('device_id').order('date').order(
+            'time_block'
+        ).limit(limit)
+        response = await self.policy.call('fetch_feature_updates', query.execute)
+        return response.data
+
+    async def fetch_result(self, device_id: str, date: str) -> Optional[Dict[str, Any]]:
+        query = self.client.table('audio_aggregator').select(', '.join(RESULT_COLUMNS)).eq(
+            'device_id', device_id
+        ).eq(
+            'date', date
+        )
+        response = await self.policy.call('fetch_result', query.execute)
+        return response.data[0] if response.data else None
+
+    async def fetch_fingerprints(self, keys: Sequence[DeviceDay]) -> Dict[DeviceDay, Fingerprint]:
+        wanted = set(keys)
+        if not wanted:
+            return {}
+        device_ids = sorted({device_id for device_id, _ in wanted})
+        dates = sorted({date for _, date in wanted})
+
+        def build(count: bool):
+            return self.client.table('audio_aggregator').select(
+                ', '.join(('device_id', 'date') + FINGERPRINT_COLUMNS), count='exact' if count else None
+            ).in_('device_id', device_ids).in_('date', dates).order('device_id').order('date')
+
+        fingerprints: Dict[DeviceDay, Fingerprint] = {}
+        async for page in self._fetch_pages('fetch_fingerprints', build, self.page_size):
+            for row in page:
+                key = (row['device_id'], row['date'])
+                if key in wanted:
+                    fingerprints[key] = Fingerprint.of(row)
+        return fingerprints
+
+    def _upsert(self, body: Any, table: str) -> None:
+        """table へUPSERT（主キーが同じ行は指定した列のみ更新）
+
+        本文は serialization.dumps（orjson）でシリアライズ済みのbytesとして送信し、
+        supabase-py（httpx）の標準jsonによるシリアライズを避ける。応答本文は不要なので return=minimal。
+        """
+        self._post(f'/{table}', body, 'resolution=merge-duplicates,return=minimal')
+
+    def _post(self, path: str, body: Any, prefer: Optional[str] = None) -> Any:
+        """PostgRESTへPOSTし、応答本文（ない場合はNone）を返す（エラー応答は APIError として送出）"""
+        from postgrest.exceptions import APIError
+
+        headers = {'Content-Type': 'application/json'}
+        if prefer:
+            headers['Prefer'] = prefer
+        response = self.client.postgrest.session.post(path, content=serialization.dumps(body), headers=headers)
+        if response.status_code >= 400:
+            try:
+                error = serialization.loads(response.content)
+            except ValueError:
+                error = {'message': response.text}
+            if not isinstance(error, dict):
+                error = {'message': str(error)}
+            # エラーコードがない応答（プロキシの5xxなど）はHTTPステータスで判定する
+            error['code'] = error.get('code') or response.status_code
+            raise APIError(error)
+        return serialization.loads(response.content) if response.content else None
+
+    async def upsert_results_if(self, rows: List[Dict[str, Any]],
+                                expected: Sequence[Optional[str]]) -> List[DeviceDay]:
+        """関数 sed_upsert_results_if（migrations/001_sed_upsert_results_if.sql）で、比較と書き込みを1回の呼び出しでまとめて行う
+
+        タイムアウトしても書き込まれている場合があるためリトライしない（失敗として save_rows の呼び出し元に返す）。
+        """
+        if not rows:
+            return []
+        payload = [{**row, 'expected_processed_at': previous} for row, previous in zip(rows, expected)]
+        written = await self.policy.call(
+            'upsert_results', lambda: self._post('/rpc/sed_upsert_results_if', {'payload': payload}), idempotent=False
+        )
+        written = set(written or ())
+        return [(row['device_id'], row['date']) for i, row in enumerate(rows) if i not in written]
+
+    async def update_result(self, device_id: str, date: str, values: Dict[str, Any]) -> None:
+        query = self.client.table('audio_aggregator').update(values).eq('device_id', device_id).eq('date', date)
+        await self.policy.call('update_result', query.execute)
+
+    async def fetch_stale_results(self, rules_version: str, offset: int, limit: int) -> List[Dict[str, Any]]:
+        query = self.client.table('audio_aggregator').select(
+            'device_id, date, behavior_aggregator_labels'
+        ).or_(
+            f'behavior_aggregator_rules_version.is.null,behavior_aggregator_rules_version.neq.{rules_version}'
+        ).order('device_id').order('date').range(offset, offset + limit - 1)
+        response = await self.policy.call('fetch_stale_results', query.execute)
+        return response.data
+
+    async def fetch_profiles(self, device_id: str) -> List[Dict[str, Any]]:
+        def build(count: bool):
+            return self.client.table('audio_aggregator').select(
+                'date, behavior_aggregator_profile', count='exact' if count else None
+            ).eq('device_id', device_id).not_.is_('behavior_aggregator_profile', 'null').order('date')
+
+        rows: List[Dict[str, Any]] = []
+        async for page in self._fetch_pages('fetch_profiles', build, self.page_size):
+            rows.extend(page)
+        return rows
+
+    async def iter_result_pages(self, date_from: str, date_to: str, device_ids: Optional[Sequence[str]] = None,
+                                page_size: int = EXPORT_PAGE_SIZE) -> AsyncIterator[List[Dict[str, Any]]]:
+        def build(count: bool):
+            query = self.client.table('audio_aggregator').select(
+                'device_id, date, behavior_aggregator_result', count='exact' if count else None
+            ).gte('date', date_from).lte('date', date_to)
+            if device_ids:
+                query = query.in_('device_id', list(device_ids))
+            return query.order('device_id').order('date')
+
+        async for page in self._fetch_pages('export_results', build, min(page_size, self.page_size)):
+            yield page
+
+    async def fetch_baseline(self, device_id: str) -> Optional[Dict[str, Any]]:
+        query = self.client.table('audio_aggregator_baselines').select(
+            'device_id, baseline, previous, as_of'
+        ).eq('device_id', device_id)
+        response = await self.policy.call('fetch_baseline', query.execute)
+        return response.data[0] if response.data else None
+
+    async def upsert_baseline(self, row: Dict[str, Any]) -> None:
+        await self.policy.call('upsert_baseline', lambda: self._upsert(row, 'audio_aggregator_baselines'))
+
+
+class LocalStorage(AggregatorStorage):
+    """ローカルバックエンド共通（テストデータの読み込み）"""
+
+    @abstractmethod
+    def load_features(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """audio_featuresの行（device_id, date, time_block, behavior_extractor_result, ...）を読み込む"""
+
+    def load_seed_file(self, path: str) -> int:
+        """NDJSONファイルから audio_features の行を読み込み、件数を返す"""
+        with open(path, 'r', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        self.load_features(rows)
+        return len(rows)
+
+
+class MemoryStorage(LocalStorage):
+    """プロセス内のdictを保存先とするバックエンド"""
+
+    name = "memory"
+
+    def __init__(self):
+        self.features: Dict[DeviceDay, Dict[str, Dict[str, Any]]] = defaultdict(dict)
+        self.results: Dict[DeviceDay, Dict[str, Any]] = {}
+        self.baselines: Dict[str, Dict[str, Any]] = {}
+
+    def load_features(self, rows: Iterable[Dict[str, Any]]) -> None:
+        for row in rows:
+            row = dict(row)
+            label_table.intern_frames(row.get('behavior_extractor_result'))
+            self.features[(row['device_id'], row['date'])][row['time_block']] = row
+
+    async def fetch_slots(self, device_id: str, date: str) -> SlotData:
+        return _slots_from_rows(self.features.get((device_id, date), {}).values())
+
+    async def fetch_many(self, keys: Sequence[DeviceDay]) -> Dict[DeviceDay, SlotData]:
+        return {key: _slots_from_rows(self.features.get(key, {}).values()) for key in keys}
+
+    async def fetch_feature_updates(self, after: Optional[FeedCursor], limit: int) -> List[Dict[str, Any]]:
+        updates = [
+            {key: row.get(key) for key in ('device_id', 'date', 'time_block', 'behavior_extractor_processed_at')}
+            for slots in self.features.values() for row in slots.values()
+            if row.get('behavior_extractor_processed_at')
+        ]
+        if after is not None:
+            updates = [row for row in updates if feed_cursor(row) > after]
+        updates.sort(key=feed_cursor)
+        return updates[:limit]
+
+    async def fetch_result(self, device_id: str, date: str) -> Optional[Dict[str, Any]]:
+        row = self.results.get((device_id, date))
+        return dict(row) if row is not None else None
+
+    async def fetch_fingerprints(self, keys: Sequence[DeviceDay]) -> Dict[DeviceDay, Fingerprint]:
+        return {key: Fingerprint.of(self.results[key]) for key in keys if key in self.results}
+
+    async def upsert_results_if(self, rows: List[Dict[str, Any]],
+                                expected: Sequence[Optional[str]]) -> List[DeviceDay]:
+        conflicts: List[DeviceDay] = []
+        for row, previous in zip(rows, expected):
+            key = (row['device_id'], row['date'])
+            stored = self.results.get(key)
+            if _written_at(stored) != previous:
+                conflicts.append(key)
+                continue
+            self.results[key] = {**(stored or {}), **row}
+        return conflicts
+
+    async def update_result(self, device_id: str, date: str, values: Dict[str, Any]) -> None:
+        row = self.results.get((device_id, date))
+        if row is not None:
+            row.update(values)
+
+    async def fetch_stale_results(self, rules_version: str, offset: int, limit: int) -> List[Dict[str, Any]]:
+        stale = [
+            row for key, row in sorted(self.results.items())
+            if row.get('behavior_aggregator_rules_version') != rules_version
+        ]
+        return [
+            {key: row.get(key) for key in ('device_id', 'date', 'behavior_aggregator_labels')}
+            for row in stale[offset:offset + limit]
+        ]
+
+    async def fetch_profiles(self, device_id: str) -> List[Dict[str, Any]]:
+        return [
+            {'date': date, 'behavior_aggregator_profile': row['behavior_aggregator_profile']}
+            for (result_device, date), row in sorted(self.results.items())
+            if result_device == device_id and row.get('behavior_aggregator_profile')
+        ]
+
+    async def iter_result_pages(self, date_from: str, date_to: str, device_ids: Optional[Sequence[str]] = None,
+                                page_size: int = EXPORT_PAGE_SIZE) -> AsyncIterator[List[Dict[str, Any]]]:
+        wanted = set(device_ids) if device_ids else None
+        keys = sorted(
+            key for key in self.results
+            if date_from <= key[1] <= date_to and (wanted is None or key[0] in wanted)
+        )
+        for start in range(0, len(keys), page_size):
+            yield [
+                {'device_id': device_id, 'date': date,
+                 'behavior_aggregator_result': self.results[(device_id, date)].get('behavior_aggregator_result')}
+                for device_id, date in keys[start:start + page_size] if (device_id, date) in self.results
+            ]
+
+    async def fetch_baseline(self, device_id: str) -> Optional[Dict[str, Any]]:
+        row = self.baselines.get(device_id)
+        return dict(row) if row is not None else None
+
+    async def upsert_baseline(self, row: Dict[str, Any]) -> None:
+        self.baselines[row['device_id']] = {**self.baselines.get(row['device_id'], {}), **row}
+
+
+class SQLiteStorage(LocalStorage):
+    """SQLiteファイルを保存先とするバックエンド
+
+    JSONB列はJSON文字列として保存する。audio_aggregatorは検索に使う列以外を
+    row列（JSON）にまとめ、PostgRESTのUPSERTと同様に指定した列のみ更新する。
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS audio_features (
+        device_id TEXT NOT NULL,
+        date TEXT NOT NULL,
+        time_block TEXT NOT NULL,
+        behavior_extractor_result TEXT,
+        behavior_extractor_processed_at TEXT,
+        PRIMARY KEY (device_id, date, time_block)
+    );
+    CREATE TABLE IF NOT EXISTS audio_aggregator (
+        device_id TEXT NOT NULL,
+        date TEXT NOT NULL,
+        behavior_aggregator_rules_version TEXT,
+        row TEXT NOT NULL,
+        PRIMARY KEY (device_id, date)
+    );
+    CREATE TABLE IF NOT EXISTS audio_aggregator_baselines (
+        device_id TEXT PRIMARY KEY,
+        as_of TEXT,
+        baseline TEXT NOT NULL,
+        previous TEXT
+    );
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('SED_SQLITE_PATH', 'sed_local.db')
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript(self.SCHEMA)
+
+    def _execute(self, sql: str, params: Sequence[Any] = ()) -> List[Tuple]:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            self._conn.commit()
+            return rows
+
+    def _executemany(self, sql: str, params: Iterable[Sequence[Any]]) -> None:
+        with self._lock:
+            self._conn.executemany(sql, params)
+            self._conn.commit()
+
+    def load_features(self, rows: Iterable[Dict[str, Any]]) -> None:
+        self._executemany(
+            "INSERT OR REPLACE INTO audio_features VALUES (?, ?, ?, ?, ?)",
+            [
+                (row['device_id'], row['date'], row['time_block'],
+                 json.dumps(row['behavior_extractor_result'], ensure_ascii=False),
+                 row.get('behavior_extractor_processed_at'))
+                for row in rows
+            ]
+        )
+
+    def _fetch_slots(self, device_id: str, date: str) -> SlotData:
+        rows = self._execute(
+            "SELECT time_block, behavior_extractor_result, behavior_extractor_processed_at FROM audio_features"
+            " WHERE device_id = ? AND date = ?",
+            (device_id, date)
+        )
+        return _slots_from_rows(
+            {'time_block': time_block,
+             'behavior_extractor_result': label_table.intern_frames(json.loads(result)) if result else None,
+             'behavior_extractor_processed_at': processed_at}
+            for time_block, result, processed_at in rows
+        )
+
+    async def fetch_slots(self, device_id: str, date: str) -> SlotData:
+        return await asyncio.to_thread(self._fetch_slots, device_id, date)
+
+    async def fetch_many(self, keys: Sequence[DeviceDay]) -> Dict[DeviceDay, SlotData]:
+        return {key: await self.fetch_slots(*key) for key in keys}
+
+    def _fetch_feature_updates(self, after: Optional[FeedCursor], limit: int) -> List[Dict[str, Any]]:
+        rows = self._execute(
+            "SELECT device_id, date, time_block, behavior_extractor_processed_at FROM audio_features"
+            " WHERE behavior_extractor_processed_at IS NOT NULL"
+            " AND (behavior_extractor_processed_at, device_id, date, time_block) > (?, ?, ?, ?)"
+            " ORDER BY behavior_extractor_processed_at, device_id, date, time_block LIMIT ?",
+            (*(after or ('', '', '', '')), limit)
+        )
+        return [
+            {'device_id': device_id, 'date': date, 'time_block': time_block,
+             'behavior_extractor_processed_at': processed_at}
+            for device_id, date, time_block, processed_at in rows
+        ]
+
+    async def fetch_feature_updates(self, after: Optional[FeedCursor], limit: int) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self._fetch_feature_updates, after, limit)
+
+    def _fetch_result(self, device_id: str, date: str) -> Optional[Dict[str, Any]]:
+        rows = self._execute("SELECT row FROM audio_aggregator WHERE device_id = ? AND date = ?", (device_id, date))
+        return json.loads(rows[0][0]) if rows else None
+
+    async def fetch_result(self, device_id: str, date: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._fetch_result, device_id, date)
+
+    def _fetch_fingerprints(self, keys: Sequence[DeviceDay]) -> Dict[DeviceDay, Fingerprint]:
+        fingerprints: Dict[DeviceDay, Fingerprint] = {}
+        for key in keys:
+            row = self._fetch_result(*key)
+            if row is not None:
+                fingerprints[key] = Fingerprint.of(row)
+        return fingerprints
+
+    async def fetch_fingerprints(self, keys: Sequence[DeviceDay]) -> Dict[DeviceDay, Fingerprint]:
+        return await asyncio.to_thread(self._fetch_fingerprints, keys)
+
+    def _upsert_if(self, rows: List[Dict[str, Any]], expected: Sequence[Optional[str]]) -> List[DeviceDay]:
+        """保存済みの更新時刻が expected と一致する行のみUPSERTし、一致しなかったキーを返す"""
+        conflicts: List[DeviceDay] = []
+        with self._lock:
+            for i, row in enumerate(rows):
+                existing = self._conn.execute(
+                    "SELECT row FROM audio_aggregator WHERE device_id = ? AND date = ?",
+                    (row['device_id'], row['date'])
+                ).fetchone()
+                stored = json.loads(existing[0]) if existing else None
+                if _written_at(stored) != expected[i]:
+                    conflicts.append((row['device_id'], row['date']))
+                    continue
+                merged = {**(stored or {}), **row}
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO audio_aggregator VALUES (?, ?, ?, ?)",
+                    (merged['device_id'], merged['date'], merged.get('behavior_aggregator_rules_version'),
+                     json.dumps(merged, ensure_ascii=False))
+                )
+            self._conn.commit()
+        return conflicts
+
+    async def upsert_results_if(self, rows: List[Dict[str, Any]],
+                                expected: Sequence[Optional[str]]) -> List[DeviceDay]:
+        if not rows:
+            return []
+        return await asyncio.to_thread(self._upsert_if, rows, expected)
+
+    def _update_result(self, device_id: str, date: str, values: Dict[str, Any]) -> None:
+        """保存済みの行の列を1回のUPDATEで置き換える（読み込みと書き込みの間に他の書き込みが入らない）"""
+        if not values:
+            return
+        paths = ", ".join("?, json(?)" for _ in values)
+        params: List[Any] = []
+        for key, value in values.items():
+            params += [f'$."{key}"', json.dumps(value, ensure_ascii=False)]
+        sql = f"UPDATE audio_aggregator SET row = json_set(row, {paths})"
+        if 'behavior_aggregator_rules_version' in values:
+            sql += ", behavior_aggregator_rules_version = ?"
+            params.append(values['behavior_aggregator_rules_version'])
+        self._execute(sql + " WHERE device_id = ? AND date = ?", (*params, device_id, date))
+
+    async def update_result(self, device_id: str, date: str, values: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._update_result, device_id, date, values)
+
+    def _fetch_stale_results(self, rules_version: str, offset: int, limit: int) -> List[Dict[str, Any]]:
+        rows = self._execute(
+            "SELECT row FROM audio_aggregator"
+            " WHERE behavior_aggregator_rules_version IS NULL OR behavior_aggregator_rules_version != ?"
+            " ORDER BY device_id, date LIMIT ? OFFSET ?",
+            (rules_version, limit, offset)
+        )
+        return [
+            {key: row.get(key) for key in ('device_id', 'date', 'behavior_aggregator_labels')}
+            for row in (json.loads(r[0]) for r in rows)
+        ]
+
+    async def fetch_stale_results(self, rules_version: str, offset: int, limit: int) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self._fetch_stale_results, rules_version, offset, limit)
+
+    def _fetch_profiles(self, device_id: str) -> List[Dict[str, Any]]:
+        rows = self._execute("SELECT row FROM audio_aggregator WHERE device_id = ? ORDER BY date", (device_id,))
+        return [
+            {'date': row['date'], 'behavior_aggregator_profile': row['behavior_aggregator_profile']}
+            for row in (json.loads(r[0]) for r in rows) if row.get('behavior_aggregator_profile')
+        ]
+
+    async def fetch_profiles(self, device_id: str) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self._fetch_profiles, device_id)
+
+    def _fetch_result_page(self, date_from: str, date_to: str, device_ids: Optional[Sequence[str]],
+                           after: Optional[DeviceDay], limit: int) -> List[Dict[str, Any]]:
+        # 出力に必要な time_blocks だけを取り出してデコードする
+        sql = ("SELECT device_id, date, json_extract(row, '$.behavior_aggregator_result') FROM audio_aggregator"
+               " WHERE date BETWEEN ? AND ?")
+        params: List[Any] = [date_from, date_to]
+        if device_ids:
+            sql += f" AND device_id IN ({', '.join('?' * len(device_ids))})"
+            params += list(device_ids)
+        if after is not None:
+            # キーセット方式（OFFSETのように読み飛ばす行を走査しない）
+            sql += " AND (device_id, date) > (?, ?)"
+            params += list(after)
+        rows = self._execute(sql + " ORDER BY device_id, date LIMIT ?", params + [limit])
+        return [
+            {'device_id': device_id, 'date': date, 'behavior_aggregator_result': json.loads(result) if result else None}
+            for device_id, date, result in rows
+        ]
+
+    async def iter_result_pages(self, date_from: str, date_to: str, device_ids: Optional[Sequence[str]] = None,
+                                page_size: int = EXPORT_PAGE_SIZE) -> AsyncIterator[List[Dict[str, Any]]]:
+        after: Optional[DeviceDay] = None
+        while True:
+            page = await asyncio.to_thread(self._fetch_result_page, date_from, date_to, device_ids, after, page_size)
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            after = (page[-1]['device_id'], page[-1]['date'])
+
+    def _fetch_baseline(self, device_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._execute(
+            "SELECT as_of, baseline, previous FROM audio_aggregator_baselines WHERE device_id = ?", (device_id,)
+        )
+        if not rows:
+            return None
+        as_of, baseline, previous = rows[0]
+        return {'device_id': device_id, 'as_of': as_of, 'baseline': json.loads(baseline),
+                'previous': json.loads(previous) if previous else None}
+
+    async def fetch_baseline(self, device_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._fetch_baseline, device_id)
+
+    async def upsert_baseline(self, row: Dict[str, Any]) -> None:
+        await asyncio.to_thread(
+            self._execute, "INSERT OR REPLACE INTO audio_aggregator_baselines VALUES (?, ?, ?, ?)",
+            (row['device_id'], row.get('as_of'), json.dumps(row['baseline'], ensure_ascii=False),
+             json.dumps(row.get('previous'), ensure_ascii=False))
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_storage(kind: Optional[str] = None) -> AggregatorStorage:
+    """環境変数 SED_STORAGE に応じたバックエンドを作成"""
+    kind = (kind or os.getenv('SED_STORAGE', 'supabase')).lower()
+    if kind == 'supabase':
+        return SupabaseStorage()
+
+    if kind == 'memory':
+        storage: LocalStorage = MemoryStorage()
+    elif kind == 'sqlite':
+        storage = SQLiteStorage()
+    else:
+        raise ValueError(f"不明なストレージです: {kind}（supabase / memory / sqlite）")
+
+    seed_file = os.getenv('SED_SEED_FILE')
+    if seed_file:
+        storage.load_seed_file(seed_file)
+    return storage
@@ -0,0 +1,55 @@
+"""
+プロセスプールでの集計のテスト（spawnでワーカーを起動するため数秒かかる）
+"""
+
+import asyncio
+
+import pytest
+
+from aggregation_pool import AggregationPool, create_pool
+from benchmarks.synthetic import DENSE_DAY, SPARSE_DAY, TYPICAL_DAY, generate_day
+from sed_aggregator import SEDAggregator
+from sed_rules import compile_rules
+from storage import MemoryStorage
+
+RULES = compile_rules({
+    "version": "pool-test",
+    "excluded_events": ["Speech"],
+    "consolidation": {"Dog": "Animal"},
+    "priority_categories": {"animal": ["Animal"]},
+})
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = AggregationPool(workers=1, min_frames=0)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.mark.parametrize("profile", [SPARSE_DAY, TYPICAL_DAY, DENSE_DAY], ids=["sparse", "typical", "dense"])
+@pytest.mark.parametrize("rules", [None, RULES], ids=["default", "custom"])
+def test_pool_results_equal_in_process_results(pool, profile, rules):
+    day = generate_day(profile)
+    aggregator = SEDAggregator(MemoryStorage(), pool=pool)
+
+    assert asyncio.run(aggregator.aggregate(day, rules)) == aggregator.aggregate_data(day, rules)
+
+
+def test_worker_measurements_reach_parent_hooks(pool, monkeypatch):
+    stages, counters = [], []
+    monkeypatch.setattr(SEDAggregator, "stage_hooks", [lambda stage, seconds: stages.append(stage)])
+    monkeypatch.setattr(SEDAggregator, "counter_hooks", [lambda name, amount, labels: counters.append(name)])
+
+    asyncio.run(SEDAggregator(MemoryStorage(), pool=pool).aggregate(generate_day(SPARSE_DAY)))
+
+    assert "pool" in stages and len(stages) > 1
+    assert counters
+
+
+def test_small_days_stay_in_process():
+    pool = AggregationPool(workers=1, min_frames=10_000)
+    assert not pool.should_offload(generate_day(SPARSE_DAY))
+    assert pool.should_offload(generate_day(DENSE_DAY))
+    assert create_pool("0") is None and create_pool("") is None
+    assert create_pool("1").workers == 1
@@ -0,0 +1,137 @@
+"""
+デバイスごとのベースラインによる異常検出のテスト（MemoryStorage使用、ネットワーク不要）
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+from anomaly import DAY, AnomalyDetector
+from sed_aggregator import SEDAggregator
+from storage import MemoryStorage
+
+
+def _blocks(cough: int, speech: int = 5):
+    events = [{"event": "Speech", "count": speech}]
+    if cough:
+        events.append({"event": "Cough", "count": cough})
+    return {"03-00": events, "03-30": None}
+
+
+def _rows(date: str, cough: int):
+    frames = [{"time": float(i), "events": [{"label": "Cough", "score": 0.9}]} for i in range(cough)]
+    frames += [{"time": 100.0 + i, "events": [{"label": "Speech", "score": 0.9}]} for i in range(5)]
+    return [{"device_id": "dev", "date": date, "time_block": "03-00", "behavior_extractor_result": frames}]
+
+
+def test_spike_is_flagged_after_min_days():
+    detector = AnomalyDetector(alpha=0.2, z_threshold=3.0, min_days=5, min_count=3)
+    baseline = {}
+    for day in range(10):
+        flags, baseline = detector.evaluate(baseline, _blocks(cough=1 + day % 2))
+        assert flags == []
+
+    flags, updated = detector.evaluate(baseline, _blocks(cough=20))
+    assert {(f["event"], f["slot"], f["direction"]) for f in flags} == {("Cough", "03-00", "high"), ("Cough", DAY, "high")}
+    assert flags[0]["expected"] < 2
+    # 空スロット（None）は観測しない、ベースラインは入力を変更しない
+    assert "03-30" not in updated["Cough"]
+    assert baseline["Cough"]["03-00"][2] == 10 and updated["Cough"]["03-00"][2] == 11
+
+
+def test_baseline_is_updated_once_per_date_and_flags_are_saved():
+    storage = MemoryStorage()
+    aggregator = SEDAggregator(storage, detector=AnomalyDetector(alpha=0.2, min_days=3, min_count=3))
+    for day in range(1, 6):
+        date = f"2025-01-0{day}"
+        storage.load_features(_rows(date, cough=1))
+        assert asyncio.run(aggregator.run("dev", date))["result"]["anomalies"] == []
+
+    storage.load_features(_rows("2025-01-06", cough=15))
+    result = asyncio.run(aggregator.run("dev", "2025-01-06"))
+    assert [f["slot"] for f in result["result"]["anomalies"] if f["event"] == "Cough"] == ["03-00", DAY]
+    assert storage.baselines["dev"]["as_of"] == "2025-01-06"
+    days = storage.baselines["dev"]["baseline"]["Cough"]["03-00"][2]
+
+    # 同じ日の再集計ではその日を反映する前のベースラインと比較する（二重に反映しない）
+    rerun = asyncio.run(aggregator.run("dev", "2025-01-06"))
+    assert rerun["result"]["anomalies"] == result["result"]["anomalies"]
+    assert rerun["written"] is False
+    assert storage.baselines["dev"]["baseline"]["Cough"]["03-00"][2] == days
+    saved = storage.results[("dev", "2025-01-06")]["behavior_aggregator_anomalies"]
+    assert saved == result["result"]["anomalies"]
+
+    # 過去の日の再集計は比較のみ
+    asyncio.run(aggregator.run("dev", "2025-01-02"))
+    assert storage.baselines["dev"]["as_of"] == "2025-01-06"
+
+
+
+class FailingStorage(MemoryStorage):
+    """mode に応じて条件付き書き込みを失敗させる（"error": 例外、"conflict": 常に競合）"""
+
+    mode = None
+
+    async def upsert_results_if(self, rows, expected):
+        if self.mode == "error":
+            raise RuntimeError("upsert failed")
+        if self.mode == "conflict":
+            return [(row["device_id"], row["date"]) for row in rows]
+        return await super().upsert_results_if(rows, expected)
+
+
+def test_baseline_advances_only_when_the_result_is_written():
+    storage = FailingStorage()
+    aggregator = SEDAggregator(storage, detector=AnomalyDetector(alpha=0.2, min_days=3, min_count=3))
+    storage.load_features(_rows("2025-01-01", cough=1))
+    assert asyncio.run(aggregator.run("dev", "2025-01-01"))["written"] is True
+    assert storage.baselines["dev"]["as_of"] == "2025-01-01"
+
+    # 保存に失敗・競合が続いた場合は更新しない
+    for mode, reason in (("error", "storage_error"), ("conflict", "conflict")):
+        storage.mode = mode
+        storage.load_features(_rows("2025-01-02", cough=2))
+        assert asyncio.run(aggregator.run("dev", "2025-01-02"))["reason"] == reason
+        assert storage.baselines["dev"]["as_of"] == "2025-01-01"
+
+    # ルール変更時の再集計は書き込んでも更新しない
+    storage.mode = None
+    result = asyncio.run(aggregator.run("dev", "2025-01-02", update_baseline=False))
+    assert result["written"] is True
+    assert storage.baselines["dev"]["as_of"] == "2025-01-01"
+
+    # 変更のない（書き込まない）集計でも更新しない
+    assert asyncio.run(aggregator.run("dev", "2025-01-02"))["written"] is False
+    assert storage.baselines["dev"]["as_of"] == "2025-01-01"
+
+
+def test_detection_is_disabled_by_default():
+    assert SEDAggregator(MemoryStorage()).detector is None
+
+
+_TIED_FLAGS = """
+import json
+from anomaly import AnomalyDetector
+labels = ["Cough", "Sneeze", "Snoring", "Laughter", "Crying", "Dog", "Music", "Door"]
+baseline = {label: {"03-00": [1.0, 0.0, 10], "day": [1.0, 0.0, 10]} for label in labels}
+blocks = {"03-00": [{"event": label, "count": 20} for label in labels]}
+flags, updated = AnomalyDetector(z_threshold=3.0, min_days=5, min_count=3, max_flags=5).evaluate(baseline, blocks)
+print(json.dumps([flags, list(updated)]))
+"""
+
+
+def test_flags_do_not_depend_on_hash_seed():
+    outputs = []
+    for seed in ("1", "2"):
+        env = {**os.environ, "PYTHONHASHSEED": seed}
+        completed = subprocess.run([sys.executable, "-c", _TIED_FLAGS], env=env, capture_output=True, text=True,
+                                   check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        outputs.append(completed.stdout)
+    assert outputs[0] == outputs[1]
+    flags, _ = json.loads(outputs[0])
+    # 同じzスコアはラベル・スロット順（上位5件に残るフラグも決まる）
+    assert [(f["event"], f["slot"]) for f in flags] == [
+        ("Cough", "03-00"), ("Cough", "day"), ("Crying", "03-00"), ("Crying", "day"), ("Dog", "03-00")
+    ]
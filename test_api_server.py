@@ -0,0 +1,171 @@
+"""
+APIサーバーのテスト（MemoryStorage使用、ネットワーク不要）
+
+TestClient を with なしで使い、起動時のウォームアップは実行しない（各テストで状態を設定する）。
+"""
+
+import asyncio
+
+import httpx
+import pytest
+from starlette.testclient import TestClient
+
+import api_server
+from coalescer import Debouncer
+from rate_limit import LocalRateLimitStore, RateLimiter
+from sed_aggregator import SEDAggregator
+from sed_rules import compile_rules, rules_registry
+from storage import MemoryStorage
+
+FRAMES = [{"time": 0.0, "events": [{"label": "Speech", "score": 0.9}]}]
+
+
+@pytest.fixture
+def warming_up(monkeypatch):
+    """ウォームアップが終わっていない状態"""
+    monkeypatch.setattr(api_server, "_aggregator", None)
+    monkeypatch.setattr(api_server, "readiness", {"ready": False, "error": None})
+    return TestClient(api_server.app)
+
+
+def test_requests_during_warm_up_get_503_without_creating_clients(warming_up, monkeypatch):
+    def fail():
+        raise AssertionError("リクエストの処理中に集計クライアントを作成しました")
+    monkeypatch.setattr(api_server, "get_aggregator", fail)
+
+    responses = [
+        warming_up.post("/analysis/sed", json={"device_id": "dev", "date": "2025-01-01"}),
+        warming_up.post("/analysis/sed/batch", json={"device_ids": ["dev"], "start_date": "2025-01-01"}),
+        warming_up.get("/aggregates/dev/2025-01-01"),
+        warming_up.get("/aggregates/dev/2025-01-01/similar"),
+        warming_up.get("/export", params={"from": "2025-01-01", "to": "2025-01-02"}),
+    ]
+    assert [response.status_code for response in responses] == [503] * len(responses)
+    assert all(response.headers["retry-after"] == "1" for response in responses)
+    assert warming_up.get("/ready").json() == {"status": "starting"}
+
+    # ウォームアップに失敗した場合も（500ではなく）503で理由を返す
+    api_server.readiness["error"] = "SUPABASE_URLおよびSUPABASE_KEYが設定されていません"
+    response = warming_up.get("/aggregates/dev/2025-01-01")
+    assert response.status_code == 503 and "SUPABASE_URL" in response.json()["detail"]
+
+
+def test_requests_are_served_after_warm_up(warming_up, monkeypatch):
+    monkeypatch.setattr(api_server, "_aggregator", SEDAggregator(MemoryStorage()))
+    api_server.readiness["ready"] = True
+
+    assert warming_up.get("/ready").json() == {"status": "ready", "storage": "memory"}
+    assert warming_up.get("/aggregates/dev/2025-01-01").status_code == 404
+
+
+@pytest.fixture
+def debounced(monkeypatch):
+    """ウォームアップ済みで、リクエストを0.3秒まとめる状態（集計結果は storage に保存される）"""
+    storage = MemoryStorage()
+    monkeypatch.setattr(api_server, "_aggregator", SEDAggregator(storage))
+    monkeypatch.setattr(api_server, "readiness", {"ready": True, "error": None})
+    monkeypatch.setattr(api_server, "debouncer", Debouncer(0.3, 5))
+    monkeypatch.setattr(api_server, "pending_tasks", {})
+    monkeypatch.setattr(api_server, "rate_checks", {})
+    return storage
+
+
+def _post_concurrently(bodies):
+    """POST /analysis/sed を同時に送る（最初のタスクの応答はバックグラウンドの実行後に返る）"""
+    async def post():
+        transport = httpx.ASGITransport(app=api_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(client.post("/analysis/sed", json=body) for body in bodies))
+    return asyncio.run(post())
+
+
+def test_requests_within_the_window_are_coalesced(debounced):
+    debounced.load_features([{"device_id": "dev-coalesce", "date": "2025-01-01", "time_block": "09-00",
+                              "behavior_extractor_result": FRAMES}])
+    body = {"device_id": "dev-coalesce", "date": "2025-01-01"}
+
+    responses = _post_concurrently([body] * 3)
+    task_ids = {response.json()["task_id"] for response in responses}
+    assert len(task_ids) == 1
+
+    status = api_server.task_status[task_ids.pop()]
+    assert status["status"] == "completed" and status["coalesced"] == 3
+    assert ("dev-coalesce", "2025-01-01") in debounced.results
+    assert api_server.pending_tasks == {} and len(api_server.debouncer) == 0
+
+
+def test_failed_task_does_not_absorb_later_requests(debounced, monkeypatch):
+    body = {"device_id": "dev-failed", "date": "2025-01-01"}
+    first, = _post_concurrently([body])
+    assert api_server.task_status[first.json()["task_id"]]["reason"] == "no_data"
+    second, = _post_concurrently([body])
+    assert second.json()["task_id"] != first.json()["task_id"]
+
+    # 待機中に失敗した場合も実行待ちから外す
+    def fail(key):
+        raise RuntimeError("deadline failed")
+    monkeypatch.setattr(api_server.debouncer, "deadline", fail)
+    with pytest.raises(RuntimeError):
+        _post_concurrently([body])
+    assert api_server.pending_tasks == {} and len(api_server.debouncer) == 0
+
+
+def test_only_newly_scheduled_runs_are_rate_limited(debounced, monkeypatch):
+    # デバイスごとに1回だけ受け付ける（補充はほぼしない）
+    monkeypatch.setattr(api_server, "rate_limiter", RateLimiter(
+        LocalRateLimitStore(clock=lambda: 0.0), device_rate=0.001, device_burst=1, global_rate=0, global_burst=0
+    ))
+    debounced.load_features([{"device_id": "dev-limited", "date": "2025-01-01", "time_block": "09-00",
+                              "behavior_extractor_result": FRAMES}])
+
+    # 不正なリクエストはトークンを消費しない
+    for _ in range(3):
+        response, = _post_concurrently([{"device_id": "dev-limited", "date": "2025/01/01"}])
+        assert response.status_code == 400
+
+    # まとめたリクエストもトークンを消費しない
+    responses = _post_concurrently([{"device_id": "dev-limited", "date": "2025-01-01"}] * 3)
+    assert [response.status_code for response in responses] == [200] * 3
+    assert len({response.json()["task_id"] for response in responses}) == 1
+
+    response, = _post_concurrently([{"device_id": "dev-limited", "date": "2025-01-02"}])
+    assert response.status_code == 429 and response.headers["retry-after"]
+
+
+def test_requests_are_coalesced_while_the_rate_limit_is_checked(debounced, monkeypatch):
+    # Redisなど、確認中にイベントループへ制御を返すレート制限
+    class SlowStore(LocalRateLimitStore):
+        calls = 0
+
+        async def acquire(self, limits):
+            SlowStore.calls += 1
+            await asyncio.sleep(0.05)
+            return await super().acquire(limits)
+
+    monkeypatch.setattr(api_server, "rate_limiter", RateLimiter(
+        SlowStore(), device_rate=100, device_burst=100, global_rate=0, global_burst=0
+    ))
+    debounced.load_features([{"device_id": "dev-slow", "date": "2025-01-01", "time_block": "09-00",
+                              "behavior_extractor_result": FRAMES}])
+
+    responses = _post_concurrently([{"device_id": "dev-slow", "date": "2025-01-01"}] * 3)
+    assert [response.status_code for response in responses] == [200] * 3
+    assert len({response.json()["task_id"] for response in responses}) == 1
+    assert SlowStore.calls == 1 and api_server.rate_checks == {}
+
+
+def test_cached_aggregate_follows_the_current_rules(debounced, monkeypatch):
+    debounced.load_features([{"device_id": "dev-rules", "date": "2025-01-01", "time_block": "09-00",
+                              "behavior_extractor_result": FRAMES}])
+    asyncio.run(api_server._aggregator.run("dev-rules", "2025-01-01"))
+    client = TestClient(api_server.app)
+
+    ranking = client.get("/aggregates/dev-rules/2025-01-01").json()["summary_ranking"]
+    assert ranking[0]["category"] == "other"
+
+    # 保存済みの行が同じでも、ルールを再読み込みしたら現在のルールで summary_ranking を作り直す
+    monkeypatch.setattr(rules_registry, "_rules", compile_rules({
+        "version": "voice", "priority_categories": {"voice": ["Speech"]}
+    }))
+    ranking = client.get("/aggregates/dev-rules/2025-01-01").json()["summary_ranking"]
+    assert ranking[0]["category"] == "voice"
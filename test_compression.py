@@ -0,0 +1,123 @@
+"""
+レスポンス圧縮ミドルウェアと ?fields= による絞り込みのテスト
+"""
+
+import asyncio
+import gzip
+import zlib
+
+import pytest
+from starlette.testclient import TestClient
+
+import api_server
+from benchmarks.synthetic import time_slots
+from compression import CompressionMiddleware
+from sed_aggregator import SEDAggregator
+from storage import MemoryStorage
+
+BODY = b'{"event":"Speech","count":1}' * 100
+
+
+def _app(chunks, content_type="application/json", headers=()):
+    """chunks を順に送るASGIアプリ（2つ以上ならストリーミング）"""
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", content_type.encode()), *headers]})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+    return app
+
+
+def _call(app, accept_encoding="gzip", **options):
+    """ミドルウェアを通したときに送られるメッセージ"""
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    asyncio.run(CompressionMiddleware(app, **options)(scope, receive, send))
+    start, *bodies = messages
+    return dict(start["headers"]), bodies
+
+
+def test_buffered_response_is_gzipped():
+    headers, bodies = _call(_app([BODY]))
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert len(bodies) == 1 and int(headers[b"content-length"]) == len(bodies[0]["body"])
+    assert gzip.decompress(bodies[0]["body"]) == BODY
+
+
+@pytest.mark.parametrize("app, accept_encoding", [
+    (_app([b"{}"]), "gzip"),  # minimum_size 未満
+    (_app([BODY]), "identity, gzip;q=0"),
+    (_app([BODY], content_type="application/vnd.apache.parquet"), "gzip"),
+    (_app([BODY], headers=[(b"content-encoding", b"br")]), "gzip"),
+], ids=["small", "not-accepted", "parquet", "already-encoded"])
+def test_response_is_left_as_is(app, accept_encoding):
+    headers, bodies = _call(app, accept_encoding)
+    assert b"gzip" not in headers.get(b"content-encoding", b"")
+    assert b"".join(message["body"] for message in bodies) in (BODY, b"{}")
+
+
+def test_streaming_response_is_compressed_chunk_by_chunk():
+    chunks = [BODY] * 5
+    headers, bodies = _call(_app(chunks), minimum_size=10 ** 9)
+
+    # 本文をまとめず、Content-Length なしで逐次送る（minimum_size はストリーミングには適用しない）
+    assert headers[b"content-encoding"] == b"gzip" and b"content-length" not in headers
+    assert len(bodies) > 1
+    assert [message["more_body"] for message in bodies][-1] is False
+    assert all(message["more_body"] for message in bodies[:-1])
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert b"".join(decompressor.decompress(message["body"]) for message in bodies) == b"".join(chunks)
+
+
+def test_streaming_parquet_is_passed_through():
+    chunks = [b"PAR1", BODY, b"PAR1"]
+    headers, bodies = _call(_app(chunks, content_type="application/vnd.apache.parquet"))
+    assert b"content-encoding" not in headers
+    assert [message["body"] for message in bodies] == chunks
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """ウォームアップ済みで、集計済みの行が1件ある状態"""
+    storage = MemoryStorage()
+    storage.load_features([
+        {"device_id": "dev", "date": "2025-01-01", "time_block": slot,
+         "behavior_extractor_result": [{"time": 0.0, "events": [{"label": "Speech", "score": 0.9}]}]}
+        for slot in time_slots()
+    ])
+    aggregator = SEDAggregator(storage)
+    asyncio.run(aggregator.run("dev", "2025-01-01"))
+    monkeypatch.setattr(api_server, "_aggregator", aggregator)
+    monkeypatch.setattr(api_server, "readiness", {"ready": True, "error": None})
+    monkeypatch.setattr(api_server, "task_status", {
+        "t1": {"task_id": "t1", "status": "completed", "progress": 100, "result": {"large": "x" * 4096}},
+    })
+    return TestClient(api_server.app)
+
+
+def test_fields_selects_paths(client):
+    full = client.get("/aggregates/dev/2025-01-01")
+    assert full.headers["content-encoding"] == "gzip"
+
+    response = client.get("/aggregates/dev/2025-01-01", params={"fields": "device_id,time_blocks.09-30,missing.x"})
+    assert response.json() == {"device_id": "dev", "time_blocks": {"09-30": full.json()["time_blocks"]["09-30"]}}
+    assert "content-encoding" not in response.headers  # 絞り込んだ結果が minimum_size 未満
+
+    assert client.get("/analysis/sed/t1", params={"fields": "status,progress"}).json() == \
+        {"status": "completed", "progress": 100}
+    assert client.get("/analysis/sed", params={"fields": "task_id"}).json() == \
+        {"tasks": [{"task_id": "t1"}], "total": 1}
+
+
+def test_parse_fields_merges_paths():
+    assert api_server.parse_fields(None) is None
+    assert api_server.parse_fields("a.b,a.c, d ,a.b.x") == {"a": {"b": None, "c": None}, "d": None}
+    assert api_server.parse_fields("a,a.b") == {"a": None}
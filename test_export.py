@@ -0,0 +1,74 @@
+"""
+集計結果のエクスポートのテスト（MemoryStorage / SQLiteStorage使用、ネットワーク不要）
+"""
+
+import asyncio
+import json
+
+from starlette.applications import Starlette
+from starlette.responses import StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from compression import CompressionMiddleware
+from export import flatten_result, ndjson_stream
+from sed_aggregator import SEDAggregator
+from storage import MemoryStorage, SQLiteStorage
+
+
+def _frames(*labels):
+    return [{"time": float(i), "events": [{"label": label, "score": 0.9}]} for i, label in enumerate(labels)]
+
+
+def _load(storage, device_id, date):
+    storage.load_features([
+        {"device_id": device_id, "date": date, "time_block": "08-00",
+         "behavior_extractor_result": _frames("Speech", "Speech", "Cough")},
+        {"device_id": device_id, "date": date, "time_block": "09-30", "behavior_extractor_result": _frames()},
+    ])
+    asyncio.run(SEDAggregator(storage).run(device_id, date))
+
+
+def _export(storage, *args, **kwargs):
+    async def collect():
+        return b"".join([chunk async for chunk in ndjson_stream(storage.iter_result_pages(*args, **kwargs))])
+    return [json.loads(line) for line in asyncio.run(collect()).splitlines()]
+
+
+def test_flatten_skips_empty_slots():
+    rows = list(flatten_result("dev", "2025-01-01", {"08-30": [{"event": "Cough", "count": 1}],
+                                                     "08-00": [{"event": "Speech", "count": 2}],
+                                                     "09-00": [], "09-30": None}))
+    assert rows == [("dev", "2025-01-01", "08-00", "Speech", 2), ("dev", "2025-01-01", "08-30", "Cough", 1)]
+    assert list(flatten_result("dev", "2025-01-01", None)) == []
+
+
+def test_export_filters_range_and_devices_across_pages():
+    for storage in (MemoryStorage(), SQLiteStorage(":memory:")):
+        for device_id in ("dev-a", "dev-b", "dev-c"):
+            for date in ("2025-01-01", "2025-01-02", "2025-01-03"):
+                _load(storage, device_id, date)
+
+        rows = _export(storage, "2025-01-02", "2025-01-03", ["dev-a", "dev-c"], page_size=1)
+        assert {(r["device_id"], r["date"]) for r in rows} == {
+            (d, date) for d in ("dev-a", "dev-c") for date in ("2025-01-02", "2025-01-03")
+        }
+        assert rows[:2] == [
+            {"device_id": "dev-a", "date": "2025-01-02", "slot": "08-00", "label": "Speech", "count": 2},
+            {"device_id": "dev-a", "date": "2025-01-02", "slot": "08-00", "label": "Cough", "count": 1},
+        ]
+        assert len(_export(storage, "2025-01-01", "2025-01-31")) == 9 * 2
+
+
+def test_streaming_responses_are_compressed_incrementally():
+    async def lines(request):
+        async def body():
+            for i in range(100):
+                yield json.dumps({"i": i}).encode() + b"\n"
+        return StreamingResponse(body(), media_type="application/x-ndjson")
+
+    app = CompressionMiddleware(Starlette(routes=[Route("/", lines)]), minimum_size=0)
+    response = TestClient(app).get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert len(response.text.splitlines()) == 100
@@ -0,0 +1,74 @@
+"""
+ラベル翻訳と翻訳済みレスポンスのキャッシュのテスト（locales/ja.json を使用）
+"""
+
+import copy
+
+import pytest
+
+import localization
+from localization import TranslationCache, translate_result
+
+
+def _result():
+    return {
+        "device_id": "dev",
+        "time_blocks": {
+            "09-00": [{"event": "Speech", "count": 3}, {"event": "Cough / 咳", "count": 1}],
+            "09-30": [{"event": "Unknown label", "count": 2}],
+            "10-00": None,
+        },
+        "summary_ranking": [{"event": "Speech", "count": 3, "category": "voice"}],
+        "anomalies": [{"event": "Cough", "slot": "09-00", "count": 1, "z": 4.0}],
+    }
+
+
+def test_source_language_is_returned_as_is():
+    result = _result()
+    assert translate_result(result, localization.SOURCE_LANGUAGE) is result
+
+
+def test_labels_are_translated_without_changing_the_source():
+    result = _result()
+    original = copy.deepcopy(result)
+    translated = translate_result(result, "ja")
+
+    assert result == original
+    assert translated["lang"] == "ja"
+    assert translated["device_id"] == "dev"
+    # "English / 日本語" 形式は英語部分で引き、辞書にないラベルは英語のまま返す
+    assert translated["time_blocks"] == {
+        "09-00": [{"event": "話し声", "count": 3}, {"event": "咳", "count": 1}],
+        "09-30": [{"event": "Unknown label", "count": 2}],
+        "10-00": None,
+    }
+    assert translated["summary_ranking"] == [{"event": "話し声", "count": 3, "category": "voice"}]
+    assert translated["anomalies"] == [{"event": "咳", "slot": "09-00", "count": 1, "z": 4.0}]
+
+
+@pytest.mark.parametrize("lang", ["xx", "../locales/ja", "ja/../ja"])
+def test_unsupported_languages_are_rejected(lang):
+    with pytest.raises(ValueError):
+        localization.get_dictionary(lang)
+
+
+def test_cache_translates_once_per_key_and_language():
+    cache = TranslationCache(max_size=2)
+    builds = []
+
+    def build():
+        builds.append(1)
+        return _result()
+
+    first = cache.get_or_translate(("dev", "t1"), "ja", build)
+    assert cache.get_or_translate(("dev", "t1"), "ja", build) is first
+    assert len(builds) == 1
+
+    # 言語・キー（更新時刻など）が異なれば作り直す
+    cache.get_or_translate(("dev", "t1"), "en", build)
+    cache.get_or_translate(("dev", "t2"), "ja", build)
+    assert len(builds) == 3
+
+    # 最も古く使われたエントリから破棄する
+    cache.get_or_translate(("dev", "t1"), "ja", build)
+    assert len(builds) == 4
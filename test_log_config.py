@@ -0,0 +1,74 @@
+"""
+構造化ログ（JSON出力・タスク単位の相関ID）のテスト
+"""
+
+import asyncio
+import json
+import logging
+import sys
+
+from log_config import (JSONFormatter, TextFormatter, bind_task, correlation_id, fields, parse_levels,
+                        record_stage, stage_durations)
+
+
+def _record(msg="集計完了", extra=None, exc_info=None):
+    logger = logging.getLogger("sed_aggregator")
+    return logger.makeRecord(logger.name, logging.INFO, __file__, 1, msg, (), exc_info, extra=extra)
+
+
+def test_json_formatter_writes_one_object_per_record():
+    token = correlation_id.set(None)
+    try:
+        line = JSONFormatter().format(_record(extra={**fields(device_id="dev", events=42), "legacy": "x"}))
+    finally:
+        correlation_id.reset(token)
+
+    assert "\n" not in line
+    entry = json.loads(line)
+    assert entry["ts"].endswith("Z") and len(entry["ts"]) == len("2025-01-01T00:00:00.000Z")
+    assert {key: entry[key] for key in ("level", "logger", "msg", "device_id", "events", "legacy")} == {
+        "level": "INFO", "logger": "sed_aggregator", "msg": "集計完了", "device_id": "dev", "events": 42,
+        "legacy": "x",
+    }
+    assert "correlation_id" not in entry and "fields" not in entry
+
+
+def test_json_formatter_includes_exceptions():
+    try:
+        raise ValueError("broken")
+    except ValueError:
+        entry = json.loads(JSONFormatter().format(_record("失敗", exc_info=sys.exc_info())))
+    assert "ValueError: broken" in entry["exc_info"]
+
+
+def test_bound_task_ids_do_not_leak_between_tasks():
+    formatter = JSONFormatter()
+
+    async def task(task_id, stage_seconds):
+        bind_task(task_id)
+        record_stage("fetch", stage_seconds)
+        await asyncio.sleep(0)
+        record_stage("fetch", stage_seconds)
+        return json.loads(formatter.format(_record()))["correlation_id"], stage_durations.get()
+
+    async def run_tasks():
+        return await asyncio.gather(task("task-a", 0.001), task("task-b", 0.002))
+
+    assert asyncio.run(run_tasks()) == [("task-a", {"fetch": 2.0}), ("task-b", {"fetch": 4.0})]
+    # タスクの外（呼び出し元のコンテキスト）には残らない
+    assert correlation_id.get() is None and stage_durations.get() is None
+
+
+def test_text_formatter_appends_fields():
+    token = correlation_id.set("task-a")
+    try:
+        text = TextFormatter().format(_record(extra=fields(device_id="dev")))
+    finally:
+        correlation_id.reset(token)
+    assert text.endswith(" - INFO - sed_aggregator - 集計完了 correlation_id=task-a device_id=dev")
+
+
+def test_parse_levels_ignores_invalid_entries():
+    assert parse_levels("sed_aggregator=debug, httpx=WARNING,broken,storage=LOUD") == {
+        "sed_aggregator": logging.DEBUG, "httpx": logging.WARNING,
+    }
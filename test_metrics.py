@@ -0,0 +1,58 @@
+"""
+Prometheus形式のメトリクス出力のテスト
+"""
+
+from metrics import RESULT_WRITES, Counter, Gauge, Histogram, Registry, count
+
+
+def test_counter_and_gauge_exposition():
+    registry = Registry()
+    counter = registry.register(Counter("sed_test_total", "テスト", ["outcome"]))
+    gauge = registry.register(Gauge("sed_test_in_flight", "実行中"))
+    counter.inc(outcome="written")
+    counter.inc(2, outcome='say "hi"\n')
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+
+    assert registry.render() == (
+        "# HELP sed_test_total テスト\n"
+        "# TYPE sed_test_total counter\n"
+        'sed_test_total{outcome="written"} 1\n'
+        'sed_test_total{outcome="say \\"hi\\"\\n"} 2\n'
+        "# HELP sed_test_in_flight 実行中\n"
+        "# TYPE sed_test_in_flight gauge\n"
+        "sed_test_in_flight 1\n"
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("sed_test_seconds", "所要時間", ["stage"], buckets=(0.5, 0.1, 1.0))
+    for value in (0.05, 0.1, 0.3, 2.0):
+        histogram.observe(value, stage="fetch")
+
+    assert histogram.buckets == (0.1, 0.5, 1.0, float("inf"))
+    assert histogram.count(stage="fetch") == 4
+    assert list(histogram.samples()) == [
+        'sed_test_seconds_bucket{stage="fetch",le="0.1"} 2',
+        'sed_test_seconds_bucket{stage="fetch",le="0.5"} 3',
+        'sed_test_seconds_bucket{stage="fetch",le="1.0"} 3',
+        'sed_test_seconds_bucket{stage="fetch",le="+Inf"} 4',
+        'sed_test_seconds_sum{stage="fetch"} 2.45',
+        'sed_test_seconds_count{stage="fetch"} 4',
+    ]
+
+
+def test_gauge_collects_values_on_render():
+    values = {("running",): 2}
+    gauge = Gauge("sed_test_tasks", "状態別", ["status"], collect=lambda: values)
+    assert list(gauge.samples()) == ['sed_test_tasks{status="running"} 2']
+    values[("running",)] = 0
+    assert list(gauge.samples()) == ['sed_test_tasks{status="running"} 0']
+
+
+def test_aggregator_counter_names_are_routed():
+    before = RESULT_WRITES.value(outcome="reaggregated")
+    count("result_writes", 2, {"outcome": "reaggregated"})
+    count("unknown_counter", 1, {})
+    assert RESULT_WRITES.value(outcome="reaggregated") == before + 2
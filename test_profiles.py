@@ -0,0 +1,63 @@
+"""
+活動プロファイルと類似日検索のテスト（MemoryStorage使用、ネットワーク不要）
+"""
+
+import asyncio
+import math
+
+import profiles
+from profiles import PROFILE_LENGTH, ProfileIndex, build_profile, pack, unpack
+from sed_aggregator import SEDAggregator
+from storage import MemoryStorage
+
+
+def _frames(*labels):
+    return [{"time": float(i), "events": [{"label": label, "score": 0.9}]} for i, label in enumerate(labels)]
+
+
+def _day(device_id, date, morning, evening):
+    return [
+        {"device_id": device_id, "date": date, "time_block": "08-00", "behavior_extractor_result": _frames(*morning)},
+        {"device_id": device_id, "date": date, "time_block": "20-00", "behavior_extractor_result": _frames(*evening)},
+    ]
+
+
+def test_profile_is_fixed_length_normalized_and_packed():
+    vector = build_profile({"08-00": [{"event": "Speech / 会話・発話", "count": 3}, {"event": "Cough", "count": 1}],
+                            "08-30": None})
+    assert len(vector) == PROFILE_LENGTH
+    assert math.isclose(math.fsum(v * v for v in vector), 1.0, rel_tol=1e-9)
+    assert build_profile({}) == [0.0] * PROFILE_LENGTH
+
+    restored = unpack(pack(vector))
+    assert len(restored) == PROFILE_LENGTH
+    assert all(math.isclose(a, b, abs_tol=1e-6) for a, b in zip(restored, vector))
+
+
+def test_similar_days_are_ranked_and_cache_is_invalidated_on_write():
+    storage = MemoryStorage()
+    aggregator = SEDAggregator(storage)
+    SEDAggregator.write_hooks.append(profiles.profile_index.on_written)
+    try:
+        days = {
+            "2025-01-01": (["Speech"] * 5, ["Dishes"] * 3),
+            "2025-01-02": (["Speech"] * 4, ["Dishes"] * 3),
+            "2025-01-03": (["Snoring"] * 6, []),
+        }
+        for date, (morning, evening) in days.items():
+            storage.load_features(_day("dev", date, morning, evening))
+            asyncio.run(aggregator.run("dev", date))
+
+        index = ProfileIndex()
+        matrix = asyncio.run(index.get("dev", storage.fetch_profiles))
+        ranked = matrix.most_similar("2025-01-01", limit=5)
+        assert [date for date, _ in ranked] == ["2025-01-02", "2025-01-03"]
+        assert ranked[0][1] > 0.9 > ranked[1][1]
+
+        # キャッシュ済みの行列を使い、書き込み後は読み直す
+        assert asyncio.run(profiles.profile_index.get("dev", storage.fetch_profiles)).dates == matrix.dates
+        storage.load_features(_day("dev", "2025-01-04", ["Speech"] * 5, ["Dishes"] * 2))
+        asyncio.run(aggregator.run("dev", "2025-01-04"))
+        assert "2025-01-04" in asyncio.run(profiles.profile_index.get("dev", storage.fetch_profiles))
+    finally:
+        SEDAggregator.write_hooks.remove(profiles.profile_index.on_written)
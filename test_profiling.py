@@ -0,0 +1,47 @@
+"""
+分析タスクのプロファイル取得のテスト（cProfile、ネットワーク不要）
+"""
+
+import asyncio
+import marshal
+
+from profiling import REQUESTED, TaskProfiler
+from sed_aggregator import SEDAggregator
+from storage import MemoryStorage
+
+
+def _run(profiler, task_id, requested):
+    storage = MemoryStorage()
+    storage.load_features([{"device_id": "dev", "date": "2025-01-01", "time_block": "08-00",
+                            "behavior_extractor_result": [{"time": 0.0, "events": [{"label": "Speech", "score": 0.9}]}]}])
+    with profiler.capture(task_id, requested) as captured:
+        asyncio.run(SEDAggregator(storage).run("dev", "2025-01-01"))
+    return captured.profile
+
+
+def test_requested_profile_is_kept_and_readable():
+    profiler = TaskProfiler(profiler="cprofile", keep=1)
+    profile = _run(profiler, "task-1", requested=True)
+
+    assert profile.reason == REQUESTED and profiler.get("task-1") is profile
+    assert "sed_aggregator.py" in profile.text and "run" in profile.text
+    # pstats形式（.prof）は marshal された統計
+    stats = marshal.loads(profile.data)
+    assert any(function == "run" and filename.endswith("sed_aggregator.py") for filename, _, function in stats)
+
+    # 保持数を超えたら古い順に破棄
+    _run(profiler, "task-2", requested=True)
+    assert profiler.get("task-1") is None and profiler.get("task-2") is not None
+
+
+def test_sampling_keeps_only_slow_tasks_and_token_is_checked():
+    profiler = TaskProfiler(profiler="cprofile", token="secret", sample_rate=1.0, slow_seconds=60)
+    assert _run(profiler, "fast", requested=False) is None
+    assert profiler.get("fast") is None
+
+    profiler.slow_seconds = 0
+    assert _run(profiler, "slow", requested=False).reason == "sampled"
+    assert _run(TaskProfiler(sample_rate=0), "off", requested=False) is None
+
+    assert profiler.authorized("secret")
+    assert not profiler.authorized(None) and not profiler.authorized("wrong")
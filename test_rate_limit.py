@@ -0,0 +1,50 @@
+"""
+分析リクエストのレート制限のテスト（プロセス内のトークンバケット、ネットワーク不要）
+"""
+
+import asyncio
+
+from rate_limit import DEVICE, GLOBAL, LocalRateLimitStore, RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _limiter(clock, **overrides):
+    settings = dict(device_rate=1.0, device_burst=2, global_rate=10.0, global_burst=3)
+    settings.update(overrides)
+    return RateLimiter(LocalRateLimitStore(clock=clock), **settings)
+
+
+def test_device_bucket_refills_and_rejections_do_not_consume_global_tokens():
+    clock = FakeClock()
+    limiter = _limiter(clock)
+    check = lambda device_id: asyncio.run(limiter.check(device_id))
+
+    assert check("dev-a").allowed and check("dev-a").allowed
+    rejected = check("dev-a")
+    assert (rejected.allowed, rejected.scope) == (False, DEVICE)
+    assert rejected.retry_after == 1.0
+
+    # dev-a の拒否は全体のトークンを消費しない（残り1つ）
+    assert check("dev-b").allowed
+    assert check("dev-c").scope == GLOBAL
+
+    clock.now = 1.0
+    assert check("dev-a").allowed
+
+
+def test_disabled_limits_and_bounded_buckets():
+    clock = FakeClock()
+    assert not _limiter(clock, device_rate=0, global_rate=0).enabled
+
+    limiter = _limiter(clock, global_rate=0)
+    limiter.store.max_keys = 2
+    for device_id in ("a", "b", "c"):
+        assert asyncio.run(limiter.check(device_id)).allowed
+    assert len(limiter.store) == 2
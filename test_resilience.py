@@ -0,0 +1,206 @@
+"""
+Supabase呼び出しの耐障害性テスト
+
+障害を注入するローカルのPostgREST互換スタブに対して、SupabaseStorageのタイムアウト・リトライ・
+サーキットブレーカーと、SEDAggregator.run の失敗理由を確認する（ネットワーク不要）。
+"""
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from resilience import CircuitBreaker, ResiliencePolicy, StorageError
+from sed_aggregator import SEDAggregator
+from storage import SupabaseStorage
+
+# 形式だけ正しいダミーのキー（create_client の検証用）
+DUMMY_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.abc"
+
+ROWS = [{"device_id": "dev", "date": "2025-01-01", "time_block": "09-00",
+         "behavior_extractor_result": [{"time": 0.0, "events": [{"label": "Speech", "score": 0.9}]}]}]
+
+
+class FaultyPostgREST:
+    """応答（ステータス, 本文, 遅延秒）を順番に返すスタブ。キューが空なら200で ROWS を返す"""
+
+    def __init__(self):
+        self.faults = []
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self):
+                stub.requests += 1
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                status, body, delay = stub.faults.pop(0) if stub.faults else (200, ROWS, 0)
+                time.sleep(delay)
+                payload = body if isinstance(body, bytes) else json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except OSError:
+                    pass  # タイムアウトでクライアントが切断済み
+
+            do_GET = do_POST = do_PATCH = _respond
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def stub():
+    server = FaultyPostgREST()
+    yield server
+    server.server.shutdown()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _storage(stub, attempts=3, timeout=0.5, threshold=5, clock=time.monotonic):
+    policy = ResiliencePolicy(timeout=timeout, attempts=attempts, base_delay=0,
+                              breaker=CircuitBreaker(threshold, 30, clock))
+    return SupabaseStorage(stub.url, DUMMY_KEY, policy)
+
+
+def test_transient_errors_are_retried(stub):
+    storage = _storage(stub)
+    stub.faults = [(503, b'<html>Service Unavailable</html>', 0), (500, {"code": "PGRST001", "message": "db"}, 0)]
+
+    slots = asyncio.run(storage.fetch_slots("dev", "2025-01-01"))
+
+    assert "09-00" in slots
+    assert stub.requests == 3
+
+
+def test_timeout_is_reported_not_empty(stub):
+    storage = _storage(stub, attempts=2, timeout=0.2)
+    stub.faults = [(200, ROWS, 0.5), (200, ROWS, 0.5)]
+
+    with pytest.raises(StorageError) as error:
+        asyncio.run(storage.fetch_slots("dev", "2025-01-01"))
+    assert error.value.reason == "timeout"
+
+
+def test_client_errors_are_not_retried(stub):
+    storage = _storage(stub)
+    stub.faults = [(400, {"code": "PGRST100", "message": "bad filter"}, 0)]
+
+    with pytest.raises(StorageError) as error:
+        asyncio.run(storage.update_result("dev", "2025-01-01", {"behavior_aggregator_rules_version": "1"}))
+    assert error.value.reason == "rejected"
+    assert stub.requests == 1
+
+
+def test_conditional_upsert_is_not_retried_after_timeout(stub):
+    # タイムアウトしても書き込まれている場合があるため、同じ条件付き書き込みを再送しない
+    storage = _storage(stub, timeout=0.2)
+    stub.faults = [(200, [0], 0.5)]
+
+    with pytest.raises(StorageError) as error:
+        asyncio.run(storage.upsert_results_if([{"device_id": "dev", "date": "2025-01-01"}], [None]))
+    assert error.value.reason == "timeout"
+    assert stub.requests == 1
+
+
+def test_circuit_opens_and_recovers(stub):
+    clock = FakeClock()
+    storage = _storage(stub, attempts=1, threshold=2, clock=clock)
+    stub.faults = [(503, b'', 0), (503, b'', 0)]
+
+    for _ in range(2):
+        with pytest.raises(StorageError):
+            asyncio.run(storage.fetch_slots("dev", "2025-01-01"))
+
+    # 開いている間はSupabaseを呼ばずに即座に失敗する
+    with pytest.raises(StorageError) as error:
+        asyncio.run(storage.fetch_slots("dev", "2025-01-01"))
+    assert error.value.reason == "circuit_open"
+    assert stub.requests == 2
+
+    # リセット時間経過後の試行が成功すれば閉じる
+    clock.now = 31
+    assert asyncio.run(storage.fetch_slots("dev", "2025-01-01"))
+    assert storage.policy.breaker.state == "closed"
+
+
+def test_run_distinguishes_failure_from_no_data(stub):
+    aggregator = SEDAggregator(_storage(stub, attempts=1))
+    stub.faults = [(503, b'', 0)]
+    result = asyncio.run(aggregator.run("dev", "2025-01-01"))
+    assert result == {**result, "success": False, "reason": "unavailable", "operation": "fetch"}
+
+    stub.faults = [(200, [], 0)]
+    assert asyncio.run(aggregator.run("dev", "2025-01-01"))["reason"] == "no_data"
+
+
+def test_timed_out_calls_hold_their_slot_until_they_finish():
+    # タイムアウトしてもスレッドは動き続けるため、終了するまで次の呼び出しを始めない
+    policy = ResiliencePolicy(timeout=0.1, attempts=1, max_in_flight=1)
+    release = threading.Event()
+    started = []
+
+    def blocked():
+        started.append(1)
+        release.wait(5)
+        raise ConnectionError("遅れて失敗")
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(StorageError) as error:
+                await policy.call("fetch", blocked)
+            assert error.value.reason == "timeout"
+        assert started == [1] and policy.in_flight == 1
+
+        release.set()
+        while policy.in_flight:
+            await asyncio.sleep(0.01)
+        return await policy.call("fetch", lambda: "ok")
+
+    assert asyncio.run(scenario()) == "ok"
+
+
+def test_cancelled_half_open_probe_releases_the_circuit():
+    clock = FakeClock()
+    policy = ResiliencePolicy(timeout=1, attempts=1, breaker=CircuitBreaker(1, 30, clock))
+    release = threading.Event()
+
+    def fail():
+        raise ConnectionError("down")
+
+    async def scenario():
+        with pytest.raises(StorageError):
+            await policy.call("fetch", fail)
+        assert policy.breaker.state == "open"
+
+        # リセット時間経過後の試行（half_open）を取り消しても、次の呼び出しで再び試行できる
+        clock.now = 31
+        probe = asyncio.create_task(policy.call("fetch", lambda: release.wait(5)))
+        await asyncio.sleep(0.05)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        release.set()
+
+        assert await policy.call("fetch", lambda: "ok") == "ok"
+        assert policy.breaker.state == "closed"
+
+    asyncio.run(scenario())
@@ -0,0 +1,107 @@
+"""
+変更フィードコンシューマーのテスト（MemoryStorage / SQLiteStorage使用、ネットワーク不要）
+"""
+
+import asyncio
+
+import pytest
+
+from sed_aggregator import SEDAggregator
+from sed_consumer import ChangeFeedConsumer
+from storage import MemoryStorage, SQLiteStorage
+
+FRAMES = [{"time": 0.0, "events": [{"label": "Speech", "score": 0.9}]}]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _feature(device_id, date, slot, processed_at):
+    return {
+        "device_id": device_id, "date": date, "time_block": slot,
+        "behavior_extractor_result": FRAMES, "behavior_extractor_processed_at": processed_at,
+    }
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def storage(request):
+    return MemoryStorage() if request.param == "memory" else SQLiteStorage(":memory:")
+
+
+def _consumer(tmp_path, storage, clock, **kwargs):
+    return ChangeFeedConsumer(
+        SEDAggregator(storage), debounce=10, max_wait=60,
+        watermark_path=str(tmp_path / "watermark"), clock=clock, **kwargs
+    )
+
+
+def _stored(storage, device_id, date):
+    return asyncio.run(storage.fetch_result(device_id, date))
+
+
+def test_updates_are_coalesced_until_window_closes(tmp_path, storage):
+    clock = FakeClock()
+    consumer = _consumer(tmp_path, storage, clock)
+
+    storage.load_features([_feature("dev", "2025-01-01", "09-00", "2025-01-01T09:30:00")])
+    assert asyncio.run(consumer.poll_once()) == 1
+    clock.now = 5
+    storage.load_features([_feature("dev", "2025-01-01", "09-30", "2025-01-01T10:00:00")])
+    assert asyncio.run(consumer.poll_once()) == 1
+
+    # 最後の更新から10秒経過するまでは集計しない
+    clock.now = 12
+    assert asyncio.run(consumer.flush()) == 0
+    assert consumer.debouncer.coalesced(("dev", "2025-01-01")) == 2
+    assert (tmp_path / "watermark").read_text() == "2025-01-01T09:30:00"
+
+    clock.now = 15
+    assert asyncio.run(consumer.flush()) == 1
+    row = _stored(storage, "dev", "2025-01-01")
+    assert row["behavior_aggregator_result"]["09-30"]
+    assert (tmp_path / "watermark").read_text() == "2025-01-01T10:00:00"
+
+
+def test_rows_at_watermark_are_not_reprocessed(tmp_path, storage):
+    clock = FakeClock()
+    storage.load_features([
+        _feature("dev", "2025-01-01", "09-00", "2025-01-01T09:30:00"),
+        _feature("dev", "2025-01-02", "09-00", "2025-01-01T09:30:00"),
+    ])
+    consumer = _consumer(tmp_path, storage, clock)
+
+    assert asyncio.run(consumer.poll_once()) == 2
+    assert asyncio.run(consumer.flush(force=True)) == 2
+    assert asyncio.run(consumer.poll_once()) == 0
+
+    # 再起動後も保存したウォーターマークから再開する
+    restarted = _consumer(tmp_path, storage, clock)
+    assert restarted.watermark == "2025-01-01T09:30:00"
+    storage.load_features([_feature("dev", "2025-01-02", "09-30", "2025-01-02T10:00:00")])
+    asyncio.run(restarted.poll_once())
+    assert ("dev", "2025-01-02") in restarted.debouncer
+    assert ("dev", "2025-01-01") in restarted.debouncer  # 同時刻の行は再起動時に一度だけ再取得される
+
+
+def test_more_rows_than_a_page_at_one_timestamp(tmp_path, storage):
+    clock = FakeClock()
+    dates = [f"2025-01-{day:02d}" for day in range(1, 8)]
+    storage.load_features([_feature(device_id, date, "09-00", "2025-01-08T00:00:00")
+                           for device_id in ("dev-a", "dev-b") for date in dates])
+    consumer = _consumer(tmp_path, storage, clock, page_size=3)
+
+    # 同時刻の行がページより多くても、キーセットで続きを取得して全て取り込む
+    assert asyncio.run(consumer.poll_once()) == 14
+    assert len(consumer.debouncer) == 14
+    assert asyncio.run(consumer.poll_once()) == 0
+
+    storage.load_features([_feature("dev-b", "2025-01-09", "09-00", "2025-01-08T00:00:00")])
+    assert asyncio.run(consumer.poll_once()) == 1
+
+    assert asyncio.run(consumer.flush(force=True)) == 15
+    assert all(_stored(storage, device_id, date) for device_id in ("dev-a", "dev-b") for date in dates)
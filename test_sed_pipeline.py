@@ -0,0 +1,73 @@
+"""
+パイプライン集計のテスト（MemoryStorage使用、ネットワーク不要）
+"""
+
+import asyncio
+
+from benchmarks.synthetic import SPARSE_DAY, generate_rows
+from sed_aggregator import SEDAggregator
+from sed_pipeline import AggregationPipeline, date_range
+from storage import MemoryStorage
+
+
+class CountingStorage(MemoryStorage):
+    """UPSERTの回数を数え、指定したデバイスの保存を失敗させる"""
+
+    def __init__(self, failing_device=None):
+        super().__init__()
+        self.upsert_calls = 0
+        self.failing_device = failing_device
+
+    async def upsert_results_if(self, rows, expected):
+        self.upsert_calls += 1
+        if any(row['device_id'] == self.failing_device for row in rows):
+            raise RuntimeError("upsert failed")
+        return await super().upsert_results_if(rows, expected)
+
+
+def test_pipeline_aggregates_and_batches_saves():
+    dates = date_range("2025-01-01", "2025-01-05")
+    storage = CountingStorage()
+    storage.load_features(generate_rows(["dev-a", "dev-b"], dates, SPARSE_DAY))
+    keys = [(device_id, date) for device_id in ["dev-a", "dev-b", "dev-empty"] for date in dates]
+
+    pipeline = AggregationPipeline(SEDAggregator(storage), fetch_batch=3, save_batch=4, queue_size=2)
+    summary = asyncio.run(pipeline.run(keys))
+
+    assert summary["aggregated"] == 10
+    assert summary["no_data"] == 5
+    assert summary["failed"] == []
+    assert set(storage.results) == {(device_id, date) for device_id in ["dev-a", "dev-b"] for date in dates}
+    assert storage.upsert_calls == summary["upserts"] < 10
+
+
+def test_pipeline_reports_failed_saves():
+    dates = date_range("2025-01-01", "2025-01-02")
+    storage = CountingStorage(failing_device="dev-b")
+    storage.load_features(generate_rows(["dev-a", "dev-b"], dates, SPARSE_DAY))
+    keys = [(device_id, date) for device_id in ["dev-a", "dev-b"] for date in dates]
+
+    summary = asyncio.run(AggregationPipeline(SEDAggregator(storage), fetch_batch=2, save_batch=1).run(keys))
+
+    assert summary["aggregated"] == 2
+    assert {(f["device_id"], f["date"]) for f in summary["failed"]} == {("dev-b", date) for date in dates}
+    assert all(f["reason"] == "storage_error" for f in summary["failed"])
+
+
+def test_rerun_skips_unchanged_writes():
+    dates = date_range("2025-01-01", "2025-01-03")
+    storage = CountingStorage()
+    storage.load_features(generate_rows(["dev-a"], dates, SPARSE_DAY))
+    keys = [("dev-a", date) for date in dates]
+
+    first = asyncio.run(AggregationPipeline(SEDAggregator(storage), save_batch=10).run(keys))
+    assert (first["written"], first["skipped"]) == (3, 0)
+    calls = storage.upsert_calls
+
+    # 新しいインスタンス（キャッシュなし）でも保存済みのハッシュと比較して書き込まない
+    storage.load_features([{**generate_rows(["dev-a"], ["2025-01-02"], SPARSE_DAY)[0],
+                            "behavior_extractor_result": [{"time": 0.0, "events": [{"label": "Dog", "score": 0.9}]}]}])
+    second = asyncio.run(AggregationPipeline(SEDAggregator(storage), save_batch=10).run(keys))
+    assert (second["aggregated"], second["written"], second["skipped"]) == (3, 1, 2)
+    assert storage.upsert_calls == calls + 1
+    assert asyncio.run(SEDAggregator(storage).run("dev-a", "2025-01-01"))["written"] is False
@@ -0,0 +1,71 @@
+"""
+ルール変更時の選択的再集計のテスト（MemoryStorage使用、ネットワーク不要）
+"""
+
+import asyncio
+
+from anomaly import AnomalyDetector
+from sed_aggregator import SEDAggregator
+from sed_reaggregator import SelectiveReaggregator, is_affected
+from sed_rules import compile_rules
+from storage import MemoryStorage
+
+OLD_RULES = compile_rules({"version": "1"})
+NEW_RULES = compile_rules({"version": "2", "excluded_events": ["Cough"]})
+
+
+def _feature(date, *labels):
+    return {"device_id": "dev", "date": date, "time_block": "09-00",
+            "behavior_extractor_result": [{"time": 0.0, "events": [{"label": label, "score": 0.9}
+                                                                   for label in labels]}],
+            "behavior_extractor_processed_at": f"{date}T09:10:00"}
+
+
+def test_is_affected_compares_recorded_labels():
+    assert is_affected(None, NEW_RULES)  # ラベル記録のない行は常に対象
+    assert not is_affected({"Speech": "Speech", "Dog": "Dog"}, NEW_RULES)
+    assert is_affected({"Speech": "Speech", "Cough": "Cough"}, NEW_RULES)  # 新しく除外される
+    assert is_affected({"Snake": None}, NEW_RULES)  # 除外されなくなる
+
+
+def test_only_affected_rows_are_reaggregated():
+    storage = MemoryStorage()
+    storage.load_features([_feature("2025-01-01", "Speech", "Cough"), _feature("2025-01-02", "Speech"),
+                           _feature("2025-01-03", "Dog")])
+    aggregator = SEDAggregator(storage, detector=AnomalyDetector())
+    for date in ("2025-01-01", "2025-01-02", "2025-01-03"):
+        asyncio.run(aggregator.run("dev", date, OLD_RULES))
+    before = {key: dict(row) for key, row in storage.results.items()}
+    baseline = dict(storage.baselines["dev"])
+
+    progress = []
+    reaggregator = SelectiveReaggregator(aggregator, concurrency=2, progress=lambda *p: progress.append(p))
+    summary = asyncio.run(reaggregator.run(NEW_RULES))
+
+    assert summary == {"rules_version": "2", "stale": 3, "reaggregated": 1, "restamped": 2, "failed": []}
+    assert progress[0] == (0, 3) and progress[-1] == (3, 3)
+    assert all(row["behavior_aggregator_rules_version"] == "2" for row in storage.results.values())
+
+    # 影響のある行は新しいルールで集計し直す
+    reaggregated = storage.results[("dev", "2025-01-01")]
+    assert [item["event"] for item in reaggregated["behavior_aggregator_result"]["09-00"]] == ["Speech"]
+    assert reaggregated["behavior_aggregator_labels"] == {"Cough": None, "Speech": "Speech"}
+
+    # 影響のない行はルールバージョンのみ更新（集計結果・更新時刻はそのまま）
+    for date in ("2025-01-02", "2025-01-03"):
+        row = storage.results[("dev", date)]
+        assert row == {**before[("dev", date)], "behavior_aggregator_rules_version": "2"}
+
+    # 再集計では異常検出のベースラインを進めない
+    assert storage.baselines["dev"] == baseline
+
+    assert asyncio.run(reaggregator.run(NEW_RULES))["stale"] == 0
+
+    # ルールバージョンのみ更新した行は、新しいルールで再実行しても書き直さない
+    writes = []
+    aggregator.write_hooks = [writes.extend]
+    for date in ("2025-01-02", "2025-01-03"):
+        asyncio.run(aggregator.run("dev", date, NEW_RULES))
+    assert writes == []
+    assert storage.results[("dev", "2025-01-02")] == {**before[("dev", "2025-01-02")],
+                                                       "behavior_aggregator_rules_version": "2"}
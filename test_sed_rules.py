@@ -0,0 +1,80 @@
+"""
+集計ルールのコンパイルと再読み込みのテスト
+"""
+
+import json
+import logging
+import os
+
+from sed_rules import BUILTIN_RULES_VERSION, RulesRegistry, compile_rules
+
+
+def _write(path, version, mtime, **source):
+    path.write_text(json.dumps({"version": version, **source}), encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+def test_rules_are_compiled_into_lookups():
+    rules = compile_rules({
+        "version": "1",
+        "excluded_events": ["Snake", "White*"],
+        "consolidation": {"Water tap, faucet": "Water sounds", "Walk*": "Footsteps"},
+        "consolidation_regex": [["^Child .*$", "Child speech"]],
+        "priority_categories": {"biometric": ["Cough"], "voice": ["Speech", "Cough"]},
+    })
+
+    assert [rules.map_label(label) for label in ("Snake", "White noise", "Walk, footsteps", "Child singing",
+                                                 "Water tap, faucet", "Speech")] == \
+        [None, None, "Footsteps", "Child speech", "Water sounds", "Speech"]
+    assert rules.apply_counts({"Snake": 1, "Walk": 2, "Walk, footsteps": 3, "Speech": 1}) == \
+        {"Footsteps": 5, "Speech": 1}
+    # 先に定義されたカテゴリーを優先し、未定義は other
+    assert rules.category("Cough") == "biometric"
+    assert rules.category("Dog") == "other"
+    assert rules.priority_order == ("biometric", "voice", "other")
+
+
+def test_file_changes_are_picked_up_by_mtime(tmp_path):
+    path = tmp_path / "rules.json"
+    _write(path, "1", 1000)
+    registry = RulesRegistry(path, check_interval=0)
+    first = registry.get()
+    assert first.version == "1"
+
+    # 更新時刻が変わらなければ読み直さない
+    path.write_text(json.dumps({"version": "ignored"}), encoding="utf-8")
+    os.utime(path, (1000, 1000))
+    assert registry.get() is first
+
+    _write(path, "2", 2000, excluded_events=["Speech"])
+    assert registry.get().version == "2"
+    assert registry.get().map_label("Speech") is None
+
+    # ファイルが削除された場合は組み込みのルール（何もしない）に戻る
+    path.unlink()
+    assert registry.get().version == BUILTIN_RULES_VERSION
+
+
+def test_file_is_checked_only_every_interval(tmp_path):
+    path = tmp_path / "rules.json"
+    _write(path, "1", 1000)
+    registry = RulesRegistry(path, check_interval=3600)
+
+    _write(path, "2", 2000)
+    assert registry.get().version == "1"
+    assert registry.reload().version == "2"
+
+
+def test_broken_file_keeps_current_rules(tmp_path, caplog):
+    path = tmp_path / "rules.json"
+    _write(path, "1", 1000)
+    registry = RulesRegistry(path, check_interval=0)
+
+    path.write_text("{not json", encoding="utf-8")
+    os.utime(path, (2000, 2000))
+    with caplog.at_level(logging.WARNING, logger="sed_rules"):
+        assert registry.get().version == "1"
+    assert caplog.records[-1].fields["path"] == str(path)
+
+    _write(path, "1", 3000, consolidation_regex=[["(", "broken"]])
+    assert registry.get().version == "1"
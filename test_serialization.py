@@ -0,0 +1,62 @@
+"""
+JSONシリアライズ（orjson と標準ライブラリのフォールバック）のテスト
+"""
+
+import pytest
+
+import serialization
+from benchmarks.synthetic import TYPICAL_DAY, generate_day
+from sed_aggregator import SEDAggregator, result_hash
+from storage import MemoryStorage
+
+VALUES = {
+    "label": "話し声 / Speech \"quoted\"\n",
+    "counts": {"b": 2, "a": 1},
+    "floats": [0.1, 1.5, 1e-05, 1e-07, 1.5e+16, 123456789.123, -0.0],
+    "flags": [True, False, None],
+    "nested": [{"z": [], "y": {}}],
+}
+
+pytestmark = pytest.mark.skipif(not serialization.ORJSON_AVAILABLE, reason="orjsonが未インストール")
+
+
+@pytest.fixture
+def stdlib(monkeypatch):
+    """orjsonが無い環境と同じ動作にする"""
+    def use_stdlib():
+        monkeypatch.setattr(serialization, "orjson", None)
+    return use_stdlib
+
+
+def _day_result():
+    aggregator = SEDAggregator(MemoryStorage())
+    return aggregator.aggregate_data(generate_day(TYPICAL_DAY))
+
+
+def test_dumps_round_trips_to_the_same_values(stdlib):
+    with_orjson = serialization.dumps(VALUES)
+    stdlib()
+    without = serialization.dumps(VALUES)
+
+    assert serialization.loads(with_orjson) == serialization.loads(without)
+    assert "話し声".encode("utf-8") in with_orjson and "話し声".encode("utf-8") in without
+
+
+@pytest.mark.parametrize("value", [VALUES, "day_result"])
+def test_canonical_dumps_is_the_same_with_and_without_orjson(stdlib, value):
+    value = _day_result() if value == "day_result" else value
+    with_orjson = serialization.canonical_dumps(value)
+    stdlib()
+    assert serialization.canonical_dumps(value) == with_orjson
+
+
+def test_canonical_dumps_ignores_key_order():
+    assert serialization.canonical_dumps({"b": 1, "a": {"d": 2, "c": 3}}) == \
+        serialization.canonical_dumps({"a": {"c": 3, "d": 2}, "b": 1}) == b'{"a":{"c":3,"d":2},"b":1}'
+
+
+def test_result_hash_does_not_depend_on_orjson(stdlib):
+    result = {**_day_result(), "anomalies": [{"event": "Cough", "slot": "09-00", "z": 1e-07}]}
+    expected = result_hash(result)
+    stdlib()
+    assert result_hash(result) == expected
@@ -0,0 +1,152 @@
+"""
+スロット別バージョンと条件付き保存のテスト（MemoryStorage / SQLiteStorage使用、ネットワーク不要）
+
+遅れて終わった古い集計・並行する集計が、新しいデータの集計結果を上書きしないことを確認する。
+"""
+
+import asyncio
+
+from sed_aggregator import SEDAggregator
+from sed_rules import compile_rules, get_rules
+from storage import MemoryStorage, SQLiteStorage
+
+DEVICE, DATE = "dev", "2025-01-01"
+
+
+def _frames(label):
+    return [{"time": 0.0, "events": [{"label": label, "score": 0.9}]}]
+
+
+def _feature(slot, label, processed_at):
+    return {"device_id": DEVICE, "date": DATE, "time_block": slot,
+            "behavior_extractor_result": _frames(label), "behavior_extractor_processed_at": processed_at}
+
+
+def _save(aggregator, slot_data):
+    async def save():
+        result = await aggregator.aggregate(slot_data)
+        return await aggregator.save_to_supabase(result, DEVICE, DATE)
+    return asyncio.run(save())
+
+
+def _stored_events(storage):
+    row = asyncio.run(storage.fetch_result(DEVICE, DATE))
+    return {slot: [item["event"] for item in events]
+            for slot, events in row["behavior_aggregator_result"].items() if events}
+
+
+def test_late_older_run_does_not_overwrite_newer_result():
+    for storage in (MemoryStorage(), SQLiteStorage(":memory:")):
+        storage.load_features([_feature("08-00", "Speech", "2025-01-01T08:10:00")])
+        stale = asyncio.run(storage.fetch_slots(DEVICE, DATE))
+
+        # 古いデータを読んだ集計が終わる前に、スロットが再処理されて新しい集計が保存される
+        storage.load_features([_feature("08-00", "Cough", "2025-01-01T09:00:00")])
+        assert asyncio.run(SEDAggregator(storage).run(DEVICE, DATE))["written"] is True
+
+        assert _save(SEDAggregator(storage), stale) is False
+        assert _stored_events(storage) == {"08-00": ["Cough"]}
+        row = asyncio.run(storage.fetch_result(DEVICE, DATE))
+        assert row["behavior_aggregator_slot_versions"] == {"08-00": "2025-01-01T09:00:00"}
+
+
+def test_newer_slots_are_merged_per_slot():
+    storage = MemoryStorage()
+    storage.load_features([_feature("08-00", "Speech", "2025-01-01T08:10:00"),
+                           _feature("09-00", "Speech", "2025-01-01T09:10:00")])
+    first = asyncio.run(storage.fetch_slots(DEVICE, DATE))
+
+    storage.load_features([_feature("09-00", "Cough", "2025-01-01T12:00:00")])
+    asyncio.run(SEDAggregator(storage).run(DEVICE, DATE))
+
+    # 08-00 だけ新しいデータを読んだ集計（09-00 は古い）が遅れて保存される
+    late = asyncio.run(storage.fetch_slots(DEVICE, DATE))
+    late["09-00"], late.versions["09-00"] = first["09-00"], first.versions["09-00"]
+    late["08-00"] = _frames("Laughter")
+    late.versions["08-00"] = "2025-01-01T13:00:00"
+
+    assert _save(SEDAggregator(storage), late) is True
+    assert _stored_events(storage) == {"08-00": ["Laughter"], "09-00": ["Cough"]}
+    row = asyncio.run(storage.fetch_result(DEVICE, DATE))
+    assert row["behavior_aggregator_slot_versions"] == {"08-00": "2025-01-01T13:00:00",
+                                                        "09-00": "2025-01-01T12:00:00"}
+    assert {"Speech", "Laughter", "Cough"} <= set(row["behavior_aggregator_labels"])
+
+
+def test_newer_slots_under_other_rules_are_reaggregated():
+    storage = MemoryStorage()
+    storage.load_features([_feature("08-00", "Speech", "2025-01-01T08:10:00"),
+                           _feature("09-00", "Speech", "2025-01-01T09:10:00")])
+    first = asyncio.run(storage.fetch_slots(DEVICE, DATE))
+
+    # 09-00 の新しいデータが別のルールで集計・保存される（スロット単位では取り込めない）
+    storage.load_features([_feature("09-00", "Cough", "2025-01-01T12:00:00")])
+    other_rules = compile_rules({"version": "other", "consolidation": {"Cough": "Coughing"}})
+    asyncio.run(SEDAggregator(storage).run(DEVICE, DATE, other_rules))
+
+    storage.load_features([_feature("08-00", "Laughter", "2025-01-01T13:00:00")])
+    late = asyncio.run(storage.fetch_slots(DEVICE, DATE))
+    late["09-00"], late.versions["09-00"] = first["09-00"], first.versions["09-00"]
+
+    # 破棄せず、データを読み直して現在のルールで集計し直す
+    assert _save(SEDAggregator(storage), late) is True
+    assert _stored_events(storage) == {"08-00": ["Laughter"], "09-00": ["Cough"]}
+    row = asyncio.run(storage.fetch_result(DEVICE, DATE))
+    assert row["behavior_aggregator_rules_version"] == get_rules().version
+    assert row["behavior_aggregator_slot_versions"] == {"08-00": "2025-01-01T13:00:00",
+                                                        "09-00": "2025-01-01T12:00:00"}
+
+
+class RacingStorage(MemoryStorage):
+    """race=True の場合、次の条件付き書き込みの直前に別の集計（より新しいデータ）の書き込みを割り込ませる"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.race = False
+
+    async def upsert_results_if(self, rows, expected):
+        self.calls += 1
+        if self.race:
+            self.race = False
+            self.load_features([_feature("08-00", "Cough", "2025-01-01T09:00:00")])
+            await SEDAggregator(self).run(DEVICE, DATE)
+        return await super().upsert_results_if(rows, expected)
+
+
+def test_conflicting_write_is_retried_against_newer_state():
+    storage = RacingStorage()
+    storage.load_features([_feature("08-00", "Speech", "2025-01-01T08:10:00")])
+    aggregator = SEDAggregator(storage)
+    # 保存済みの行がある状態から始める（キャッシュ済みの指紋が古くなる）
+    asyncio.run(aggregator.run(DEVICE, DATE))
+    storage.load_features([_feature("08-00", "Speech", "2025-01-01T08:20:00")])
+    stale = asyncio.run(storage.fetch_slots(DEVICE, DATE))
+
+    storage.race = True
+    assert _save(aggregator, stale) is False
+    assert storage.calls == 3  # 最初の保存、競合した保存、割り込んだ保存（読み直した後は古いため書き込まない）
+    assert _stored_events(storage) == {"08-00": ["Cough"]}
+
+
+def test_conditional_upsert_compares_written_at():
+    for storage in (MemoryStorage(), SQLiteStorage(":memory:")):
+        row = {"device_id": DEVICE, "date": DATE, "behavior_aggregator_processed_at": "t1"}
+        assert asyncio.run(storage.upsert_results_if([row], [None])) == []
+        assert asyncio.run(storage.upsert_results_if([row], [None])) == [(DEVICE, DATE)]
+
+        newer = {**row, "behavior_aggregator_processed_at": "t2"}
+        assert asyncio.run(storage.upsert_results_if([newer], ["t0"])) == [(DEVICE, DATE)]
+        assert asyncio.run(storage.upsert_results_if([newer], ["t1"])) == []
+        assert asyncio.run(storage.fetch_result(DEVICE, DATE))["behavior_aggregator_processed_at"] == "t2"
+
+
+def test_row_without_aggregate_counts_as_unsaved():
+    # audio_aggregator は共有テーブルのため、集計結果のない（processed_at が NULL の）行がある
+    for storage in (MemoryStorage(), SQLiteStorage(":memory:")):
+        other = {"device_id": DEVICE, "date": DATE, "behavior_aggregator_processed_at": None}
+        assert asyncio.run(storage.upsert_results_if([other], [None])) == []
+
+        row = {**other, "behavior_aggregator_processed_at": "t1"}
+        assert asyncio.run(storage.upsert_results_if([row], [None])) == []
+        assert asyncio.run(storage.fetch_result(DEVICE, DATE))["behavior_aggregator_processed_at"] == "t1"
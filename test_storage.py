@@ -0,0 +1,119 @@
+"""
+ローカルの保存先（MemoryStorage / SQLiteStorage）のテスト（ネットワーク不要）
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from anomaly import AnomalyDetector
+from benchmarks.synthetic import SPARSE_DAY, generate_rows
+from sed_aggregator import SEDAggregator
+from storage import MemoryStorage, SQLiteStorage
+
+DEVICE, DATE = "dev", "2025-01-01"
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def storage(request):
+    return MemoryStorage() if request.param == "memory" else SQLiteStorage(":memory:")
+
+
+def _row(**values):
+    return {"device_id": DEVICE, "date": DATE, "behavior_aggregator_rules_version": "1",
+            "behavior_aggregator_labels": {"Speech": "Speech"}, "behavior_aggregator_processed_at": "t1", **values}
+
+
+def test_update_result_replaces_only_given_columns(storage):
+    asyncio.run(storage.upsert_results_if([_row()], [None]))
+    asyncio.run(storage.update_result(DEVICE, DATE, {"behavior_aggregator_rules_version": "2",
+                                                     "behavior_aggregator_labels": {"Cough": None}}))
+
+    assert asyncio.run(storage.fetch_result(DEVICE, DATE)) == _row(behavior_aggregator_rules_version="2",
+                                                                   behavior_aggregator_labels={"Cough": None})
+    assert asyncio.run(storage.fetch_stale_results("1", 0, 10))[0]["device_id"] == DEVICE
+    assert asyncio.run(storage.fetch_stale_results("2", 0, 10)) == []
+
+    # 保存されていない行は作らない
+    asyncio.run(storage.update_result(DEVICE, "2025-01-02", {"behavior_aggregator_rules_version": "2"}))
+    assert asyncio.run(storage.fetch_result(DEVICE, "2025-01-02")) is None
+
+
+def test_concurrent_updates_of_different_columns_are_not_lost(monkeypatch):
+    storage = SQLiteStorage(":memory:")
+    columns = [f"column_{i}" for i in range(20)]
+    asyncio.run(storage.upsert_results_if([_row(**{column: "old" for column in columns})], [None]))
+    # 読み込みの後に他のスレッドが割り込みやすくする（読み込みと書き込みが別だと更新が失われる）
+    fetch_result = storage._fetch_result
+
+    def slow_fetch_result(*args):
+        row = fetch_result(*args)
+        time.sleep(0.01)
+        return row
+    monkeypatch.setattr(storage, "_fetch_result", slow_fetch_result)
+
+    threads = [threading.Thread(target=lambda c=column: asyncio.run(storage.update_result(DEVICE, DATE, {c: "new"})))
+               for column in columns]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    row = asyncio.run(storage.fetch_result(DEVICE, DATE))
+    assert {column: row.get(column) for column in columns} == {column: "new" for column in columns}
+
+
+DEVICES = ["dev-a", "dev-b"]
+DATES = ["2025-01-01", "2025-01-02", "2025-01-03"]
+
+
+async def _collect(iterator):
+    return [item async for item in iterator]
+
+
+def _snapshot(storage):
+    """全ての読み込み方法の結果（更新時刻は実行ごとに変わるため除く）"""
+    keys = [(device_id, date) for device_id in DEVICES for date in DATES] + [("dev-missing", DATES[0])]
+
+    def without_written_at(row):
+        return {key: value for key, value in row.items() if key != "behavior_aggregator_processed_at"}
+
+    async def read():
+        slots = await storage.fetch_many(keys)
+        return {
+            "slots": {key: (dict(data), getattr(data, "versions", {})) for key, data in slots.items()},
+            "iter_slots": [(key, dict(data)) for key, data in await _collect(storage.iter_slots(keys))],
+            "updates": await storage.fetch_feature_updates(None, 1000),
+            "results": {key: without_written_at(row) for key in keys
+                        if (row := await storage.fetch_result(*key)) is not None},
+            "fingerprints": {key: fingerprint._replace(written_at=None)
+                             for key, fingerprint in (await storage.fetch_fingerprints(keys)).items()},
+            "stale": [await storage.fetch_stale_results("other", offset, 2) for offset in (0, 2, 4, 6)],
+            "profiles": await storage.fetch_profiles("dev-a"),
+            "pages": await _collect(storage.iter_result_pages(DATES[1], DATES[2], ["dev-b"], page_size=1)),
+            "baseline": await storage.fetch_baseline("dev-a"),
+        }
+    return asyncio.run(read())
+
+
+def test_memory_and_sqlite_storage_behave_the_same():
+    rows = generate_rows(DEVICES, DATES, SPARSE_DAY)
+    for i, row in enumerate(rows):
+        row["behavior_extractor_processed_at"] = f"{row['date']}T{row['time_block'].replace('-', ':')}:{i % 60:02d}"
+
+    snapshots = []
+    for storage in (MemoryStorage(), SQLiteStorage(":memory:")):
+        storage.load_features(rows)
+        aggregator = SEDAggregator(storage, detector=AnomalyDetector())
+        for device_id in DEVICES:
+            for date in DATES:
+                assert asyncio.run(aggregator.run(device_id, date))["written"] is True
+        asyncio.run(storage.update_result("dev-a", DATES[0], {"behavior_aggregator_rules_version": "old"}))
+        snapshots.append(_snapshot(storage))
+
+    memory, sqlite = snapshots
+    assert memory["results"] and memory["profiles"] and memory["pages"] and memory["baseline"]
+    for name in memory:
+        assert memory[name] == sqlite[name], name
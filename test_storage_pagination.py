@@ -0,0 +1,101 @@
+"""
+audio_featuresのページ分割取得のテスト
+
+offset / limit と count=exact に対応したPostgREST互換スタブに対して、
+SupabaseStorage.iter_slots / fetch_many がページをまたいでデバイス・日付単位に正しくまとめることを確認する。
+"""
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from benchmarks.synthetic import SPARSE_DAY, generate_rows
+from resilience import ResiliencePolicy, StorageError
+from storage import SupabaseStorage
+
+DUMMY_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.abc"
+
+DEVICES = ["dev-a", "dev-b"]
+DATES = ["2025-01-01", "2025-01-02"]
+
+
+class PagingPostgREST:
+    """rows を device_id, date, time_block 順に offset / limit で返すスタブ（max_rows で切り詰め）"""
+
+    def __init__(self, rows, max_rows=1000):
+        self.rows = sorted(rows, key=lambda r: (r['device_id'], r['date'], r['time_block']))
+        self.max_rows = max_rows
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                params = parse_qs(urlparse(self.path).query)
+                offset = int(params.get('offset', ['0'])[0])
+                limit = min(int(params.get('limit', ['1000'])[0]), stub.max_rows)
+                page = stub.rows[offset:offset + limit]
+                payload = json.dumps(page).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                if 'count=exact' in self.headers.get('Prefer', ''):
+                    self.send_header('Content-Range', f"{offset}-{offset + len(page) - 1}/{len(stub.rows)}")
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+def _storage(stub, page_size):
+    storage = SupabaseStorage(stub.url, DUMMY_KEY, ResiliencePolicy(timeout=2, attempts=1))
+    storage.page_size = page_size
+    return storage
+
+
+@pytest.fixture
+def rows():
+    return generate_rows(DEVICES, DATES, SPARSE_DAY)
+
+
+def test_pages_are_grouped_by_device_day(rows):
+    stub = PagingPostgREST(rows)
+    storage = _storage(stub, page_size=50)
+    keys = [(device_id, date) for device_id in DEVICES for date in DATES]
+
+    async def collect():
+        return [key async for key, _ in storage.iter_slots(keys)]
+
+    assert asyncio.run(collect()) == keys
+    assert stub.requests == -(-len(rows) // 50)
+
+    results = asyncio.run(storage.fetch_many(keys))
+    for device_id, date in keys:
+        expected = {r['time_block'] for r in rows
+                    if (r['device_id'], r['date']) == (device_id, date) and r['behavior_extractor_result']}
+        assert set(results[(device_id, date)]) == expected
+
+    # 同じラベルはページ・デバイスをまたいで1つの文字列オブジェクトを共有する
+    labels = [event['label'] for slots in results.values() for frames in slots.values()
+              for frame in frames for event in frame['events']]
+    assert len({id(label) for label in labels}) == len(set(labels))
+    stub.server.shutdown()
+
+
+def test_truncated_pages_are_an_error(rows):
+    stub = PagingPostgREST(rows, max_rows=20)
+    storage = _storage(stub, page_size=50)
+
+    with pytest.raises(StorageError) as error:
+        asyncio.run(storage.fetch_many([("dev-a", "2025-01-01")]))
+    assert error.value.reason == "rejected"
+    stub.server.shutdown()